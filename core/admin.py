@@ -1,8 +1,15 @@
-from django.contrib import admin
+from django import forms
+from django.contrib import admin, messages
 
+from rest_framework.exceptions import APIException
+
+from . import orders, payments, stock
+from .audit import audit_writer, snapshot
 from .models import (
 	Client,
 	Wallet,
+	WalletEntry,
+	WalletCheckpoint,
 	Payment,
 	PaymentStatusHistory,
 	GasBottleType,
@@ -19,28 +26,152 @@ from .models import (
 	BusAlert,
 	ActivityLog,
 	ClientOrder,
+	StockMovement,
 )
 
 
+class AuditedModelAdmin(admin.ModelAdmin):
+	"""ModelAdmin qui journalise les créations, modifications et suppressions dans ActivityLog."""
+
+	def get_object(self, request, object_id, from_field=None):
+		obj = super().get_object(request, object_id, from_field)
+		if obj is not None:
+			# État avant application du formulaire, pour le diff à l'enregistrement
+			obj._audit_before = snapshot(obj)
+		return obj
+
+	def save_model(self, request, obj, form, change):
+		super().save_model(request, obj, form, change)
+		if change:
+			audit_writer.log_changes(
+				obj,
+				getattr(obj, "_audit_before", {}),
+				prefix="Modification via l'admin",
+				user=request.user,
+			)
+		else:
+			audit_writer.log(obj, ActivityLog.ACTION_CREATE, user=request.user)
+
+	def delete_model(self, request, obj):
+		audit_writer.log(obj, ActivityLog.ACTION_DELETE, user=request.user)
+		super().delete_model(request, obj)
+
+	def delete_queryset(self, request, queryset):
+		audit_writer.log_many(list(queryset), ActivityLog.ACTION_DELETE, user=request.user)
+		super().delete_queryset(request, queryset)
+
+
+class StockCorrectionForm(forms.ModelForm):
+	"""Formulaire d'une ligne de stock: les quantités ne se saisissent pas, elles se corrigent par écart."""
+
+	full_delta = forms.IntegerField(
+		label="Correction (pleines)",
+		required=False,
+		help_text="Écart signé, inscrit comme mouvement de correction d'inventaire.",
+	)
+	correction_note = forms.CharField(label="Motif de la correction", required=False)
+
+
+class StockCorrectionWithEmptiesForm(StockCorrectionForm):
+	empty_delta = forms.IntegerField(
+		label="Correction (vides)",
+		required=False,
+		help_text="Écart signé, inscrit comme mouvement de correction d'inventaire.",
+	)
+
+
+class StockAdmin(AuditedModelAdmin):
+	"""Stock d'un emplacement: quantités en lecture seule, corrigées par mouvement (core.stock.adjust).
+
+	Une saisie directe contournerait le journal StockMovement et ferait
+	apparaître un écart à la réconciliation.
+	"""
+
+	form = StockCorrectionWithEmptiesForm
+	location_field = ""
+	readonly_fields = ("quantity", "empty_quantity", "reserved_quantity")
+
+	def get_readonly_fields(self, request, obj=None):
+		fields = tuple(self.readonly_fields)
+		if obj is not None:
+			# Changer d'emplacement ou de type déplacerait le stock sans mouvement
+			fields += (self.location_field, "bottle_type")
+		return fields
+
+	def save_model(self, request, obj, form, change):
+		if not change:
+			super().save_model(request, obj, form, change)
+		location = getattr(obj, self.location_field)
+		note = form.cleaned_data.get("correction_note") or "Correction via l'admin"
+		for field, empty in (("full_delta", False), ("empty_delta", True)):
+			delta = form.cleaned_data.get(field)
+			if delta:
+				stock.adjust(location, obj.bottle_type, delta, empty=empty, user=request.user, note=note)
+		obj.refresh_from_db()
+
+
 @admin.register(Client)
-class ClientAdmin(admin.ModelAdmin):
+class ClientAdmin(AuditedModelAdmin):
 	list_display = ("name", "phone", "client_type", "status", "user", "created_at")
 	search_fields = ("name", "phone")
 	list_filter = ("client_type", "status")
 
 
 @admin.register(Wallet)
-class WalletAdmin(admin.ModelAdmin):
+class WalletAdmin(AuditedModelAdmin):
 	list_display = ("client", "balance_mru", "updated_at")
 	search_fields = ("client__name", "client__phone")
+	# Le solde ne bouge que par des écritures du grand livre
+	readonly_fields = ("balance_mru",)
+
+
+@admin.register(WalletEntry)
+class WalletEntryAdmin(admin.ModelAdmin):
+	list_display = ("created_at", "wallet", "entry_type", "counter_account", "amount_mru", "balance_after_mru")
+	list_filter = ("entry_type", "counter_account")
+	search_fields = ("wallet__client__name", "wallet__client__phone", "note")
+
+	def has_add_permission(self, request):
+		return False
+
+	def has_change_permission(self, request, obj=None):
+		return False
+
+	def has_delete_permission(self, request, obj=None):
+		return False
+
+
+@admin.register(WalletCheckpoint)
+class WalletCheckpointAdmin(admin.ModelAdmin):
+	list_display = ("as_of", "wallet", "balance_mru", "last_entry")
+	search_fields = ("wallet__client__name", "wallet__client__phone")
 
 
 @admin.register(Payment)
-class PaymentAdmin(admin.ModelAdmin):
+class PaymentAdmin(AuditedModelAdmin):
 	list_display = ("client", "amount_mru", "status", "created_at")
 	list_filter = ("status",)
 	search_fields = ("client__name", "client__phone")
 	inlines = []
+	# Le statut ne change que par les transitions (actions ci-dessous ou API)
+	readonly_fields = ("status", "receipt_sha256", "receipt_display", "receipt_thumbnail")
+	actions = ("validate_selected", "reject_selected")
+
+	def _decide(self, request, queryset, new_status):
+		if not payments.can_validate_payments(request.user):
+			self.message_user(request, "Seul un utilisateur financier peut valider ou rejeter un paiement.", messages.ERROR)
+			return
+		results = payments.bulk_decide(list(queryset.values_list("id", flat=True)), new_status, request.user)
+		done = sum(1 for result in results if result["result"] == payments.RESULT_OK)
+		self.message_user(request, f"{done} paiement(s) passé(s) en {new_status}, {len(results) - done} ignoré(s).")
+
+	@admin.action(description="Valider les paiements sélectionnés")
+	def validate_selected(self, request, queryset):
+		self._decide(request, queryset, Payment.VALIDATED)
+
+	@admin.action(description="Rejeter les paiements sélectionnés")
+	def reject_selected(self, request, queryset):
+		self._decide(request, queryset, Payment.REJECTED)
 
 
 @admin.register(PaymentStatusHistory)
@@ -51,35 +182,38 @@ class PaymentStatusHistoryAdmin(admin.ModelAdmin):
 
 
 @admin.register(GasBottleType)
-class GasBottleTypeAdmin(admin.ModelAdmin):
+class GasBottleTypeAdmin(AuditedModelAdmin):
 	list_display = ("name", "capacity_kg", "price_mru", "deposit_mru")
 
 
 @admin.register(ClientBottleBalance)
-class ClientBottleBalanceAdmin(admin.ModelAdmin):
+class ClientBottleBalanceAdmin(StockAdmin):
 	list_display = ("client", "bottle_type", "quantity")
 	search_fields = ("client__name", "client__phone")
+	form = StockCorrectionForm
+	location_field = "client"
+	readonly_fields = ("quantity",)
 
 
 @admin.register(Bus)
-class BusAdmin(admin.ModelAdmin):
-	list_display = ("name", "plate_number", "capacity", "max_speed_kmh")
+class BusAdmin(AuditedModelAdmin):
+	list_display = ("name", "plate_number", "capacity", "max_speed_kmh", "warehouse")
 
 
 @admin.register(Driver)
-class DriverAdmin(admin.ModelAdmin):
+class DriverAdmin(AuditedModelAdmin):
 	list_display = ("name", "phone", "bus", "user")
 	search_fields = ("name", "phone")
 
 
 @admin.register(Tour)
-class TourAdmin(admin.ModelAdmin):
+class TourAdmin(AuditedModelAdmin):
 	list_display = ("date", "sector", "bus", "driver")
 	list_filter = ("date", "sector")
 
 
 @admin.register(TourStop)
-class TourStopAdmin(admin.ModelAdmin):
+class TourStopAdmin(AuditedModelAdmin):
 	list_display = ("tour", "client", "order_index", "status")
 	list_filter = ("status",)
 	search_fields = ("client__name", "client__phone")
@@ -92,27 +226,29 @@ class BusPositionAdmin(admin.ModelAdmin):
 
 
 @admin.register(Warehouse)
-class WarehouseAdmin(admin.ModelAdmin):
+class WarehouseAdmin(AuditedModelAdmin):
 	list_display = ("name", "address", "gps_latitude", "gps_longitude", "created_at")
 	search_fields = ("name", "address")
 
 
 @admin.register(WarehouseBottleStock)
-class WarehouseBottleStockAdmin(admin.ModelAdmin):
-	list_display = ("warehouse", "bottle_type", "quantity", "updated_at")
+class WarehouseBottleStockAdmin(StockAdmin):
+	list_display = ("warehouse", "bottle_type", "quantity", "empty_quantity", "updated_at")
 	list_filter = ("warehouse", "bottle_type")
 	search_fields = ("warehouse__name", "bottle_type__name")
+	location_field = "warehouse"
 
 
 @admin.register(BusBottleStock)
-class BusBottleStockAdmin(admin.ModelAdmin):
-	list_display = ("bus", "bottle_type", "quantity", "updated_at")
+class BusBottleStockAdmin(StockAdmin):
+	list_display = ("bus", "bottle_type", "quantity", "empty_quantity", "updated_at")
 	list_filter = ("bus", "bottle_type")
 	search_fields = ("bus__name", "bottle_type__name")
+	location_field = "bus"
 
 
 @admin.register(GeofenceZone)
-class GeofenceZoneAdmin(admin.ModelAdmin):
+class GeofenceZoneAdmin(AuditedModelAdmin):
 	list_display = ("name", "center_latitude", "center_longitude", "radius_meters", "is_active")
 	list_filter = ("is_active",)
 	search_fields = ("name",)
@@ -133,7 +269,49 @@ class ActivityLogAdmin(admin.ModelAdmin):
 
 
 @admin.register(ClientOrder)
-class ClientOrderAdmin(admin.ModelAdmin):
+class ClientOrderAdmin(AuditedModelAdmin):
 	list_display = ("id", "client", "bottle_type", "quantity", "total_price_mru", "status", "created_at")
 	list_filter = ("status", "bottle_type")
 	search_fields = ("client__name", "client__phone")
+	# Le statut ne change que par les transitions (actions ci-dessous, API ou livraison)
+	readonly_fields = ("status", "delivered_at", "delivered_by")
+	actions = ("validate_selected", "cancel_selected")
+
+	def _decide(self, request, queryset, new_status):
+		if not payments.can_validate_payments(request.user):
+			self.message_user(request, "Seul un utilisateur financier peut modifier une commande.", messages.ERROR)
+			return
+		try:
+			results = orders.bulk_transition(list(queryset.values_list("id", flat=True)), new_status, request.user)
+		except APIException as exc:
+			# Lot annulé (stock insuffisant pour les réservations, ...), comme le 409 de l'API
+			self.message_user(request, f"Aucune commande modifiée: {exc.detail}", messages.ERROR)
+			return
+		done = sum(1 for result in results if result["result"] == orders.RESULT_OK)
+		self.message_user(request, f"{done} commande(s) passée(s) en {new_status}, {len(results) - done} ignorée(s).")
+
+	@admin.action(description="Valider les commandes sélectionnées")
+	def validate_selected(self, request, queryset):
+		self._decide(request, queryset, ClientOrder.VALIDATED)
+
+	@admin.action(description="Annuler les commandes sélectionnées")
+	def cancel_selected(self, request, queryset):
+		self._decide(request, queryset, ClientOrder.CANCELLED)
+
+
+@admin.register(StockMovement)
+class StockMovementAdmin(admin.ModelAdmin):
+	"""Journal des mouvements: lecture seule (corrections par mouvement d'ajustement)."""
+
+	list_display = ("created_at", "movement_type", "bottle_type", "quantity", "empty", "order", "created_by")
+	list_filter = ("movement_type", "bottle_type", "empty")
+	search_fields = ("note", "order__id")
+
+	def has_add_permission(self, request):
+		return False
+
+	def has_change_permission(self, request, obj=None):
+		return False
+
+	def has_delete_permission(self, request, obj=None):
+		return False
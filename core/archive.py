@@ -0,0 +1,270 @@
+import datetime
+import gzip
+import hashlib
+import json
+import os
+from collections import Counter, defaultdict, deque
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .models import ActivityLog
+
+
+def month_start(year: int, month: int) -> datetime.datetime:
+	"""Premier instant du mois (fuseau du projet)."""
+	return timezone.make_aware(datetime.datetime(year, month, 1))
+
+
+def next_month(year: int, month: int) -> tuple[int, int]:
+	return (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+def add_months(year: int, month: int, delta: int) -> tuple[int, int]:
+	index = year * 12 + (month - 1) + delta
+	return index // 12, index % 12 + 1
+
+
+def object_ranges(object_ids) -> dict:
+	"""Identifiants d'objets d'un modèle compactés pour l'index: plages d'entiers consécutifs et autres clés."""
+	numbers, keys = set(), set()
+	for object_id in object_ids:
+		if object_id.isdigit():
+			numbers.add(int(object_id))
+		elif object_id:
+			keys.add(object_id)
+	ranges = []
+	for number in sorted(numbers):
+		if ranges and number == ranges[-1][1] + 1:
+			ranges[-1][1] = number
+		else:
+			ranges.append([number, number])
+	return {"ranges": ranges, "keys": sorted(keys)}
+
+
+class ActivityLogArchive:
+	"""Partitions mensuelles fermées du journal d'activité.
+
+	Chaque mois archivé est un fichier ``AAAA-MM.jsonl.gz`` (une entrée par ligne,
+	triées par date croissante) accompagné d'un index ``AAAA-MM.index.json``
+	(nombre d'entrées, bornes de dates et d'id, répartition par modèle et par
+	action, objets visés par modèle en plages d'id, empreinte SHA-256). Les
+	lectures consultent d'abord les index pour n'ouvrir que les mois utiles.
+	"""
+
+	def __init__(self, root=None):
+		self.root = Path(root or getattr(settings, "ACTIVITY_LOG_ARCHIVE_DIR", settings.BASE_DIR / "var" / "activity_logs"))
+
+	def _data_path(self, year: int, month: int) -> Path:
+		return self.root / f"{year:04d}-{month:02d}.jsonl.gz"
+
+	def _index_path(self, year: int, month: int) -> Path:
+		return self.root / f"{year:04d}-{month:02d}.index.json"
+
+	def months(self) -> list[tuple[int, int]]:
+		"""Mois archivés, du plus récent au plus ancien."""
+		if not self.root.is_dir():
+			return []
+		found = []
+		for path in self.root.glob("*.index.json"):
+			try:
+				year, month = path.name[:7].split("-")
+				found.append((int(year), int(month)))
+			except ValueError:
+				continue
+		return sorted(found, reverse=True)
+
+	def read_index(self, year: int, month: int) -> dict:
+		with open(self._index_path(year, month), encoding="utf-8") as fh:
+			return json.load(fh)
+
+	def export_month(self, year: int, month: int, delete: bool = True, chunk_size: int = 2000) -> dict:
+		"""Exporte un mois fermé vers l'archive compressée puis le retire de la table.
+
+		L'écriture passe par des fichiers temporaires renommés à la fin: un export
+		interrompu ne laisse jamais de partition partielle visible.
+		"""
+		start = month_start(year, month)
+		end = month_start(*next_month(year, month))
+		rows = (
+			ActivityLog.objects.filter(created_at__gte=start, created_at__lt=end)
+			.select_related("user")
+			.order_by("created_at", "id")
+		)
+
+		self.root.mkdir(parents=True, exist_ok=True)
+		data_path = self._data_path(year, month)
+		index_path = self._index_path(year, month)
+		if index_path.exists():
+			raise FileExistsError(f"Le mois {year:04d}-{month:02d} est déjà archivé.")
+		tmp_data = data_path.with_suffix(".tmp")
+		tmp_index = index_path.with_suffix(".tmp")
+
+		digest = hashlib.sha256()
+		models_count = Counter()
+		actions_count = Counter()
+		objects = defaultdict(set)
+		count = 0
+		min_id = max_id = None
+		first_at = last_at = None
+		with gzip.open(tmp_data, "wt", encoding="utf-8") as fh:
+			for log in rows.iterator(chunk_size=chunk_size):
+				line = json.dumps(
+					{
+						"id": log.id,
+						"created_at": log.created_at.isoformat(),
+						"user_id": log.user_id,
+						"user_username": log.user.username if log.user else None,
+						"model_name": log.model_name,
+						"object_id": log.object_id,
+						"content_type_id": log.content_type_id,
+						"object_pk": log.object_pk,
+						"action": log.action,
+						"description": log.description,
+						"data": log.data,
+					},
+					cls=DjangoJSONEncoder,
+					ensure_ascii=False,
+				)
+				fh.write(line + "\n")
+				digest.update(line.encode("utf-8"))
+				models_count[log.model_name] += 1
+				objects[log.model_name].add(log.object_id)
+				actions_count[log.action] += 1
+				count += 1
+				min_id = log.id if min_id is None else min(min_id, log.id)
+				max_id = log.id if max_id is None else max(max_id, log.id)
+				first_at = first_at or log.created_at
+				last_at = log.created_at
+
+		index = {
+			"month": f"{year:04d}-{month:02d}",
+			"count": count,
+			"first_created_at": first_at.isoformat() if first_at else None,
+			"last_created_at": last_at.isoformat() if last_at else None,
+			"min_id": min_id,
+			"max_id": max_id,
+			"models": dict(models_count),
+			"actions": dict(actions_count),
+			"objects": {label: object_ranges(object_ids) for label, object_ids in objects.items()},
+			"sha256": digest.hexdigest(),
+			"archived_at": timezone.now().isoformat(),
+		}
+		with open(tmp_index, "w", encoding="utf-8") as fh:
+			json.dump(index, fh, ensure_ascii=False, indent=2)
+
+		os.replace(tmp_data, data_path)
+		os.replace(tmp_index, index_path)
+
+		if delete and count:
+			with transaction.atomic():
+				ActivityLog.objects.filter(created_at__gte=start, created_at__lt=end, id__lte=max_id).delete()
+		return index
+
+	def months_in_range(self, date_from=None, date_to=None) -> list[tuple[int, int]]:
+		"""Mois archivés recoupant l'intervalle [date_from, date_to] (dates incluses)."""
+		selected = []
+		for year, month in self.months():
+			first_day = datetime.date(year, month, 1)
+			last_day = datetime.date(*next_month(year, month), 1) - datetime.timedelta(days=1)
+			if date_to and first_day > date_to:
+				continue
+			if date_from and last_day < date_from:
+				continue
+			selected.append((year, month))
+		return selected
+
+	def months_before(self, moment=None) -> list[tuple[int, int]]:
+		"""Mois archivés entièrement antérieurs à ``moment`` (tous si None), du plus récent au plus ancien."""
+		if moment is None:
+			return self.months()
+		return [(year, month) for year, month in self.months() if month_start(*next_month(year, month)) <= moment]
+
+	def reindex_month(self, year: int, month: int) -> dict:
+		"""Ajoute les objets visés à l'index d'un mois archivé avant leur introduction (une lecture du mois)."""
+		index = self.read_index(year, month)
+		objects = defaultdict(set)
+		with gzip.open(self._data_path(year, month), "rt", encoding="utf-8") as fh:
+			for line in fh:
+				entry = json.loads(line)
+				objects[entry["model_name"]].add(entry["object_id"])
+		index["objects"] = {label: object_ranges(object_ids) for label, object_ids in objects.items()}
+		index_path = self._index_path(year, month)
+		tmp_index = index_path.with_suffix(".tmp")
+		with open(tmp_index, "w", encoding="utf-8") as fh:
+			json.dump(index, fh, ensure_ascii=False, indent=2)
+		os.replace(tmp_index, index_path)
+		return index
+
+	@staticmethod
+	def may_contain(index: dict, model: str, object_id) -> bool:
+		"""Faux si l'index garantit qu'aucune entrée du mois ne vise l'objet (vrai pour un index sans objets)."""
+		if "objects" not in index:
+			return True
+		object_id = str(object_id)
+		for label, found in index["objects"].items():
+			if label.lower() != model.lower():
+				continue
+			if object_id.isdigit():
+				number = int(object_id)
+				if any(low <= number <= high for low, high in found["ranges"]):
+					return True
+			elif object_id in found["keys"]:
+				return True
+		return False
+
+	def iter_entries(
+		self,
+		year: int,
+		month: int,
+		date_from=None,
+		date_to=None,
+		model=None,
+		action=None,
+		username=None,
+		object_id=None,
+		accept=None,
+		newest=None,
+	):
+		"""Entrées d'un mois archivé, de la plus récente à la plus ancienne, filtrées.
+
+		Le fichier est lu en flux (ordre croissant); seules les entrées retenues
+		sont gardées pour être rendues dans l'ordre inverse, au plus ``newest``
+		(les plus récentes) si donné. ``accept(entry)`` filtre en plus sur l'entrée
+		décodée (curseur de pagination, par exemple).
+		"""
+		index = self.read_index(year, month)
+		if model and not any(label.lower() == model.lower() for label in index.get("models", {})):
+			return
+		if action and action not in index.get("actions", {}):
+			return
+		if model and object_id is not None and not self.may_contain(index, model, object_id):
+			return
+
+		entries = deque(maxlen=newest)
+		with gzip.open(self._data_path(year, month), "rt", encoding="utf-8") as fh:
+			for line in fh:
+				entry = json.loads(line)
+				if model and entry["model_name"].lower() != model.lower():
+					continue
+				if action and entry["action"] != action:
+					continue
+				if object_id is not None and entry["object_id"] != str(object_id):
+					continue
+				if username and username.lower() not in (entry.get("user_username") or "").lower():
+					continue
+				created_at = parse_datetime(entry["created_at"])
+				local_day = timezone.localtime(created_at).date()
+				if date_from and local_day < date_from:
+					continue
+				if date_to and local_day > date_to:
+					continue
+				entry["created_at"] = created_at
+				if accept is not None and not accept(entry):
+					continue
+				entries.append(entry)
+		yield from reversed(entries)
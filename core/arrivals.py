@@ -0,0 +1,208 @@
+import math
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.utils import timezone
+
+from . import geo, stops
+from .models import BusPosition, DriverNotification, Tour, TourProgress, TourStop
+
+
+INDEX_KEY = "core:arrivals:tour:{}"
+
+# Hystérésis: on arrive à ARRIVAL_RADIUS_M, on ne repart qu'au double (bruit GPS)
+DEPARTURE_FACTOR = 2.0
+
+
+def _radius_m() -> float:
+	return float(getattr(settings, "ARRIVAL_RADIUS_M", 60))
+
+
+def _timeout() -> int:
+	return getattr(settings, "ARRIVAL_INDEX_TIMEOUT", 600)
+
+
+def _progress(bus_id: int, tour_id: int | None, day) -> dict | None:
+	"""Tournée du jour du bus, version de son index et présence en cours, en une requête (TourProgress)."""
+	if tour_id:
+		rows = TourProgress.objects.filter(tour_id=tour_id)
+	else:
+		rows = TourProgress.objects.filter(tour__bus_id=bus_id, tour__date=day).order_by("-tour_id")
+	return rows.values("tour_id", "updated_at", "presence_stop_id", "presence_since", "presence_seen_at").first()
+
+
+def build_index(tour_id: int) -> dict | None:
+	"""Grille des arrêts à visiter de la tournée, en deux requêtes.
+
+	Mailles de la taille du rayon de départ: les voisins d'un point sont dans
+	les 3 x 3 mailles qui l'entourent.
+	"""
+	tour = Tour.objects.filter(pk=tour_id).values("driver_id").first()
+	if tour is None:
+		return None
+	rows = (
+		TourStop.objects.filter(tour_id=tour_id, status=TourStop.PENDING)
+		.exclude(client__gps_latitude=None)
+		.exclude(client__gps_longitude=None)
+		.values_list("id", "client_id", "client__name", "client__gps_latitude", "client__gps_longitude")
+	)
+	points = {stop_id: (float(lat), float(lon), client_id, name) for stop_id, client_id, name, lat, lon in rows}
+	dlat = _radius_m() * DEPARTURE_FACTOR / 1000 / geo.KM_PER_DEGREE_LAT
+	reference = next(iter(points.values()))[0] if points else 0.0
+	dlon = dlat / max(geo.lon_scale(reference), 0.01)
+	cells = {}
+	for stop_id, (lat, lon, _, _) in points.items():
+		cells.setdefault((math.floor(lat / dlat), math.floor(lon / dlon)), []).append(stop_id)
+	return {"tour": tour_id, "driver": tour["driver_id"], "cell": (dlat, dlon), "cells": cells, "stops": points}
+
+
+def index(tour_id: int, version=None) -> dict | None:
+	"""Index de la tournée, reconstruit si ``version`` (TourProgress.updated_at) a changé.
+
+	La version vient de la base: un index périmé dans le cache local d'un autre
+	processus n'est jamais utilisé.
+	"""
+	key = INDEX_KEY.format(tour_id)
+	cached = cache.get(key)
+	if cached is not None and (version is None or cached[0] == version):
+		return cached[1]
+	data = build_index(tour_id)
+	if data is not None:
+		cache.set(key, (version, data), _timeout())
+	return data
+
+
+def invalidate(tour_ids=()):
+	"""Retire les index du cache au commit (libère la mémoire; la version suffit à les écarter)."""
+	keys = [INDEX_KEY.format(pk) for pk in tour_ids]
+	if keys:
+		transaction.on_commit(lambda: cache.delete_many(keys))
+
+
+def _distance_m(idx: dict, stop_id: int, lat: float, lon: float) -> float:
+	stop_lat, stop_lon = idx["stops"][stop_id][:2]
+	return geo.haversine_km(lat, lon, stop_lat, stop_lon) * 1000
+
+
+def nearest(idx: dict, lat: float, lon: float, radius_m: float) -> int | None:
+	"""Arrêt à visiter le plus proche à moins de ``radius_m`` (au plus le rayon de départ)."""
+	dlat, dlon = idx["cell"]
+	row, col = math.floor(lat / dlat), math.floor(lon / dlon)
+	best, best_distance = None, radius_m
+	for i in (row - 1, row, row + 1):
+		for j in (col - 1, col, col + 1):
+			for stop_id in idx["cells"].get((i, j), ()):
+				distance = _distance_m(idx, stop_id, lat, lon)
+				if distance <= best_distance:
+					best, best_distance = stop_id, distance
+	return best
+
+
+def _dwelled(state: dict) -> bool:
+	return (state["last_seen"] - state["since"]).total_seconds() >= getattr(settings, "ARRIVAL_MIN_DWELL_SECONDS", 120)
+
+
+def _arrive(idx: dict, state: dict) -> dict:
+	TourStop.objects.filter(pk=state["stop"], arrived_at__isnull=True).update(arrived_at=state["since"])
+	return {"event": "arrival", "stop": state["stop"], "arrived_at": state["since"].isoformat()}
+
+
+def _depart(idx: dict, state: dict, user) -> dict:
+	"""Départ après un arrêt suffisamment long: arrêt pointé visité, ou suggestion au chauffeur."""
+	stop_id, arrived_at, departed_at = state["stop"], state["since"], state["last_seen"]
+	TourStop.objects.filter(pk=stop_id).update(departed_at=departed_at)
+	dwell = round((departed_at - arrived_at).total_seconds())
+	event = {
+		"event": "departure",
+		"stop": stop_id,
+		"arrived_at": arrived_at.isoformat(),
+		"departed_at": departed_at.isoformat(),
+		"dwell_seconds": dwell,
+	}
+	if getattr(settings, "ARRIVAL_AUTO_COMPLETE", False):
+		result = stops.bulk_status(Tour(pk=idx["tour"]), [{"id": stop_id, "status": TourStop.COMPLETED}], user=user)[0]
+		event["completed"] = result["result"] == stops.RESULT_OK
+	elif idx["driver"]:
+		_, _, client_id, name = idx["stops"][stop_id]
+		DriverNotification.objects.create(
+			driver_id=idx["driver"],
+			kind=DriverNotification.KIND_ARRIVAL,
+			tour_id=idx["tour"],
+			stop_id=stop_id,
+			message=f"Arrêt de {max(dwell // 60, 1)} min chez {name}: confirmer la visite ?",
+			data={**event, "client": client_id},
+		)
+	return event
+
+
+def track(position, user=None) -> dict | None:
+	"""Rapproche une position reçue des arrêts à visiter de la tournée du bus.
+
+	Le bus « arrive » quand il reste ARRIVAL_MIN_DWELL_SECONDS à moins de
+	ARRIVAL_RADIUS_M d'un arrêt (``arrived_at`` renseigné) et « repart » quand
+	il s'en éloigne (``departed_at``, puis arrêt pointé visité si
+	ARRIVAL_AUTO_COMPLETE, sinon suggestion dans le fil du chauffeur).
+
+	La présence en cours est tenue sur TourProgress, partagée par tous les
+	processus: une lecture par point, et une écriture conditionnelle
+	(``UPDATE ... WHERE`` présence lue) seulement quand elle change. Si un autre
+	processus l'a modifiée entre-temps, la position est ignorée; les événements
+	ne sont écrits que par l'écriture gagnante. Seul l'index des arrêts est en
+	cache, validé par TourProgress.updated_at. Retourne l'événement éventuel.
+	"""
+	if position.status == BusPosition.STATUS_OFFLINE:
+		return None
+	now = position.created_at or timezone.now()
+	progress = _progress(position.bus_id, position.tour_id, timezone.localdate(now))
+	if progress is None:
+		return None
+	idx = index(progress["tour_id"], progress["updated_at"])
+	if idx is None:
+		return None
+	previous = {"stop": progress["presence_stop_id"], "since": progress["presence_since"], "last_seen": progress["presence_seen_at"]}
+	# Position antérieure à la présence connue (renvoi d'une file hors ligne): ignorée
+	if previous["last_seen"] is not None and now < previous["last_seen"]:
+		return None
+	lat, lon = float(position.latitude), float(position.longitude)
+	radius = _radius_m()
+	state = dict(previous) if previous["stop"] is not None else None
+	departed = None
+
+	# Arrêt pointé entre-temps (retiré de l'index): présence oubliée
+	if state and state["stop"] not in idx["stops"]:
+		state = None
+	if state:
+		if _distance_m(idx, state["stop"], lat, lon) <= radius * DEPARTURE_FACTOR:
+			state["last_seen"] = now
+		else:
+			if _dwelled(state):
+				departed = state
+			state = None
+	if state is None:
+		stop_id = nearest(idx, lat, lon, radius)
+		if stop_id is not None:
+			state = {"stop": stop_id, "since": now, "last_seen": now}
+	arrived = (
+		state is not None
+		and _dwelled(state)
+		and not (previous["stop"] == state["stop"] and previous["since"] == state["since"] and _dwelled(previous))
+	)
+
+	current = state or {"stop": None, "since": None, "last_seen": None}
+	if current == previous:
+		return None
+	with transaction.atomic():
+		updated = TourProgress.objects.filter(
+			tour_id=progress["tour_id"],
+			presence_stop_id=previous["stop"],
+			presence_since=previous["since"],
+			presence_seen_at=previous["last_seen"],
+		).update(presence_stop_id=current["stop"], presence_since=current["since"], presence_seen_at=current["last_seen"])
+		if not updated:
+			return None
+		event = _depart(idx, departed, user) if departed else None
+		if arrived:
+			arrival = _arrive(idx, state)
+			event = event or arrival
+	return event
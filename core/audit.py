@@ -0,0 +1,352 @@
+import atexit
+import logging
+import threading
+from collections import defaultdict
+from contextlib import contextmanager
+from functools import partial
+
+from django.apps import apps
+from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
+from django.db import close_old_connections, models, transaction
+
+from .models import ActivityLog
+
+
+logger = logging.getLogger(__name__)
+
+
+# Champs purement techniques, jamais rapportés comme modifiés
+IGNORED_FIELDS = frozenset({"id", "created_at", "updated_at"})
+
+
+def _identity(value):
+	return value
+
+
+def _to_str(value):
+	return None if value is None else str(value)
+
+
+def _to_isoformat(value):
+	return None if value is None else value.isoformat()
+
+
+def _file_name(value):
+	# Selon l'état de l'instance, la valeur brute est un str, un FieldFile ou un File
+	if not value:
+		return None
+	return getattr(value, "name", value) or None
+
+
+def _converter_for(field):
+	"""Convertisseur vers une valeur JSON-sérialisable pour un champ concret."""
+	if isinstance(field, models.FileField):
+		return _file_name
+	if isinstance(field, models.DecimalField):
+		return _to_str
+	if isinstance(field, (models.DateTimeField, models.DateField, models.TimeField)):
+		return _to_isoformat
+	if isinstance(field, models.UUIDField):
+		return _to_str
+	return _identity
+
+
+class AuditPlan:
+	"""Plan de capture précompilé d'un modèle: (nom, attname, convertisseur) par colonne.
+
+	La lecture passe par ``instance.__dict__`` et l'``attname`` des FK
+	(``client_id``): un instantané ne déclenche jamais de requête, et les
+	champs différés (``only()``/``defer()``) sont simplement omis.
+	"""
+
+	def __init__(self, model):
+		self.model = model
+		self.columns = tuple(
+			(field.name, field.attname, _converter_for(field)) for field in model._meta.concrete_fields
+		)
+
+	def snapshot(self, instance) -> dict:
+		values = instance.__dict__
+		return {
+			name: convert(values[attname])
+			for name, attname, convert in self.columns
+			if attname in values
+		}
+
+
+_plans = {}
+
+
+def get_plan(model) -> AuditPlan:
+	"""Retourne (et compile au premier appel) le plan d'audit du modèle."""
+	plan = _plans.get(model)
+	if plan is None:
+		plan = _plans[model] = AuditPlan(model)
+	return plan
+
+
+def snapshot(instance) -> dict:
+	"""Instantané JSON-sérialisable des colonnes de l'instance, sans requête."""
+	if instance is None:
+		return {}
+	return get_plan(type(instance)).snapshot(instance)
+
+
+def diff(before: dict, after: dict) -> dict:
+	"""Construit un dict des champs modifiés: {field: {old, new}}."""
+	changes = {}
+	for field, old in before.items():
+		if field in IGNORED_FIELDS or field not in after:
+			continue
+		new = after[field]
+		if old != new:
+			changes[field] = {"old": old, "new": new}
+	return changes
+
+
+def describe_changes(changes: dict, prefix: str = "") -> str:
+	"""Description lisible d'un diff, éventuellement précédée d'un préfixe."""
+	desc = ""
+	if changes:
+		parts = [f"{field}: '{vals['old']}' -> '{vals['new']}'" for field, vals in changes.items()]
+		desc = f"Champs modifiés: {'; '.join(parts)}"
+	if prefix:
+		return f"{prefix} | {desc}" if desc else prefix
+	return desc
+
+
+def build_description(instance, action: str) -> str:
+	"""Description lisible par défaut d'une action CRUD sur une instance."""
+	model_verbose = getattr(instance._meta, "verbose_name", instance.__class__.__name__)
+	obj_id = getattr(instance, "pk", None)
+	base = f"{model_verbose}"
+	if obj_id is not None:
+		base = f"{base} #{obj_id}"
+	if action == ActivityLog.ACTION_CREATE:
+		return f"Création de {base}"
+	if action == ActivityLog.ACTION_UPDATE:
+		return f"Mise à jour de {base}"
+	if action == ActivityLog.ACTION_DELETE:
+		return f"Suppression de {base}"
+	return f"Action {action} sur {base}"
+
+
+def _resolve_object_reference(entry):
+	"""Complète content_type / object_pk d'une entrée construite à partir des seuls libellés."""
+	try:
+		model = apps.get_model(entry.model_name)
+	except (LookupError, ValueError):
+		return
+	entry.content_type = ContentType.objects.get_for_model(model)
+	if entry.object_pk is None and entry.object_id.isdigit():
+		entry.object_pk = int(entry.object_id)
+
+
+class _AsyncBuffer:
+	"""Tampon mémoire vidé en arrière-plan par un thread démon.
+
+	La perte en cas d'arrêt brutal du processus est bornée par ``max_size``
+	entrées et ``interval`` secondes: au-delà de ``max_size``, l'appelant vide
+	lui-même le tampon (back-pressure) au lieu de jeter des entrées.
+	"""
+
+	def __init__(self, write, interval: float, max_size: int):
+		self._write = write
+		self._interval = interval
+		self._max_size = max_size
+		self._entries = []
+		self._lock = threading.Lock()
+		self._wakeup = threading.Event()
+		self._thread = None
+		# Une seule fois: le thread peut être relancé plusieurs fois (fork, arrêt)
+		atexit.register(self.flush)
+
+	def push(self, entries):
+		with self._lock:
+			self._entries.extend(entries)
+			overflow = len(self._entries) >= self._max_size
+		self._ensure_thread()
+		if overflow:
+			self.flush()
+
+	def flush(self):
+		with self._lock:
+			entries, self._entries = self._entries, []
+		if entries:
+			self._write(entries)
+
+	def _ensure_thread(self):
+		if self._thread is not None and self._thread.is_alive():
+			return
+		self._thread = threading.Thread(target=self._run, name="audit-writer", daemon=True)
+		self._thread.start()
+
+	def _run(self):
+		while True:
+			self._wakeup.wait(self._interval)
+			self._wakeup.clear()
+			try:
+				self.flush()
+			finally:
+				# Le thread possède sa propre connexion: la libérer entre deux vidages
+				close_old_connections()
+
+
+class AuditWriter:
+	"""Point d'écriture unique pour ActivityLog et PaymentStatusHistory.
+
+	Les entrées ActivityLog sont des instances non sauvegardées. Enregistrées
+	dans une transaction, elles ne sont retenues qu'au commit (abandonnées en
+	cas de rollback). Dans un lot (``batch()``, ouvert par
+	``AuditBatchMiddleware`` pour chaque requête), elles sont accumulées puis
+	écrites en un seul ``bulk_create`` par modèle, au mieux (échecs journalisés).
+
+	L'historique de statut (piste d'audit financière) ne passe pas par ce
+	chemin: ``write_history`` l'insère dans la transaction métier.
+	"""
+
+	def __init__(self):
+		self._local = threading.local()
+		self._async_buffer = None
+
+	@property
+	def async_enabled(self) -> bool:
+		return bool(getattr(settings, "AUDIT_LOG_ASYNC", False))
+
+	def record(self, entry):
+		"""Enregistre une entrée ActivityLog (écriture différée, au mieux)."""
+		batch = getattr(self._local, "batch", None)
+		sink = batch.append if batch is not None else self._flush_one
+		transaction.on_commit(partial(sink, entry))
+
+	def write_history(self, entries):
+		"""Insère un historique de statut (PaymentStatusHistory) dans la transaction en cours.
+
+		Ni différé ni tamponné: une erreur d'écriture annule l'opération métier
+		au lieu d'être seulement journalisée.
+		"""
+		entries = list(entries)
+		if entries:
+			type(entries[0]).objects.bulk_create(entries)
+		return entries
+
+	def log(self, instance, action: str, description: str = "", data: dict | None = None, user=None):
+		"""Raccourci pour journaliser une action sur une instance dans ActivityLog."""
+		if not description:
+			try:
+				description = build_description(instance, action)
+			except Exception:
+				description = ""
+		if user is not None and not getattr(user, "is_authenticated", False):
+			user = None
+		pk = getattr(instance, "pk", None)
+		self.record(
+			ActivityLog(
+				user=user,
+				model_name=instance._meta.label,
+				object_id=str(pk or ""),
+				content_type=ContentType.objects.get_for_model(instance),
+				object_pk=pk if isinstance(pk, int) else None,
+				action=action,
+				description=description,
+				data=data or None,
+			)
+		)
+
+	def log_changes(self, instance, before: dict, prefix: str = "", user=None) -> dict:
+		"""Journalise une mise à jour à partir d'un instantané pris avant la sauvegarde."""
+		changes = diff(before, snapshot(instance))
+		self.log(
+			instance,
+			ActivityLog.ACTION_UPDATE,
+			description=describe_changes(changes, prefix),
+			data={"changes": changes} if changes else None,
+			user=user,
+		)
+		return changes
+
+	def log_many(self, instances, action: str, description: str = "", user=None, data=None):
+		"""Journalise la même action sur un ensemble d'instances (opérations groupées).
+
+		``data`` peut être un dict commun ou une fonction ``instance -> dict``.
+		"""
+		with self.batch():
+			for instance in instances:
+				extra = data(instance) if callable(data) else data
+				self.log(instance, action, description=description, data=extra, user=user)
+
+	@contextmanager
+	def batch(self):
+		"""Regroupe les entrées enregistrées dans le bloc en une écriture groupée."""
+		outer = getattr(self._local, "batch", None) is None
+		if outer:
+			self._local.batch = []
+		try:
+			yield
+		finally:
+			if outer:
+				entries = self._local.batch
+				self._local.batch = None
+				# Si le bloc se termine dans une transaction, attendre son commit:
+				# les entrées différées y sont ajoutées avant ce callback.
+				transaction.on_commit(partial(self._flush, entries))
+
+	def _flush_one(self, entry):
+		self._flush([entry])
+
+	def _flush(self, entries):
+		if not entries:
+			return
+		if self.async_enabled:
+			if self._async_buffer is None:
+				self._async_buffer = _AsyncBuffer(
+					self._write,
+					interval=float(getattr(settings, "AUDIT_LOG_FLUSH_INTERVAL", 2.0)),
+					max_size=int(getattr(settings, "AUDIT_LOG_BUFFER_SIZE", 500)),
+				)
+			self._async_buffer.push(entries)
+		else:
+			self._write(entries)
+
+	def _write(self, entries):
+		by_model = defaultdict(list)
+		for entry in entries:
+			if isinstance(entry, ActivityLog) and entry.content_type_id is None:
+				_resolve_object_reference(entry)
+			by_model[type(entry)].append(entry)
+		for model, objs in by_model.items():
+			try:
+				with transaction.atomic():
+					model.objects.bulk_create(objs)
+			except Exception:
+				# Ne jamais casser l'API à cause de la journalisation; une entrée
+				# invalide ne doit pas emporter le reste du lot: reprise une à une
+				logger.exception("Échec d'écriture groupée de %d entrées %s, reprise une à une", len(objs), model._meta.label)
+				self._write_one_by_one(model, objs)
+
+	def _write_one_by_one(self, model, objs):
+		lost = 0
+		for obj in objs:
+			try:
+				with transaction.atomic():
+					model.objects.bulk_create([obj])
+			except Exception:
+				lost += 1
+				logger.exception("Entrée %s perdue: %r", model._meta.label, getattr(obj, "description", obj))
+		if lost:
+			logger.error("%d entrée(s) %s sur %d non écrite(s)", lost, model._meta.label, len(objs))
+
+
+audit_writer = AuditWriter()
+
+
+class AuditBatchMiddleware:
+	"""Ouvre un lot d'audit par requête: une seule insertion groupée en fin de requête."""
+
+	def __init__(self, get_response):
+		self.get_response = get_response
+
+	def __call__(self, request):
+		with audit_writer.batch():
+			return self.get_response(request)
@@ -0,0 +1,92 @@
+import datetime
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+
+from .audit import audit_writer
+from .models import ActivityLog, Client, ClientOrder, Payment, WalletEntry
+
+
+_MONEY = DecimalField(max_digits=14, decimal_places=2)
+
+
+def _total(queryset, group_by: str, field: str):
+	"""Somme corrélée au client courant, 0 si aucune ligne."""
+	total = queryset.values(group_by).annotate(total=Sum(field)).values("total")
+	return Coalesce(Subquery(total, output_field=_MONEY), Value(Decimal("0.00")), output_field=_MONEY)
+
+
+def annotate_due(queryset, as_of=None, grace_days: int | None = None):
+	"""Annote ``due_mru`` sur un queryset de clients, en une seule requête.
+
+	Dû = commandes validées ou livrées depuis plus de ``grace_days`` jours
+	- paiements validés - ajustements du portefeuille (gestes commerciaux).
+	"""
+	if grace_days is None:
+		grace_days = getattr(settings, "LATE_PAYMENT_GRACE_DAYS", 7)
+	cutoff = (as_of or timezone.now()) - datetime.timedelta(days=grace_days)
+	orders = ClientOrder.objects.filter(
+		client=OuterRef("pk"),
+		status__in=(ClientOrder.VALIDATED, ClientOrder.DELIVERED),
+		created_at__lte=cutoff,
+	)
+	payments = Payment.objects.filter(client=OuterRef("pk"), status=Payment.VALIDATED)
+	adjustments = WalletEntry.objects.filter(wallet__client=OuterRef("pk"), entry_type=WalletEntry.TYPE_ADJUSTMENT)
+	return queryset.annotate(
+		orders_mru=_total(orders, "client_id", "total_price_mru"),
+		paid_mru=_total(payments, "client_id", "amount_mru"),
+		adjusted_mru=_total(adjustments, "wallet_id", "amount_mru"),
+	).annotate(due_mru=F("orders_mru") - F("paid_mru") - F("adjusted_mru"))
+
+
+def _update_status(ids: list[int], status: str, now, chunk_size: int = 1000) -> int:
+	updated = 0
+	for start in range(0, len(ids), chunk_size):
+		updated += Client.objects.filter(pk__in=ids[start:start + chunk_size]).update(status=status, updated_at=now)
+	return updated
+
+
+def classify_late_clients(threshold=None, grace_days: int | None = None, dry_run: bool = False) -> dict:
+	"""Passe en LATE les clients actifs dont le dû dépasse le seuil, et inversement.
+
+	Deux lectures ensemblistes (uniquement les clients dont le statut doit
+	changer) puis des UPDATE groupés par lots d'id; les clients suspendus ne sont
+	jamais touchés. Un résumé est inscrit au journal d'activité.
+	"""
+	if threshold is None:
+		threshold = getattr(settings, "LATE_PAYMENT_THRESHOLD_MRU", 0)
+	threshold = Decimal(threshold)
+	now = timezone.now()
+	clients = annotate_due(Client.objects.all(), as_of=now, grace_days=grace_days)
+
+	with transaction.atomic():
+		to_late = list(clients.filter(status=Client.ACTIVE, due_mru__gt=threshold).values_list("id", flat=True))
+		to_active = list(clients.filter(status=Client.LATE, due_mru__lte=threshold).values_list("id", flat=True))
+		summary = {
+			"threshold_mru": str(threshold),
+			"grace_days": grace_days if grace_days is not None else getattr(settings, "LATE_PAYMENT_GRACE_DAYS", 7),
+			"to_late": len(to_late),
+			"to_active": len(to_active),
+			"dry_run": dry_run,
+		}
+		if dry_run:
+			return summary
+
+		_update_status(to_late, Client.LATE, now)
+		_update_status(to_active, Client.ACTIVE, now)
+		audit_writer.record(
+			ActivityLog(
+				model_name=Client._meta.label,
+				action=ActivityLog.ACTION_UPDATE,
+				description=(
+					f"Classement des retards de paiement: {len(to_late)} client(s) en retard, "
+					f"{len(to_active)} client(s) redevenu(s) actif(s) (seuil {threshold} MRU)"
+				),
+				data={**summary, "late_ids": to_late[:500], "active_ids": to_active[:500]},
+			)
+		)
+	return summary
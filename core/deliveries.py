@@ -0,0 +1,255 @@
+import datetime
+import logging
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, ExpressionWrapper, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import geo, ledger, orders, progress, stock
+from .audit import audit_writer
+from .models import ActivityLog, BusPosition, ClientOrder, Tour, TourStop
+
+
+logger = logging.getLogger(__name__)
+
+RESULT_OK = "ok"
+RESULT_DUPLICATE = "duplicate"
+RESULT_CONFLICT = "conflict"
+RESULT_NOT_FOUND = "not_found"
+RESULT_ERROR = "error"
+
+DELIVERABLE_STATUSES = (ClientOrder.PENDING, ClientOrder.VALIDATED)
+
+# Tolérance sur l'horloge du téléphone pour delivered_at
+CLOCK_SKEW = datetime.timedelta(minutes=5)
+
+
+class PositionRequired(APIException):
+	status_code = status.HTTP_409_CONFLICT
+	default_detail = "Aucune tournée aujourd'hui et aucune position connue: envoyez la position du téléphone (?lat=&lon=)."
+	default_code = "position_required"
+
+
+def deliver(order, driver, user, delivered_at=None, returned_bottles: int = 0, position=None) -> str:
+	"""Marque une commande livrée par ``UPDATE ... WHERE status IN (à livrer)``.
+
+	La réservation de stock doit être tenue par le bus du chauffeur (ou
+	absente): elle est consommée sur ce bus, sinon ReservedElsewhere (409).
+	Débit du portefeuille, mouvements de stock, arrêt du client pointé visité
+	(``_complete_stop``) et journal suivent dans la même transaction. Retourne RESULT_OK, RESULT_DUPLICATE (déjà livrée par ce
+	chauffeur: nouvel envoi d'une file hors ligne) ou RESULT_CONFLICT.
+	"""
+	now = timezone.now()
+	delivered_at = min(delivered_at or now, now)
+	previous_status = order.status
+	held_here = Q(reserved_bus__isnull=True, reserved_warehouse__isnull=True)
+	if driver.bus_id:
+		held_here |= Q(reserved_bus_id=driver.bus_id)
+	with transaction.atomic():
+		updated = ClientOrder.objects.filter(held_here, pk=order.pk, status__in=DELIVERABLE_STATUSES).update(
+			status=ClientOrder.DELIVERED,
+			delivered_at=delivered_at,
+			delivered_by=driver,
+			updated_at=now,
+		)
+		current = (
+			ClientOrder.objects.filter(pk=order.pk)
+			.values("status", "delivered_by_id", "reserved_bus_id", "reserved_warehouse_id")
+			.first()
+		)
+		if not updated:
+			if current and current["status"] == ClientOrder.DELIVERED and current["delivered_by_id"] == driver.pk:
+				return RESULT_DUPLICATE
+			if current and current["status"] in DELIVERABLE_STATUSES:
+				order.reserved_bus_id = current["reserved_bus_id"]
+				order.reserved_warehouse_id = current["reserved_warehouse_id"]
+				stock.check_reservation(order, driver.bus_id)
+			return RESULT_CONFLICT
+
+		# Réservation relue: libérée à la notification, sur le bus qui en sort les pleines
+		order.reserved_bus_id = current["reserved_bus_id"]
+		order.reserved_warehouse_id = current["reserved_warehouse_id"]
+		order.status = ClientOrder.DELIVERED
+		order.delivered_at = delivered_at
+		order.delivered_by = driver
+		ledger.debit_order(order, user=user)
+		# Pleines du bus vers le client, vides rendues vers le bus
+		stock.record_delivery(order, bus=driver.bus, returned_empties=returned_bottles, user=user)
+		stop_id = _complete_stop(order, driver, delivered_at, returned_bottles, now)
+
+		data = {
+			"status": order.status,
+			"delivered_by_driver_id": driver.id,
+			"delivered_by_driver_name": driver.name,
+			"delivered_at": delivered_at.isoformat(),
+			"returned_bottles": returned_bottles,
+		}
+		if stop_id:
+			data["stop"] = stop_id
+		if position:
+			data["position"] = position
+		audit_writer.log(order, ActivityLog.ACTION_UPDATE, description=f"Commande livrée par {driver.name}", data=data, user=user)
+		orders.notify([order], {order.pk: previous_status}, ClientOrder.DELIVERED, user)
+	return RESULT_OK
+
+
+def _complete_stop(order, driver, delivered_at, returned_bottles: int, now) -> int | None:
+	"""Pointe visité l'arrêt du client dans la tournée du jour du chauffeur et y ajoute les bouteilles.
+
+	Un arrêt déjà visité (autre commande du même client) reçoit seulement les
+	bouteilles. L'avancement de la tournée est recalculé aussitôt. Retourne
+	l'id de l'arrêt, None hors tournée.
+	"""
+	tour = current_tour(driver, timezone.localdate(delivered_at))
+	if tour is None:
+		return None
+	stop_id = (
+		TourStop.objects.filter(tour=tour, client_id=order.client_id)
+		.order_by(Case(When(status=TourStop.PENDING, then=0), default=1), "order_index", "id")
+		.values_list("id", flat=True)
+		.first()
+	)
+	if stop_id is None:
+		return None
+	TourStop.objects.filter(pk=stop_id).update(
+		status=TourStop.COMPLETED,
+		delivered_bottles=F("delivered_bottles") + order.quantity,
+		returned_bottles=F("returned_bottles") + returned_bottles,
+		updated_at=now,
+	)
+	progress.refresh([tour.pk])
+	return stop_id
+
+
+def sync(driver, user, events: list[dict]) -> list[dict]:
+	"""Applique une file de livraisons saisies hors ligne, dans l'ordre reçu.
+
+	Seules les commandes du périmètre du chauffeur (``driver_scope``, celui de
+	la file et du PATCH) ou déjà livrées par lui (renvoi) sont trouvées; les
+	autres sont not_found. Une transaction pour le lot et un point de
+	sauvegarde par événement (celui de ``deliver``): un événement en conflit ou
+	en erreur n'annule pas les autres. Les commandes sont lues en une requête;
+	le journal est écrit en une insertion groupée au commit.
+	"""
+	try:
+		scope = driver_scope(driver, driver_origin(driver))
+	except PositionRequired:
+		# Les renvois de livraisons déjà faites restent reconnus
+		scope = ClientOrder.objects.none()
+	by_id = (
+		ClientOrder.objects.select_related("client", "bottle_type")
+		.filter(Q(pk__in=scope.values("pk")) | Q(delivered_by=driver))
+		.in_bulk([event["order_id"] for event in events])
+	)
+	now = timezone.now()
+	results = []
+	with transaction.atomic(), audit_writer.batch():
+		for event in events:
+			result = {"order_id": event["order_id"], "result": RESULT_NOT_FOUND, "status": None}
+			order = by_id.get(event["order_id"])
+			if order is not None:
+				delivered_at = event.get("delivered_at")
+				if delivered_at and delivered_at > now + CLOCK_SKEW:
+					result.update(result=RESULT_CONFLICT, status=order.status, detail="Date de livraison dans le futur.")
+				else:
+					try:
+						outcome = deliver(
+							order,
+							driver,
+							user,
+							delivered_at=delivered_at,
+							returned_bottles=event.get("returned_bottles", 0),
+							position=event.get("position"),
+						)
+					except Exception as exc:
+						# Point de sauvegarde de deliver annulé: les autres événements du lot sont conservés
+						if isinstance(exc, APIException):
+							# Refus métier (réservation tenue par un autre emplacement, ...)
+							detail = str(exc.detail)
+						else:
+							logger.exception("Échec de synchronisation de la livraison de la commande #%s", order.pk)
+							detail = "Erreur lors de l'enregistrement de la livraison."
+						result.update(
+							result=RESULT_ERROR,
+							status=ClientOrder.objects.filter(pk=order.pk).values_list("status", flat=True).first(),
+							detail=detail,
+						)
+					else:
+						status = ClientOrder.DELIVERED
+						if outcome == RESULT_CONFLICT:
+							status = ClientOrder.objects.filter(pk=order.pk).values_list("status", flat=True).first()
+						result.update(result=outcome, status=status)
+			results.append(result)
+	return results
+
+
+def current_tour(driver, day=None):
+	"""Tournée du jour du chauffeur (ou de son bus)."""
+	condition = Q(driver=driver)
+	if driver.bus_id:
+		condition |= Q(bus_id=driver.bus_id)
+	return Tour.objects.filter(condition, date=day or timezone.localdate()).order_by("-id").first()
+
+
+def driver_origin(driver, latitude=None, longitude=None):
+	"""Point de départ du tri: position envoyée par le téléphone, sinon dernière position du bus, sinon son dépôt."""
+	if latitude is not None and longitude is not None:
+		return float(latitude), float(longitude)
+	if driver.bus_id:
+		position = (
+			BusPosition.objects.filter(bus_id=driver.bus_id)
+			.order_by("-created_at")
+			.values_list("latitude", "longitude")
+			.first()
+		)
+		if position:
+			return float(position[0]), float(position[1])
+		return geo.coordinates(driver.bus.warehouse)
+	return None
+
+
+def driver_scope(driver, origin=None, radius_km=None):
+	"""Commandes à livrer relevant du chauffeur, sans tri.
+
+	Clients de sa tournée du jour, quel que soit le statut de leur arrêt (un
+	arrêt pointé visité avant la livraison ne retire pas la commande); à
+	défaut, clients dans un rayon ``DRIVER_QUEUE_RADIUS_KM`` autour du bus
+	(rectangle englobant servi par l'index (gps_latitude, gps_longitude)). Ni
+	tournée ni position (téléphone, bus ou dépôt): PositionRequired (409),
+	jamais le carnet de commandes national.
+	"""
+	qs = ClientOrder.objects.filter(status__in=DELIVERABLE_STATUSES)
+	tour = current_tour(driver)
+	if tour is not None:
+		return qs.filter(client_id__in=TourStop.objects.filter(tour=tour).values("client_id"))
+	if origin is None:
+		raise PositionRequired()
+	radius_km = radius_km or getattr(settings, "DRIVER_QUEUE_RADIUS_KM", 25)
+	lat_min, lat_max, lon_min, lon_max = geo.bounding_box(*origin, radius_km)
+	return qs.filter(
+		client__gps_latitude__range=(lat_min, lat_max),
+		client__gps_longitude__range=(lon_min, lon_max),
+	)
+
+
+def driver_queue(driver, origin=None, radius_km=None):
+	"""Commandes à livrer par le chauffeur (``driver_scope``), de la plus proche à la plus lointaine.
+
+	Le tri par distance (équirectangulaire, suffisante à l'échelle d'une ville)
+	est fait en SQL, ce qui permet de paginer sans charger tout le carnet de
+	commandes.
+	"""
+	qs = driver_scope(driver, origin, radius_km).select_related("client", "bottle_type")
+	if origin is None:
+		return qs.order_by("-created_at")
+	lat0, lon0 = origin
+	dlat = Cast("client__gps_latitude", FloatField()) - Value(lat0)
+	dlon = (Cast("client__gps_longitude", FloatField()) - Value(lon0)) * Value(geo.lon_scale(lat0))
+	return qs.annotate(
+		distance_sq=ExpressionWrapper(dlat * dlat + dlon * dlon, output_field=FloatField())
+	).order_by(F("distance_sq").asc(nulls_last=True), "-created_at")
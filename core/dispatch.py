@@ -0,0 +1,206 @@
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, Max
+from django.utils import timezone
+
+from . import distances
+from .audit import audit_writer
+from .geo import coordinates
+from .models import ActivityLog, BusBottleStock, BusPosition, DriverNotification, Tour, TourStop
+
+
+class _Route:
+	"""Reste à parcourir d'une tournée: position de départ, arrêts à visiter, retour au dépôt.
+
+	Extrémités et arrêts sont des noeuds core.distances (clé ou None, point ou None).
+	"""
+
+	def __init__(self, tour, start, end):
+		self.tour = tour
+		self.start = start
+		self.end = end
+		# [order_index, (lat, lon) ou None, client_id]
+		self.stops = []
+		self.last_index = 0
+		self._legs = None
+
+	def nodes(self):
+		return [self.start] + [((distances.CLIENT, client_id), point) for _, point, client_id in self.stops] + [self.end]
+
+	def legs(self, nodes) -> list:
+		"""Longueur de chaque tronçon du reste du parcours (None si une extrémité est inconnue)."""
+		if self._legs is None:
+			self._legs = [distances.distance(a, b) for a, b in zip(nodes, nodes[1:])]
+		return self._legs
+
+	def cheapest_insertion(self, node) -> tuple[float, int] | None:
+		"""(surcoût en km, position dans ``stops``) de l'insertion la moins chère, None si impossible."""
+		best = None
+		nodes = self.nodes()
+		to_node = distances.distances_from(node, nodes)
+		legs = self.legs(nodes)
+		for position in range(len(nodes) - 1):
+			a, b = to_node[position], to_node[position + 1]
+			# Extrémité inconnue (départ, retour libre, client sans coordonnées): seul l'autre tronçon compte
+			if a is None and b is None:
+				extra = 0.0
+			elif a is None:
+				extra = b
+			elif b is None:
+				extra = a
+			else:
+				# Inégalité triangulaire: seul l'arrondi peut rendre le surcoût négatif
+				extra = max(a + b - legs[position], 0.0)
+			if best is None or extra < best[0]:
+				best = (extra, position)
+		return best
+
+	def insert(self, position: int, point, client_id: int) -> int:
+		"""Insère l'arrêt avant ``stops[position]`` et retourne son order_index (décalage en mémoire)."""
+		if position < len(self.stops):
+			index = self.stops[position][0]
+			for entry in self.stops[position:]:
+				entry[0] += 1
+		else:
+			index = self.last_index + 1
+		self.stops.insert(position, [index, point, client_id])
+		self.last_index += 1
+		self._legs = None
+		return index
+
+
+def _depot(tour):
+	depot = coordinates(tour.bus.warehouse)
+	return (distances.node(tour.bus.warehouse) if depot else None), depot
+
+
+def _start_point(tour, last_visited):
+	"""Départ (noeud): dernière position du bus, sinon dernier client visité, sinon dépôt."""
+	position = BusPosition.objects.filter(bus_id=tour.bus_id).order_by("-created_at").values_list("latitude", "longitude").first()
+	if position:
+		return None, (float(position[0]), float(position[1]))
+	return last_visited or _depot(tour)
+
+
+def _active_routes(day) -> list[_Route]:
+	"""Tournées du jour qui ont encore des arrêts à visiter, lues en trois requêtes (+ une position par bus)."""
+	tours = {
+		tour.pk: tour
+		for tour in Tour.objects.filter(date=day, stops__status=TourStop.PENDING).distinct().select_related("bus__warehouse", "driver")
+	}
+	if not tours:
+		return []
+	pending = defaultdict(list)
+	last_visited = {}
+	rows = (
+		TourStop.objects.filter(tour_id__in=list(tours))
+		.order_by("tour_id", "order_index", "id")
+		.values_list("tour_id", "order_index", "status", "client_id", "client__gps_latitude", "client__gps_longitude")
+	)
+	for tour_id, order_index, status, client_id, latitude, longitude in rows:
+		point = (float(latitude), float(longitude)) if latitude is not None and longitude is not None else None
+		if status == TourStop.PENDING:
+			pending[tour_id].append([order_index, point, client_id])
+		elif point is not None:
+			last_visited[tour_id] = ((distances.CLIENT, client_id), point)
+	last_index = dict(TourStop.objects.filter(tour_id__in=list(tours)).values_list("tour_id").annotate(last=Max("order_index")).order_by())
+
+	routes = []
+	for tour_id, tour in tours.items():
+		route = _Route(tour, _start_point(tour, last_visited.get(tour_id)), _depot(tour))
+		route.stops = pending[tour_id]
+		route.last_index = last_index.get(tour_id) or 0
+		routes.append(route)
+	return routes
+
+
+def insert_orders(orders, user=None, day=None) -> list[dict]:
+	"""Ajoute les clients de commandes tout juste validées aux tournées en cours (insertion la moins chère).
+
+	Pour chaque client sans arrêt à visiter aujourd'hui, l'arrêt est inséré dans
+	la tournée active dont le reste du parcours s'allonge le moins (au plus
+	AUTO_INSERT_MAX_DETOUR_KM), si le bus a les bouteilles quand il est déjà
+	chargé. Un UPDATE décale les rangs suivants, puis le chauffeur est prévenu
+	dans son fil. Retourne une ligne par arrêt inséré.
+	"""
+	day = day or timezone.localdate()
+	max_detour = getattr(settings, "AUTO_INSERT_MAX_DETOUR_KM", 15)
+	first_order = {}
+	for order in orders:
+		first_order.setdefault(order.client_id, order)
+	planned = set(
+		TourStop.objects.filter(tour__date=day, status=TourStop.PENDING, client_id__in=list(first_order)).values_list("client_id", flat=True)
+	)
+	candidates = [order for client_id, order in first_order.items() if client_id not in planned]
+	if not candidates:
+		return []
+	routes = _active_routes(day)
+	if not routes:
+		return []
+
+	available = {}
+	loaded = set()
+	for bus_id, bottle_type_id, quantity, reserved in BusBottleStock.objects.filter(
+		bus_id__in={route.tour.bus_id for route in routes}
+	).values_list("bus_id", "bottle_type_id", "quantity", "reserved_quantity"):
+		loaded.add(bus_id)
+		available[(bus_id, bottle_type_id)] = quantity - reserved
+
+	inserted = []
+	notifications = []
+	with transaction.atomic():
+		for order in candidates:
+			point = (
+				(float(order.client.gps_latitude), float(order.client.gps_longitude))
+				if order.client.gps_latitude is not None and order.client.gps_longitude is not None
+				else None
+			)
+			if point is None:
+				continue
+			best = None
+			for route in routes:
+				bus_id = route.tour.bus_id
+				if bus_id in loaded and available.get((bus_id, order.bottle_type_id), 0) < order.quantity:
+					continue
+				option = route.cheapest_insertion(((distances.CLIENT, order.client_id), point))
+				if option and option[0] <= max_detour and (best is None or option[0] < best[0]):
+					best = (option[0], option[1], route)
+			if best is None:
+				continue
+
+			extra_km, position, route = best
+			index = route.insert(position, point, order.client_id)
+			TourStop.objects.filter(tour_id=route.tour.pk, order_index__gte=index).update(order_index=F("order_index") + 1)
+			stop = TourStop.objects.create(tour=route.tour, client_id=order.client_id, order_index=index)
+			available[(route.tour.bus_id, order.bottle_type_id)] = available.get((route.tour.bus_id, order.bottle_type_id), 0) - order.quantity
+			result = {
+				"order": order.pk,
+				"client": order.client_id,
+				"tour": route.tour.pk,
+				"stop": stop.pk,
+				"order_index": index,
+				"extra_km": round(extra_km, 3),
+			}
+			inserted.append(result)
+			audit_writer.log(
+				stop,
+				ActivityLog.ACTION_CREATE,
+				description=f"Arrêt ajouté à la tournée #{route.tour.pk} (commande #{order.pk}, +{result['extra_km']} km)",
+				data=result,
+				user=user,
+			)
+			if route.tour.driver_id:
+				notifications.append(
+					DriverNotification(
+						driver_id=route.tour.driver_id,
+						kind=DriverNotification.KIND_NEW_STOP,
+						tour=route.tour,
+						stop=stop,
+						message=f"Nouvel arrêt n°{index}: {order.client.name} ({order.quantity} x {order.bottle_type.name})",
+						data=result,
+					)
+				)
+		DriverNotification.objects.bulk_create(notifications)
+	return inserted
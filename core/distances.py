@@ -0,0 +1,437 @@
+"""Matrice persistante des distances (km) entre clients et dépôts géolocalisés.
+
+Taille: ``matrix.bin`` est dense, capacité² float32 (capacité: puissance de 2
+au-dessus du nombre de rangs, bornée par DISTANCE_MATRIX_MAX_NODES), soit
+16 Mio pour 2 048 rangs, 256 Mio pour 8 192 (défaut) et 1 Gio pour 16 384.
+Au-delà de la borne, ``update`` et ``rebuild`` lèvent MatrixFull: les nouveaux
+points sont alors servis par calcul direct (haversine), jamais faux. La
+reconstruction écrit ligne par ligne dans le fichier projeté: mémoire O(n),
+temps O(n²) en Python pur (de l'ordre de la minute à 8 192 rangs).
+"""
+
+import json
+import logging
+import math
+import mmap
+import os
+import threading
+from array import array
+from contextlib import contextmanager
+from functools import partial
+from pathlib import Path
+
+from django.conf import settings
+from django.db import transaction
+
+from . import geo
+from .models import Client, Warehouse
+
+try:
+	import fcntl
+except ImportError:  # Windows: verrou inter-processus indisponible, un seul processus d'écriture attendu
+	fcntl = None
+
+
+logger = logging.getLogger(__name__)
+
+CLIENT = "client"
+WAREHOUSE = "warehouse"
+MODELS = {CLIENT: Client, WAREHOUSE: Warehouse}
+
+NODES_FILE = "nodes.json"
+POINTS_FILE = "points.bin"
+MATRIX_FILE = "matrix.bin"
+LOCK_FILE = "write.lock"
+
+MIN_CAPACITY = 64
+NAN = float("nan")
+
+
+class MatrixFull(Exception):
+	"""Plus de rangs que DISTANCE_MATRIX_MAX_NODES."""
+
+
+def _root():
+	return getattr(settings, "DISTANCE_MATRIX_DIR", settings.BASE_DIR / "var" / "distances")
+
+
+def _max_nodes() -> int:
+	return getattr(settings, "DISTANCE_MATRIX_MAX_NODES", 8192)
+
+
+def _radians(points, size: int) -> tuple[list, list, list]:
+	"""(phi, cos phi, lambda) de chaque rang de ``points`` (lat, lon entrelacés); NaN si inconnu."""
+	phis = [math.radians(points[2 * j]) for j in range(size)]
+	lmbs = [math.radians(points[2 * j + 1]) for j in range(size)]
+	return phis, [math.cos(phi) for phi in phis], lmbs
+
+
+def _row(lat: float, lon: float, phis, coss, lmbs) -> array:
+	"""Distances (km) d'un point vers chaque rang précalculé, en une ligne ``array('f')`` (NaN si inconnu)."""
+	phi, lmb = math.radians(lat), math.radians(lon)
+	cos_phi = math.cos(phi)
+	diameter = 2 * geo.EARTH_RADIUS_KM
+	sin, asin, sqrt = math.sin, math.asin, math.sqrt
+	return array(
+		"f",
+		[
+			diameter * asin(min(1.0, sqrt(sin((other_phi - phi) / 2) ** 2 + cos_phi * other_cos * sin((other_lmb - lmb) / 2) ** 2)))
+			if other_phi == other_phi
+			else NAN
+			for other_phi, other_cos, other_lmb in zip(phis, coss, lmbs)
+		],
+	)
+
+
+def node(obj) -> tuple:
+	"""Clé stable d'un client ou d'un dépôt: (type, id)."""
+	return (WAREHOUSE if isinstance(obj, Warehouse) else CLIENT, obj.pk)
+
+
+def _encode(key) -> str:
+	return f"{key[0]}:{key[1]}"
+
+
+def _decode(text: str) -> tuple:
+	kind, _, pk = text.partition(":")
+	return kind, int(pk)
+
+
+class DistanceMatrix:
+	"""Distances (km) entre tous les clients et dépôts géolocalisés, sur disque.
+
+	Trois fichiers dans ``root``: ``nodes.json`` (rang stable de chaque client /
+	dépôt et capacité), ``points.bin`` (lat, lon en float64 par rang, NaN si
+	inconnues) et ``matrix.bin`` (capacité x capacité float32, ligne par rang).
+	Les deux derniers sont projetés en mémoire (mmap partagé): une ligne est une
+	vue sans copie, et un processus voit les écritures des autres. Une distance
+	n'est servie que si les coordonnées enregistrées sont celles de l'appelant;
+	sinon elle est recalculée (haversine), jamais fausse.
+	"""
+
+	def __init__(self, root=None):
+		self.root = Path(root or _root())
+		self._lock = threading.RLock()
+		self._generation = None
+		self._slots = {}
+		self._size = 0
+		self._capacity = 0
+		self._files = []
+		self._matrix = None
+		self._points = None
+
+	# Fichiers
+
+	def _path(self, name: str) -> Path:
+		return self.root / name
+
+	def _close(self):
+		for view in (self._matrix, self._points):
+			if view is not None:
+				view.release()
+		self._matrix = self._points = None
+		for handle, mapped in self._files:
+			mapped.close()
+			handle.close()
+		self._files = []
+
+	def _map(self, name: str):
+		handle = open(self._path(name), "r+b")
+		mapped = mmap.mmap(handle.fileno(), 0)
+		self._files.append((handle, mapped))
+		return mapped
+
+	def _refresh(self) -> bool:
+		"""Recharge les rangs et la projection si un autre processus les a changés; faux sans matrice."""
+		try:
+			stat = os.stat(self._path(NODES_FILE))
+		except FileNotFoundError:
+			self._close()
+			self._generation, self._slots, self._size, self._capacity = None, {}, 0, 0
+			return False
+		# Renommage atomique à chaque publication: nouvel inode, même si l'horodatage n'a pas bougé
+		generation = (stat.st_ino, stat.st_mtime_ns)
+		if generation != self._generation:
+			with open(self._path(NODES_FILE), encoding="utf-8") as fh:
+				data = json.load(fh)
+			self._close()
+			self._slots = {_decode(key): slot for key, slot in data["nodes"].items()}
+			self._size = data["size"]
+			self._capacity = data["capacity"]
+			self._matrix = memoryview(self._map(MATRIX_FILE)).cast("f")
+			self._points = memoryview(self._map(POINTS_FILE)).cast("d")
+			self._generation = generation
+		return True
+
+	def _write_nodes(self):
+		"""Publie les rangs en dernier (renommage atomique): les lecteurs rechargent alors la projection."""
+		temporary = self._path(NODES_FILE + ".tmp")
+		with open(temporary, "w", encoding="utf-8") as fh:
+			json.dump({"size": self._size, "capacity": self._capacity, "nodes": {_encode(k): v for k, v in self._slots.items()}}, fh)
+		os.replace(temporary, self._path(NODES_FILE))
+		stat = os.stat(self._path(NODES_FILE))
+		self._generation = (stat.st_ino, stat.st_mtime_ns)
+
+	def _allocate(self, capacity: int):
+		"""(Ré)écrit les fichiers à la capacité donnée, en recopiant les lignes existantes."""
+		old_matrix, old_points, old_capacity = self._matrix, self._points, self._capacity
+		matrix_tmp, points_tmp = self._path(MATRIX_FILE + ".tmp"), self._path(POINTS_FILE + ".tmp")
+		with open(matrix_tmp, "wb") as fh:
+			fh.truncate(capacity * capacity * 4)
+		with open(points_tmp, "wb") as fh:
+			(array("d", [NAN]) * (2 * capacity)).tofile(fh)
+		if old_matrix is not None:
+			with open(matrix_tmp, "r+b") as fh, mmap.mmap(fh.fileno(), 0) as mapped:
+				target = memoryview(mapped).cast("f")
+				for i in range(self._size):
+					target[i * capacity:i * capacity + self._size] = old_matrix[i * old_capacity:i * old_capacity + self._size]
+				target.release()
+			with open(points_tmp, "r+b") as fh, mmap.mmap(fh.fileno(), 0) as mapped:
+				target = memoryview(mapped).cast("d")
+				target[:2 * self._size] = old_points[:2 * self._size]
+				target.release()
+		self._close()
+		os.replace(matrix_tmp, self._path(MATRIX_FILE))
+		os.replace(points_tmp, self._path(POINTS_FILE))
+		self._capacity = capacity
+		self._matrix = memoryview(self._map(MATRIX_FILE)).cast("f")
+		self._points = memoryview(self._map(POINTS_FILE)).cast("d")
+
+	@contextmanager
+	def _writing(self):
+		"""Section d'écriture: verrou du processus et verrou de fichier, état relu depuis le disque."""
+		self.root.mkdir(parents=True, exist_ok=True)
+		with self._lock, open(self._path(LOCK_FILE), "a") as lock:
+			if fcntl is not None:
+				fcntl.flock(lock, fcntl.LOCK_EX)
+			try:
+				self._refresh()
+				yield
+			finally:
+				if fcntl is not None:
+					fcntl.flock(lock, fcntl.LOCK_UN)
+
+	# Écritures
+
+	def _fill_row(self, slot: int, lat: float, lon: float):
+		"""Ligne et colonne du rang ``slot``: une ligne calculée, écrite en deux tranches."""
+		size, capacity = self._size, self._capacity
+		row = _row(lat, lon, *_radians(self._points, size))
+		row[slot] = 0.0
+		self._matrix[slot * capacity:slot * capacity + size] = row
+		self._matrix[slot:size * capacity:capacity] = row
+
+	def update(self, key, point) -> bool:
+		"""Enregistre (ou déplace) un point et recalcule sa seule ligne; faux si rien n'a changé.
+
+		Ligne écrite avant les coordonnées: un lecteur concurrent voit encore les
+		anciennes coordonnées, donc ne se sert pas de la ligne incomplète.
+		"""
+		with self._writing():
+			slot = self._slots.get(key)
+			if point is None:
+				if slot is not None and self._points[2 * slot] == self._points[2 * slot]:
+					self._points[2 * slot] = self._points[2 * slot + 1] = NAN
+					return True
+				return False
+			lat, lon = float(point[0]), float(point[1])
+			if slot is not None and (self._points[2 * slot], self._points[2 * slot + 1]) == (lat, lon):
+				return False
+			new = slot is None
+			if new:
+				slot = self._size
+				if slot >= _max_nodes():
+					raise MatrixFull(f"Matrice des distances pleine ({_max_nodes()} rangs, DISTANCE_MATRIX_MAX_NODES).")
+				if slot >= self._capacity:
+					self._allocate(min(max(MIN_CAPACITY, self._capacity * 2), _max_nodes()))
+				self._slots[key] = slot
+				self._size += 1
+			self._points[2 * slot] = NAN
+			self._fill_row(slot, lat, lon)
+			self._points[2 * slot + 1] = lon
+			self._points[2 * slot] = lat
+			if new:
+				self._write_nodes()
+			return True
+
+	def rebuild(self, nodes: dict) -> int:
+		"""Recalcule toute la matrice ({clé: (lat, lon)}), en gardant les rangs déjà attribués.
+
+		Une ligne à la fois, écrite directement dans le fichier projeté.
+		"""
+		with self._writing():
+			slots = dict(self._slots)
+			for key in nodes:
+				if key not in slots:
+					slots[key] = len(slots)
+			size = len(slots)
+			if size > _max_nodes():
+				raise MatrixFull(
+					f"{size} rangs pour une matrice limitée à {_max_nodes()} (DISTANCE_MATRIX_MAX_NODES): "
+					"augmenter la limite (taille du fichier: capacité² x 4 octets) ou désactiver la matrice."
+				)
+			capacity = min(max(MIN_CAPACITY, 1 << (size - 1).bit_length()), _max_nodes()) if size else MIN_CAPACITY
+			self._close()
+			self._size = 0
+			self._allocate(capacity)
+			self._slots, self._size = slots, size
+			# Coordonnées d'abord (2 flottants par rang), puis une ligne calculée et écrite à la fois
+			located = 0
+			for key, slot in slots.items():
+				point = nodes.get(key)
+				if point:
+					self._points[2 * slot], self._points[2 * slot + 1] = float(point[0]), float(point[1])
+					located += 1
+			radians = _radians(self._points, size)
+			for slot in range(size):
+				lat = self._points[2 * slot]
+				if lat != lat:
+					continue
+				row = _row(lat, self._points[2 * slot + 1], *radians)
+				row[slot] = 0.0
+				self._matrix[slot * capacity:slot * capacity + size] = row
+			self._write_nodes()
+			return located
+
+	# Lectures
+
+	def _slot(self, key, point):
+		"""Rang d'une clé dont les coordonnées enregistrées sont exactement ``point``, sinon None."""
+		if key is None or point is None:
+			return None
+		slot = self._slots.get(key)
+		if slot is None or (self._points[2 * slot], self._points[2 * slot + 1]) != (float(point[0]), float(point[1])):
+			return None
+		return slot
+
+	def distances_from(self, source, targets) -> list:
+		"""Distances (km) d'un noeud (clé, point) vers une liste de noeuds; None si un point manque.
+
+		Une seule ligne de la matrice est lue (vue sans copie); les paires hors
+		matrice sont calculées.
+		"""
+		key, point = source
+		if point is None:
+			return [None] * len(targets)
+		with self._lock:
+			available = self._refresh()
+			slot = self._slot(key, point) if available else None
+			row = self._matrix[slot * self._capacity:(slot + 1) * self._capacity] if slot is not None else None
+			result = []
+			for target_key, target_point in targets:
+				if target_point is None:
+					result.append(None)
+					continue
+				target_slot = self._slot(target_key, target_point) if row is not None else None
+				if target_slot is not None:
+					result.append(row[target_slot])
+				else:
+					result.append(geo.haversine_km(float(point[0]), float(point[1]), float(target_point[0]), float(target_point[1])))
+			return result
+
+	def submatrix(self, nodes) -> list[array]:
+		"""Matrice ``array('d')`` par ligne entre des noeuds (clé, point); 0 pour un point manquant.
+
+		Les paires présentes dans la matrice sont lues dans une vue de ligne, les
+		autres calculées (haversine); sans matrice, calcul complet.
+		"""
+		points = [point for _, point in nodes]
+		with self._lock:
+			if not self._refresh():
+				return geo.distance_matrix([point or (0.0, 0.0) for point in points])
+			slots = [self._slot(key, point) for key, point in nodes]
+			capacity = self._capacity
+			rows = []
+			for point, slot in zip(points, slots):
+				if point is None:
+					rows.append(array("d", bytes(8 * len(nodes))))
+					continue
+				lat, lon = float(point[0]), float(point[1])
+				view = self._matrix[slot * capacity:(slot + 1) * capacity] if slot is not None else None
+				rows.append(
+					array(
+						"d",
+						[
+							0.0
+							if other is None
+							else view[other_slot]
+							if view is not None and other_slot is not None
+							else geo.haversine_km(lat, lon, float(other[0]), float(other[1]))
+							for other, other_slot in zip(points, slots)
+						],
+					)
+				)
+			return rows
+
+
+_matrix = None
+_matrix_lock = threading.Lock()
+
+
+def matrix() -> DistanceMatrix | None:
+	"""Matrice du processus, None si désactivée (DISTANCE_MATRIX_DIR = None)."""
+	global _matrix
+	root = _root()
+	if root is None:
+		return None
+	with _matrix_lock:
+		if _matrix is None or _matrix.root != Path(root):
+			_matrix = DistanceMatrix(root)
+		return _matrix
+
+
+def distances_from(source, targets) -> list:
+	"""Distances (km) d'un noeud (clé ou None, (lat, lon) ou None) vers d'autres noeuds."""
+	current = matrix()
+	if current is None:
+		_, point = source
+		return [
+			geo.haversine_km(float(point[0]), float(point[1]), float(target[0]), float(target[1])) if point and target else None
+			for _, target in targets
+		]
+	return current.distances_from(source, targets)
+
+
+def distance(a, b) -> float | None:
+	return distances_from(a, [b])[0]
+
+
+def submatrix(nodes) -> list[array] | None:
+	"""Matrice entre noeuds pour core.routing; None si la matrice est désactivée."""
+	current = matrix()
+	return current.submatrix(nodes) if current is not None else None
+
+
+def _apply(key, point):
+	try:
+		current = matrix()
+		if current is not None:
+			current.update(key, point)
+	except MatrixFull as exc:
+		# Point hors matrice: ses distances sont calculées à la demande
+		logger.warning("%s %s non ajouté.", exc, _encode(key))
+	except OSError:
+		logger.exception("Mise à jour de la matrice des distances impossible pour %s", _encode(key))
+
+
+def node_saved(sender, instance, **kwargs):
+	"""Receveur post_save de Client / Warehouse: ligne recalculée au commit si les coordonnées ont changé."""
+	update_fields = kwargs.get("update_fields")
+	if update_fields is not None and not {"gps_latitude", "gps_longitude"} & set(update_fields):
+		return
+	transaction.on_commit(partial(_apply, node(instance), geo.coordinates(instance)))
+
+
+def node_deleted(sender, instance, **kwargs):
+	"""Receveur post_delete: le rang est conservé, ses coordonnées effacées."""
+	transaction.on_commit(partial(_apply, node(instance), None))
+
+
+def rebuild() -> int:
+	"""Reconstruit la matrice depuis la base (commande build_distance_matrix)."""
+	nodes = {}
+	for kind, model in MODELS.items():
+		for pk, lat, lon in model.objects.exclude(gps_latitude=None).exclude(gps_longitude=None).values_list("id", "gps_latitude", "gps_longitude").iterator(chunk_size=2000):
+			nodes[(kind, pk)] = (float(lat), float(lon))
+	current = matrix()
+	return current.rebuild(nodes) if current is not None else 0
@@ -0,0 +1,56 @@
+import math
+from array import array
+
+
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEGREE_LAT = 111.32
+
+
+def haversine_km(lat1: float, lon1: float, lat2: float, lon2: float) -> float:
+	"""Distance orthodromique en kilomètres entre deux points (degrés décimaux)."""
+	phi1, phi2 = math.radians(lat1), math.radians(lat2)
+	dphi = phi2 - phi1
+	dlmb = math.radians(lon2 - lon1)
+	a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+	return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(a)))
+
+
+def bounding_box(lat: float, lon: float, radius_km: float) -> tuple[float, float, float, float]:
+	"""Rectangle (lat_min, lat_max, lon_min, lon_max) contenant le cercle de rayon donné."""
+	dlat = radius_km / KM_PER_DEGREE_LAT
+	dlon = radius_km / (KM_PER_DEGREE_LAT * max(math.cos(math.radians(lat)), 0.01))
+	return lat - dlat, lat + dlat, lon - dlon, lon + dlon
+
+
+def lon_scale(lat: float) -> float:
+	"""Facteur de réduction des écarts de longitude à cette latitude (projection équirectangulaire)."""
+	return math.cos(math.radians(lat))
+
+
+def distance_matrix(points: list[tuple[float, float]]) -> list[array]:
+	"""Matrice des distances orthodromiques (km) entre des points (lat, lon).
+
+	Sinus / cosinus calculés une fois par point, puis une ligne ``array('d')``
+	par point, remplie par symétrie: n²/2 évaluations sans objet intermédiaire.
+	"""
+	n = len(points)
+	lats = [math.radians(lat) for lat, _ in points]
+	lons = [math.radians(lon) for _, lon in points]
+	cos_lats = [math.cos(lat) for lat in lats]
+	rows = [array("d", bytes(8 * n)) for _ in range(n)]
+	diameter = 2 * EARTH_RADIUS_KM
+	for i in range(n):
+		lat_i, lon_i, cos_i, row_i = lats[i], lons[i], cos_lats[i], rows[i]
+		for j in range(i + 1, n):
+			a = math.sin((lats[j] - lat_i) / 2) ** 2 + cos_i * cos_lats[j] * math.sin((lons[j] - lon_i) / 2) ** 2
+			d = diameter * math.asin(min(1.0, math.sqrt(a)))
+			row_i[j] = d
+			rows[j][i] = d
+	return rows
+
+
+def coordinates(obj):
+	"""(lat, lon) d'un client ou d'un dépôt, None sans coordonnées."""
+	if obj is None or obj.gps_latitude is None or obj.gps_longitude is None:
+		return None
+	return float(obj.gps_latitude), float(obj.gps_longitude)
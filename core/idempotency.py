@@ -0,0 +1,96 @@
+import datetime
+import hashlib
+import json
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+
+from .models import IdempotencyKey
+
+
+HEADER = "Idempotency-Key"
+REPLAY_HEADER = "Idempotent-Replayed"
+MAX_KEY_LENGTH = 64
+
+
+class IdempotencyKeyReused(APIException):
+	status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+	default_detail = "Cette clé d'idempotence a déjà servi pour une requête différente."
+	default_code = "idempotency_key_reused"
+
+
+class IdempotentRequestInProgress(APIException):
+	status_code = status.HTTP_409_CONFLICT
+	default_detail = "Une requête avec cette clé d'idempotence est en cours de traitement."
+	default_code = "idempotency_in_progress"
+
+
+def _ttl() -> datetime.timedelta:
+	return datetime.timedelta(seconds=getattr(settings, "IDEMPOTENCY_KEY_TTL", 24 * 3600))
+
+
+def request_fingerprint(request) -> str:
+	"""Empreinte du corps de la requête (fichiers réduits à leur nom et leur taille)."""
+	data = request.data
+	if hasattr(data, "lists"):
+		payload = {name: values for name, values in data.lists() if name not in request.FILES}
+	else:
+		payload = dict(data)
+	for name, upload in request.FILES.items():
+		payload[name] = [upload.name, upload.size]
+	raw = json.dumps(payload, cls=JSONEncoder, sort_keys=True, separators=(",", ":"))
+	return hashlib.sha256(raw.encode()).hexdigest()
+
+
+def purge_expired(now=None) -> int:
+	"""Supprime les clés expirées en une requête DELETE."""
+	deleted, _ = IdempotencyKey.objects.filter(expires_at__lte=now or timezone.now()).delete()
+	return deleted
+
+
+class IdempotentCreateMixin:
+	"""Rend ``create`` rejouable pour les clients qui envoient un en-tête Idempotency-Key.
+
+	La clé est réservée (contrainte unique utilisateur / clé / URL) dans la même
+	transaction que la création: un envoi concurrent attend le commit puis
+	reçoit la réponse enregistrée; si la création échoue, la réservation est
+	annulée avec elle et la requête peut être rejouée. Sans en-tête, rien ne change.
+	"""
+
+	def create(self, request, *args, **kwargs):
+		key = request.headers.get(HEADER)
+		user = getattr(request, "user", None)
+		if not key or not getattr(user, "is_authenticated", False):
+			return super().create(request, *args, **kwargs)
+		if len(key) > MAX_KEY_LENGTH:
+			raise ValidationError({HEADER: f"{MAX_KEY_LENGTH} caractères maximum."})
+
+		scope = {"user": user, "key": key, "endpoint": request.path}
+		fingerprint = request_fingerprint(request)
+		now = timezone.now()
+		with transaction.atomic():
+			IdempotencyKey.objects.filter(**scope, expires_at__lte=now).delete()
+			try:
+				with transaction.atomic():
+					record = IdempotencyKey.objects.create(**scope, fingerprint=fingerprint, expires_at=now + _ttl())
+			except IntegrityError:
+				return self._replay(IdempotencyKey.objects.get(**scope), fingerprint)
+
+			response = super().create(request, *args, **kwargs)
+			record.status_code = response.status_code
+			record.response_body = json.loads(json.dumps(response.data, cls=JSONEncoder))
+			record.save(update_fields=["status_code", "response_body"])
+		return response
+
+	def _replay(self, record, fingerprint: str):
+		if record.fingerprint != fingerprint:
+			raise IdempotencyKeyReused()
+		if record.status_code is None:
+			raise IdempotentRequestInProgress()
+		return Response(record.response_body, status=record.status_code, headers={REPLAY_HEADER: "true"})
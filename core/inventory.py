@@ -0,0 +1,88 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Sum
+from django.utils import timezone
+
+from rest_framework import serializers
+
+from .models import BusBottleStock, ClientBottleBalance, GasBottleType, WarehouseBottleStock
+
+
+CACHE_KEY = "core:inventory"
+
+LOCATION_WAREHOUSES = "warehouses"
+LOCATION_BUSES = "buses"
+LOCATION_CLIENTS = "clients"
+
+_timestamp = serializers.DateTimeField()
+
+
+def _totals(model, *fields) -> dict:
+	"""{type de bouteille: {champ: somme}} en une requête GROUP BY."""
+	rows = model.objects.values("bottle_type_id").annotate(**{field: Sum(field) for field in fields}).order_by()
+	return {row["bottle_type_id"]: {field: row[field] or 0 for field in fields} for row in rows}
+
+
+def _stock_totals(totals: dict) -> dict:
+	full = totals.get("quantity", 0)
+	reserved = totals.get("reserved_quantity", 0)
+	return {"full": full, "empty": totals.get("empty_quantity", 0), "reserved": reserved, "available": full - reserved}
+
+
+def build_inventory() -> dict:
+	"""Bouteilles pleines, vides et réservées par type et par classe d'emplacement (dépôts, bus, clients).
+
+	Quatre requêtes quel que soit le nombre de lignes de stock: une agrégation
+	par table de stock et la liste des types de bouteilles.
+	"""
+	warehouses = _totals(WarehouseBottleStock, "quantity", "empty_quantity", "reserved_quantity")
+	buses = _totals(BusBottleStock, "quantity", "empty_quantity", "reserved_quantity")
+	clients = _totals(ClientBottleBalance, "quantity")
+
+	bottle_types = []
+	for bottle_type in GasBottleType.objects.order_by("name").values("id", "name", "capacity_kg"):
+		pk = bottle_type["id"]
+		in_warehouses = warehouses.get(pk, {})
+		on_buses = buses.get(pk, {})
+		locations = {
+			LOCATION_WAREHOUSES: _stock_totals(in_warehouses),
+			LOCATION_BUSES: _stock_totals(on_buses),
+			# Bouteilles détenues par les clients (consignées), sans distinction pleine / vide
+			LOCATION_CLIENTS: {"held": clients.get(pk, {}).get("quantity", 0)},
+		}
+		full = locations[LOCATION_WAREHOUSES]["full"] + locations[LOCATION_BUSES]["full"]
+		empty = locations[LOCATION_WAREHOUSES]["empty"] + locations[LOCATION_BUSES]["empty"]
+		reserved = locations[LOCATION_WAREHOUSES]["reserved"] + locations[LOCATION_BUSES]["reserved"]
+		held = locations[LOCATION_CLIENTS]["held"]
+		bottle_types.append(
+			{
+				"bottle_type_id": pk,
+				"name": bottle_type["name"],
+				"capacity_kg": str(bottle_type["capacity_kg"]),
+				**locations,
+				"total": {
+					"full": full,
+					"empty": empty,
+					"reserved": reserved,
+					"available": full - reserved,
+					"held": held,
+					"all": full + empty + held,
+				},
+			}
+		)
+	return {"generated_at": _timestamp.to_representation(timezone.now()), "bottle_types": bottle_types}
+
+
+def inventory() -> dict:
+	"""Inventaire du réseau, servi depuis le cache tant qu'aucun stock n'a bougé."""
+	data = cache.get(CACHE_KEY)
+	if data is None:
+		data = build_inventory()
+		cache.set(CACHE_KEY, data, getattr(settings, "INVENTORY_CACHE_TIMEOUT", 300))
+	return data
+
+
+def invalidate(**kwargs):
+	"""Retire l'inventaire du cache au commit de la transaction qui modifie un stock."""
+	transaction.on_commit(lambda: cache.delete(CACHE_KEY))
@@ -0,0 +1,159 @@
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from .models import Wallet, WalletCheckpoint, WalletEntry
+
+
+ZERO = Decimal("0.00")
+
+
+def _wallet_id_for_client(client_id: int) -> int:
+	wallet_id = Wallet.objects.filter(client_id=client_id).values_list("id", flat=True).first()
+	if wallet_id is None:
+		try:
+			with transaction.atomic():
+				wallet_id = Wallet.objects.create(client_id=client_id).id
+		except IntegrityError:
+			# Créé en parallèle par une autre requête
+			wallet_id = Wallet.objects.values_list("id", flat=True).get(client_id=client_id)
+	return wallet_id
+
+
+def post_entry(
+	client_id: int,
+	amount,
+	entry_type: str,
+	counter_account: str,
+	payment=None,
+	order=None,
+	note: str = "",
+	user=None,
+):
+	"""Passe une écriture sur le portefeuille du client et met à jour son solde.
+
+	La ligne Wallet est verrouillée, le solde modifié par ``F()`` et l'écriture
+	insérée dans la même transaction. Une écriture déjà passée pour le même
+	paiement / la même commande (contraintes d'unicité) est ignorée: retourne None.
+	"""
+	amount = Decimal(amount)
+	if user is not None and not getattr(user, "is_authenticated", False):
+		user = None
+	wallet_id = _wallet_id_for_client(client_id)
+	try:
+		with transaction.atomic():
+			Wallet.objects.select_for_update().only("id").get(pk=wallet_id)
+			Wallet.objects.filter(pk=wallet_id).update(
+				balance_mru=F("balance_mru") + amount,
+				updated_at=timezone.now(),
+			)
+			balance = Wallet.objects.values_list("balance_mru", flat=True).get(pk=wallet_id)
+			return WalletEntry.objects.create(
+				wallet_id=wallet_id,
+				entry_type=entry_type,
+				counter_account=counter_account,
+				amount_mru=amount,
+				balance_after_mru=balance,
+				payment=payment,
+				order=order,
+				note=note,
+				created_by=user,
+			)
+	except IntegrityError:
+		if payment is None and order is None:
+			raise
+		return None
+
+
+def credit_payment(payment, user=None):
+	"""Crédite le portefeuille du montant d'un paiement validé (une seule fois)."""
+	return post_entry(
+		payment.client_id,
+		payment.amount_mru,
+		WalletEntry.TYPE_PAYMENT,
+		WalletEntry.ACCOUNT_CASH,
+		payment=payment,
+		note=f"Paiement #{payment.pk} validé",
+		user=user,
+	)
+
+
+def debit_order(order, user=None):
+	"""Débite le portefeuille du montant d'une commande livrée (une seule fois)."""
+	return post_entry(
+		order.client_id,
+		-Decimal(order.total_price_mru),
+		WalletEntry.TYPE_ORDER,
+		WalletEntry.ACCOUNT_SALES,
+		order=order,
+		note=f"Commande #{order.pk} livrée",
+		user=user,
+	)
+
+
+def charge_deposit(client_id: int, bottle_type, quantity: int, order=None, user=None):
+	"""Consigne (quantité > 0) ou rembourse (quantité < 0) des bouteilles au tarif deposit_mru."""
+	if not quantity or not bottle_type.deposit_mru:
+		return None
+	amount = Decimal(bottle_type.deposit_mru) * abs(quantity)
+	if quantity > 0:
+		entry_type, amount = WalletEntry.TYPE_DEPOSIT, -amount
+		note = f"Consigne {quantity} x {bottle_type.name}"
+	else:
+		entry_type = WalletEntry.TYPE_DEPOSIT_REFUND
+		note = f"Retour consigne {-quantity} x {bottle_type.name}"
+	return post_entry(client_id, amount, entry_type, WalletEntry.ACCOUNT_DEPOSITS, order=order, note=note, user=user)
+
+
+def adjust(client_id: int, amount, note: str, user=None):
+	"""Ajustement manuel (geste commercial, correction...)."""
+	return post_entry(client_id, amount, WalletEntry.TYPE_ADJUSTMENT, WalletEntry.ACCOUNT_ADJUSTMENTS, note=note, user=user)
+
+
+def balance_at(wallet_id: int, when) -> Decimal:
+	"""Solde du portefeuille à une date: une seule lecture par l'index (wallet, created_at, id).
+
+	``balance_after_mru`` de la dernière écriture suffit; les points de solde
+	(``checkpoint``) servent au contrôle du grand livre, pas à cette lecture.
+	"""
+	balance = (
+		WalletEntry.objects.filter(wallet_id=wallet_id, created_at__lte=when)
+		.order_by("-created_at", "-id")
+		.values_list("balance_after_mru", flat=True)
+		.first()
+	)
+	return balance if balance is not None else ZERO
+
+
+def checkpoint(wallet_id: int, as_of=None):
+	"""Arrête le solde du portefeuille et vérifie la cohérence du grand livre.
+
+	Seules les écritures postérieures au point précédent sont sommées. Retourne
+	``(checkpoint, écart)``: l'écart est non nul si le solde courant ne
+	correspond plus à (point précédent + écritures depuis).
+	"""
+	as_of = as_of or timezone.now()
+	with transaction.atomic():
+		wallet = Wallet.objects.select_for_update().get(pk=wallet_id)
+		previous = WalletCheckpoint.objects.filter(wallet_id=wallet_id).order_by("-as_of", "-id").first()
+		entries = WalletEntry.objects.filter(wallet_id=wallet_id, created_at__lte=as_of)
+		start = ZERO
+		if previous is not None:
+			start = previous.balance_mru
+			if previous.last_entry_id is not None:
+				entries = entries.filter(id__gt=previous.last_entry_id)
+		delta = entries.aggregate(total=Sum("amount_mru"))["total"] or ZERO
+		last_entry_id = entries.order_by("-id").values_list("id", flat=True).first()
+		if last_entry_id is None and previous is not None:
+			last_entry_id = previous.last_entry_id
+		point = WalletCheckpoint.objects.create(
+			wallet_id=wallet_id,
+			as_of=as_of,
+			last_entry_id=last_entry_id,
+			balance_mru=start + delta,
+		)
+		later = WalletEntry.objects.filter(wallet_id=wallet_id, created_at__gt=as_of).aggregate(total=Sum("amount_mru"))["total"] or ZERO
+		drift = wallet.balance_mru - (point.balance_mru + later)
+	return point, drift
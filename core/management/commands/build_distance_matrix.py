@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.distances import MatrixFull, rebuild
+
+
+class Command(BaseCommand):
+	help = "Reconstruit la matrice persistante des distances entre clients et dépôts (rangs existants conservés)."
+
+	def handle(self, *args, **options):
+		try:
+			located = rebuild()
+		except MatrixFull as exc:
+			raise CommandError(str(exc))
+		self.stdout.write(self.style.SUCCESS(f"Matrice des distances reconstruite: {located} point(s) géolocalisé(s)."))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from core import receipts
+from core.models import Payment
+
+
+class Command(BaseCommand):
+	help = "Calcule l'empreinte des reçus existants et génère les variantes manquantes (affichage / miniature)."
+
+	def handle(self, *args, **options):
+		pending = (
+			Payment.objects.exclude(Q(receipt_image="") | Q(receipt_image__isnull=True))
+			.filter(Q(receipt_sha256="") | Q(receipt_thumbnail="") | Q(receipt_thumbnail__isnull=True))
+			.values_list("id", "receipt_image", "receipt_sha256")
+		)
+		hashed = 0
+		built = set()
+		failed = 0
+		for pk, name, sha256 in pending.iterator():
+			if not sha256:
+				try:
+					sha256 = receipts.hash_file(name)
+				except OSError:
+					failed += 1
+					self.stdout.write(self.style.WARNING(f"Paiement #{pk}: reçu introuvable ({name})."))
+					continue
+				Payment.objects.filter(pk=pk).update(receipt_sha256=sha256)
+				hashed += 1
+			if sha256 in built:
+				continue
+			if receipts.build_variants(sha256, name) is None:
+				failed += 1
+			else:
+				built.add(sha256)
+		self.stdout.write(self.style.SUCCESS(f"{hashed} empreinte(s) calculée(s), {len(built)} reçu(s) traité(s), {failed} échec(s)."))
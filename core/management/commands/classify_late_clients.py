@@ -0,0 +1,30 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.credit import classify_late_clients
+
+
+class Command(BaseCommand):
+	help = "Classe les clients en retard de paiement (statut LATE) en quelques requêtes ensemblistes."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--threshold", default=None, help="Dû au-delà duquel un client est en retard (MRU, défaut: LATE_PAYMENT_THRESHOLD_MRU).")
+		parser.add_argument("--grace-days", type=int, default=None, help="Délai de paiement d'une commande (défaut: LATE_PAYMENT_GRACE_DAYS).")
+		parser.add_argument("--dry-run", action="store_true", help="Compte les changements sans rien modifier.")
+
+	def handle(self, *args, **options):
+		started = time.monotonic()
+		summary = classify_late_clients(
+			threshold=options["threshold"],
+			grace_days=options["grace_days"],
+			dry_run=options["dry_run"],
+		)
+		elapsed = time.monotonic() - started
+		prefix = "[simulation] " if summary["dry_run"] else ""
+		self.stdout.write(
+			self.style.SUCCESS(
+				f"{prefix}{summary['to_late']} client(s) en retard, {summary['to_active']} redevenu(s) actif(s) "
+				f"(seuil {summary['threshold_mru']} MRU, délai {summary['grace_days']} j) en {elapsed:.2f}s."
+			)
+		)
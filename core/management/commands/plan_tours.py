@@ -0,0 +1,34 @@
+import datetime
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.planning import plan_day
+
+
+class Command(BaseCommand):
+	help = "Crée les tournées du jour (par bus, capacité et stock respectés) à partir des commandes validées non planifiées."
+
+	def add_arguments(self, parser):
+		parser.add_argument("--date", default=None, help="Jour à planifier, AAAA-MM-JJ (défaut: aujourd'hui).")
+		parser.add_argument("--dry-run", action="store_true", help="Calcule le plan sans rien créer.")
+
+	def handle(self, *args, **options):
+		day = None
+		if options["date"]:
+			try:
+				day = datetime.date.fromisoformat(options["date"])
+			except ValueError:
+				raise CommandError("--date attendu au format AAAA-MM-JJ.")
+		summary = plan_day(day, dry_run=options["dry_run"])
+		prefix = "[simulation] " if summary["dry_run"] else ""
+		for tour in summary["tours"]:
+			self.stdout.write(
+				f"{tour['bus_name']}: {tour['stops']} arrêt(s), {tour['bottles']} bouteille(s) "
+				f"(capacité {tour['capacity'] if tour['capacity'] is not None else '-'}), {tour['distance_km']} km"
+			)
+		self.stdout.write(
+			self.style.SUCCESS(
+				f"{prefix}{summary['date']}: {len(summary['tours'])} tournée(s) pour {summary['clients']} client(s), "
+				f"{len(summary['unassigned_clients'])} non planifié(s), en {summary['elapsed_ms'] / 1000:.2f}s."
+			)
+		)
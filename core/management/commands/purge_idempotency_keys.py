@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.idempotency import purge_expired
+
+
+class Command(BaseCommand):
+	help = "Supprime les clés d'idempotence expirées (à planifier, par exemple chaque nuit)."
+
+	def handle(self, *args, **options):
+		deleted = purge_expired()
+		self.stdout.write(self.style.SUCCESS(f"{deleted} clé(s) d'idempotence supprimée(s)."))
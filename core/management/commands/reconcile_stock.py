@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+
+from core.stock import reconcile
+
+
+class Command(BaseCommand):
+	help = "Compare les stocks (dépôts, bus, clients) au journal des mouvements et corrige éventuellement les écarts."
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			"--fix",
+			choices=["stock", "movements"],
+			default=None,
+			help="stock: reconstruit les stocks depuis les mouvements; movements: inscrit des corrections d'inventaire (bilan d'ouverture).",
+		)
+
+	def handle(self, *args, **options):
+		drifts = reconcile(fix=options["fix"])
+		for drift in drifts:
+			kind = "vides" if drift["empty"] else "pleines"
+			self.stdout.write(
+				self.style.WARNING(
+					f"{drift['location']} #{drift['location_id']} / type #{drift['bottle_type_id']} ({kind}): "
+					f"stock {drift['stock']}, mouvements {drift['movements']}"
+				)
+			)
+		action = {"stock": " (stocks reconstruits)", "movements": " (corrections inscrites)"}.get(options["fix"], "")
+		self.stdout.write(self.style.SUCCESS(f"{len(drifts)} écart(s){action}."))
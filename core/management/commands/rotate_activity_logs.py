@@ -0,0 +1,60 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Min
+from django.utils import timezone
+
+from core.archive import ActivityLogArchive, add_months
+from core.models import ActivityLog
+
+
+class Command(BaseCommand):
+	help = "Archive les mois fermés du journal d'activité en JSONL compressé (avec index) et les retire de la base."
+
+	def add_arguments(self, parser):
+		parser.add_argument(
+			"--keep-months",
+			type=int,
+			default=getattr(settings, "ACTIVITY_LOG_RETENTION_MONTHS", 3),
+			help="Nombre de mois (mois courant inclus) conservés dans la table.",
+		)
+		parser.add_argument("--dry-run", action="store_true", help="Affiche les mois concernés sans rien modifier.")
+		parser.add_argument(
+			"--reindex",
+			action="store_true",
+			help="Ajoute les objets visés aux index des mois déjà archivés qui ne les ont pas, puis s'arrête.",
+		)
+
+	def handle(self, *args, **options):
+		keep = options["keep_months"]
+		if keep < 1:
+			raise CommandError("--keep-months doit être supérieur ou égal à 1 (le mois courant n'est jamais archivé).")
+
+		if options["reindex"]:
+			archive = ActivityLogArchive()
+			for year, month in archive.months():
+				if "objects" not in archive.read_index(year, month):
+					archive.reindex_month(year, month)
+					self.stdout.write(self.style.SUCCESS(f"{year:04d}-{month:02d}: index complété."))
+			return
+
+		now = timezone.localtime()
+		cutoff = add_months(now.year, now.month, -(keep - 1))
+		oldest = ActivityLog.objects.aggregate(oldest=Min("created_at"))["oldest"]
+		if oldest is None:
+			self.stdout.write("Journal vide, rien à archiver.")
+			return
+
+		oldest = timezone.localtime(oldest)
+		archive = ActivityLogArchive()
+		archived = set(archive.months())
+		year, month = oldest.year, oldest.month
+		while (year, month) < cutoff:
+			label = f"{year:04d}-{month:02d}"
+			if (year, month) in archived:
+				self.stdout.write(self.style.WARNING(f"{label}: déjà archivé, ignoré."))
+			elif options["dry_run"]:
+				self.stdout.write(f"{label}: serait archivé.")
+			else:
+				index = archive.export_month(year, month)
+				self.stdout.write(self.style.SUCCESS(f"{label}: {index['count']} entrées archivées."))
+			year, month = add_months(year, month, 1)
@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max, OuterRef, Q, Subquery
+
+from core.ledger import checkpoint
+from core.models import Wallet, WalletCheckpoint
+
+
+class Command(BaseCommand):
+	help = "Arrête le solde des portefeuilles ayant de nouvelles écritures et signale les écarts du grand livre."
+
+	def handle(self, *args, **options):
+		last_checkpoint_entry = Subquery(
+			WalletCheckpoint.objects.filter(wallet=OuterRef("pk")).order_by("-as_of", "-id").values("last_entry_id")[:1]
+		)
+		wallets = (
+			Wallet.objects.annotate(last_entry=Max("entries__id"), checkpointed=last_checkpoint_entry)
+			.filter(last_entry__isnull=False)
+			.filter(Q(checkpointed__isnull=True) | Q(last_entry__gt=last_checkpoint_entry))
+			.values_list("id", flat=True)
+		)
+		created = 0
+		drifts = 0
+		for wallet_id in wallets:
+			point, drift = checkpoint(wallet_id)
+			created += 1
+			if drift:
+				drifts += 1
+				self.stdout.write(self.style.ERROR(f"Portefeuille #{wallet_id}: écart de {drift} MRU avec le grand livre."))
+		self.stdout.write(self.style.SUCCESS(f"{created} point(s) de solde créé(s), {drifts} écart(s)."))
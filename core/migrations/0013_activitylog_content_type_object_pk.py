@@ -0,0 +1,55 @@
+# Generated by Django 6.0.1 on 2026-10-19 14:07
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+from django.db.models.functions import Cast
+
+
+def backfill_object_references(apps, schema_editor):
+    """Renseigne content_type / object_pk à partir des libellés model_name / object_id existants."""
+    ActivityLog = apps.get_model('core', 'ActivityLog')
+    ContentType = apps.get_model('contenttypes', 'ContentType')
+
+    labels = ActivityLog.objects.values_list('model_name', flat=True).distinct()
+    for label in labels:
+        app_label, _, model = (label or '').partition('.')
+        if not model:
+            continue
+        content_type, _ = ContentType.objects.get_or_create(app_label=app_label, model=model.lower())
+        rows = ActivityLog.objects.filter(model_name=label)
+        rows.update(content_type=content_type)
+        rows.filter(object_id__regex=r'^[0-9]+$').update(
+            object_pk=Cast('object_id', models.PositiveBigIntegerField())
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0012_clientorder_delivered_at_clientorder_delivered_by_and_more'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='activitylog',
+            name='content_type',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='contenttypes.contenttype'),
+        ),
+        migrations.AddField(
+            model_name='activitylog',
+            name='object_pk',
+            field=models.PositiveBigIntegerField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_object_references, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['content_type', 'object_pk', 'created_at', 'id'], name='core_activi_content_f0ec8c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentstatushistory',
+            index=models.Index(fields=['payment', 'created_at', 'id'], name='core_paymen_payment_89fe47_idx'),
+        ),
+    ]
@@ -0,0 +1,20 @@
+# Generated by Django 6.0.1 on 2026-10-19 14:09
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('contenttypes', '0002_remove_content_type_name'),
+        ('core', '0013_activitylog_content_type_object_pk'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='activitylog',
+            index=models.Index(fields=['created_at'], name='core_activi_created_5c6490_idx'),
+        ),
+    ]
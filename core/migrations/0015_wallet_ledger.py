@@ -0,0 +1,67 @@
+# Generated by Django 6.0.1 on 2026-10-19 14:10
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_activitylog_created_at_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='WalletEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('entry_type', models.CharField(choices=[('payment', 'Paiement'), ('order', 'Commande livrée'), ('deposit', 'Consigne'), ('deposit_refund', 'Remboursement de consigne'), ('adjustment', 'Ajustement')], max_length=20)),
+                ('counter_account', models.CharField(choices=[('cash', 'Encaissements'), ('sales', 'Ventes'), ('deposits', 'Consignes'), ('adjustments', 'Ajustements')], max_length=20)),
+                ('amount_mru', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('balance_after_mru', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('note', models.TextField(blank=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='wallet_entries', to=settings.AUTH_USER_MODEL)),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='wallet_entries', to='core.clientorder')),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='wallet_entries', to='core.payment')),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='entries', to='core.wallet')),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+            },
+        ),
+        migrations.CreateModel(
+            name='WalletCheckpoint',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('as_of', models.DateTimeField()),
+                ('balance_mru', models.DecimalField(decimal_places=2, max_digits=14)),
+                ('wallet', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='checkpoints', to='core.wallet')),
+                ('last_entry', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.walletentry')),
+            ],
+            options={
+                'ordering': ['-as_of'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='walletentry',
+            index=models.Index(fields=['wallet', 'created_at', 'id'], name='core_wallet_wallet__577a16_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='walletentry',
+            constraint=models.UniqueConstraint(condition=models.Q(('payment__isnull', False)), fields=('payment', 'entry_type'), name='unique_wallet_entry_per_payment'),
+        ),
+        migrations.AddConstraint(
+            model_name='walletentry',
+            constraint=models.UniqueConstraint(condition=models.Q(('order__isnull', False)), fields=('order', 'entry_type'), name='unique_wallet_entry_per_order'),
+        ),
+        migrations.AddIndex(
+            model_name='walletcheckpoint',
+            index=models.Index(fields=['wallet', 'as_of'], name='core_wallet_wallet__b35569_idx'),
+        ),
+    ]
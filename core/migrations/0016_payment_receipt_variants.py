@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-19 14:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_wallet_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='receipt_display',
+            field=models.ImageField(blank=True, null=True, upload_to='receipts/display/'),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='receipt_sha256',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='receipt_thumbnail',
+            field=models.ImageField(blank=True, null=True, upload_to='receipts/thumbs/'),
+        ),
+    ]
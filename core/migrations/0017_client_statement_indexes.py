@@ -0,0 +1,25 @@
+# Generated by Django 6.0.1 on 2026-10-19 15:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_payment_receipt_variants'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='clientorder',
+            index=models.Index(fields=['client', 'created_at', 'id'], name='core_client_client__9ae107_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['client', 'created_at', 'id'], name='core_paymen_client__152602_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='tourstop',
+            index=models.Index(fields=['client', 'created_at', 'id'], name='core_tourst_client__753e3a_idx'),
+        ),
+    ]
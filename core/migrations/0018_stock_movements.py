@@ -0,0 +1,51 @@
+# Generated by Django 6.0.1 on 2026-10-19 15:40
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_client_statement_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='busbottlestock',
+            name='empty_quantity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='warehousebottlestock',
+            name='empty_quantity',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.CreateModel(
+            name='StockMovement',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('movement_type', models.CharField(choices=[('load', 'Chargement dépôt -> bus'), ('delivery', 'Livraison bus -> client'), ('return', 'Retour de vides client -> bus'), ('unload', 'Déchargement bus -> dépôt'), ('adjustment', "Correction d'inventaire")], max_length=20)),
+                ('quantity', models.PositiveIntegerField()),
+                ('empty', models.BooleanField(default=False)),
+                ('note', models.TextField(blank=True)),
+                ('bottle_type', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='movements', to='core.gasbottletype')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to=settings.AUTH_USER_MODEL)),
+                ('from_bus', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.bus')),
+                ('from_client', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.client')),
+                ('from_warehouse', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.warehouse')),
+                ('order', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='stock_movements', to='core.clientorder')),
+                ('to_bus', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.bus')),
+                ('to_client', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.client')),
+                ('to_warehouse', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.warehouse')),
+            ],
+            options={
+                'ordering': ['-created_at', '-id'],
+                'indexes': [models.Index(fields=['bottle_type', 'created_at'], name='core_stockm_bottle__9c9d48_idx'), models.Index(fields=['from_bus', 'created_at'], name='core_stockm_from_bu_670eb6_idx'), models.Index(fields=['to_bus', 'created_at'], name='core_stockm_to_bus__00a0c1_idx')],
+            },
+        ),
+    ]
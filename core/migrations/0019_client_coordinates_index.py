@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-19 16:20
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_stock_movements'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='client',
+            index=models.Index(fields=['gps_latitude', 'gps_longitude'], name='core_client_gps_lat_f205be_idx'),
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 6.0.1 on 2026-10-19 17:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_idempotency_keys'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='busbottlestock',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='clientorder',
+            name='reserved_bus',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.bus'),
+        ),
+        migrations.AddField(
+            model_name='clientorder',
+            name='reserved_warehouse',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.warehouse'),
+        ),
+        migrations.AddField(
+            model_name='warehousebottlestock',
+            name='reserved_quantity',
+            field=models.PositiveIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 6.0.1 on 2026-10-19 17:35
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0021_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='bus',
+            name='warehouse',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='buses', to='core.warehouse'),
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 6.0.1 on 2026-10-19 18:05
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_bus_warehouse'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DriverNotification',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('kind', models.CharField(choices=[('new_stop', 'Nouvel arrêt')], max_length=20)),
+                ('message', models.TextField()),
+                ('data', models.JSONField(blank=True, null=True)),
+                ('driver', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='notifications', to='core.driver')),
+                ('stop', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.tourstop')),
+                ('tour', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.tour')),
+            ],
+            options={
+                'ordering': ['-id'],
+                'indexes': [models.Index(fields=['driver', 'id'], name='core_driver_driver__2b927a_idx')],
+            },
+        ),
+    ]
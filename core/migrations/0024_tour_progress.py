@@ -0,0 +1,67 @@
+# Generated by Django 6.0.1 on 2026-10-19 18:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Count, Max, Q, Sum
+
+
+def backfill_progress(apps, schema_editor):
+    """Calcule l'avancement des tournées existantes."""
+    Tour = apps.get_model('core', 'Tour')
+    TourStop = apps.get_model('core', 'TourStop')
+    TourProgress = apps.get_model('core', 'TourProgress')
+
+    next_clients = {}
+    for tour_id, client_id in (
+        TourStop.objects.filter(status='pending').order_by('tour_id', 'order_index', 'id').values_list('tour_id', 'client_id')
+    ):
+        next_clients.setdefault(tour_id, client_id)
+    rows = Tour.objects.annotate(
+        pending=Count('stops', filter=Q(stops__status='pending')),
+        completed=Count('stops', filter=Q(stops__status='completed')),
+        skipped=Count('stops', filter=Q(stops__status='skipped')),
+        delivered=Sum('stops__delivered_bottles'),
+        returned=Sum('stops__returned_bottles'),
+        last_stop_at=Max('stops__updated_at', filter=~Q(stops__status='pending')),
+    )
+    TourProgress.objects.bulk_create(
+        [
+            TourProgress(
+                tour_id=tour.pk,
+                pending_stops=tour.pending,
+                completed_stops=tour.completed,
+                skipped_stops=tour.skipped,
+                delivered_bottles=tour.delivered or 0,
+                returned_bottles=tour.returned or 0,
+                last_stop_at=tour.last_stop_at,
+                next_client_id=next_clients.get(tour.pk),
+            )
+            for tour in rows
+        ],
+        batch_size=500,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_driver_notifications'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TourProgress',
+            fields=[
+                ('tour', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='progress', serialize=False, to='core.tour')),
+                ('pending_stops', models.PositiveIntegerField(default=0)),
+                ('completed_stops', models.PositiveIntegerField(default=0)),
+                ('skipped_stops', models.PositiveIntegerField(default=0)),
+                ('delivered_bottles', models.IntegerField(default=0)),
+                ('returned_bottles', models.IntegerField(default=0)),
+                ('last_stop_at', models.DateTimeField(blank=True, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('next_client', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.client')),
+            ],
+        ),
+        migrations.RunPython(backfill_progress, migrations.RunPython.noop),
+    ]
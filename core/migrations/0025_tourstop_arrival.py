@@ -0,0 +1,28 @@
+# Generated by Django 6.0.1 on 2026-10-19 18:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0024_tour_progress'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tourstop',
+            name='arrived_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tourstop',
+            name='departed_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AlterField(
+            model_name='drivernotification',
+            name='kind',
+            field=models.CharField(choices=[('new_stop', 'Nouvel arrêt'), ('arrival', 'Arrêt à confirmer')], max_length=20),
+        ),
+    ]
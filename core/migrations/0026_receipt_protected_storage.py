@@ -0,0 +1,54 @@
+# Generated by Django 6.0.1 on 2026-10-19 19:05
+
+import os
+from pathlib import Path
+
+import core.models
+from django.conf import settings
+from django.db import migrations, models
+
+
+def _move(source, target):
+    """Déplace tout l'arbre ``receipts/`` d'une racine à l'autre, y compris les fichiers orphelins (noms relatifs inchangés)."""
+    root = Path(source) / "receipts"
+    if not root.is_dir():
+        return
+    for old in root.rglob("*"):
+        new = Path(target) / old.relative_to(source)
+        if old.is_file() and not new.exists():
+            new.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(old, new)
+
+
+def to_protected(apps, schema_editor):
+    _move(settings.MEDIA_ROOT, core.models.protected_storage().location)
+
+
+def to_media(apps, schema_editor):
+    _move(core.models.protected_storage().location, settings.MEDIA_ROOT)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_tourstop_arrival'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='receipt_display',
+            field=models.ImageField(blank=True, null=True, storage=core.models.protected_storage, upload_to='receipts/display/'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='receipt_image',
+            field=models.ImageField(blank=True, null=True, storage=core.models.protected_storage, upload_to='receipts/'),
+        ),
+        migrations.AlterField(
+            model_name='payment',
+            name='receipt_thumbnail',
+            field=models.ImageField(blank=True, null=True, storage=core.models.protected_storage, upload_to='receipts/thumbs/'),
+        ),
+        migrations.RunPython(to_protected, to_media),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 6.0.1 on 2026-10-19 20:10
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_receipt_protected_storage'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tourprogress',
+            name='presence_seen_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tourprogress',
+            name='presence_since',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='tourprogress',
+            name='presence_stop',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.tourstop'),
+        ),
+    ]
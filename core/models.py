@@ -1,6 +1,8 @@
 from django.db import models
 from django.conf import settings
 from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.files.storage import FileSystemStorage
 
 
 class TimeStampedModel(models.Model):
@@ -47,6 +49,12 @@ class Client(TimeStampedModel):
 		related_name="client_profile",
 	)
 
+	class Meta:
+		indexes = [
+			# Recherche par rectangle englobant (file de livraison par proximité)
+			models.Index(fields=["gps_latitude", "gps_longitude"]),
+		]
+
 	def __str__(self) -> str:
 		return f"{self.name} ({self.phone})"
 
@@ -56,6 +64,8 @@ class Bus(TimeStampedModel):
 	plate_number = models.CharField(max_length=50, blank=True)
 	capacity = models.PositiveIntegerField(null=True, blank=True)
 	max_speed_kmh = models.DecimalField(max_digits=6, decimal_places=2, null=True, blank=True)
+	# Dépôt de rattachement: départ et retour des tournées (optimisation d'itinéraire)
+	warehouse = models.ForeignKey("Warehouse", on_delete=models.SET_NULL, null=True, blank=True, related_name="buses")
 
 	def __str__(self) -> str:
 		return self.name
@@ -142,10 +152,18 @@ class WarehouseBottleStock(TimeStampedModel):
 	warehouse = models.ForeignKey(Warehouse, on_delete=models.CASCADE, related_name="stocks")
 	bottle_type = models.ForeignKey(GasBottleType, on_delete=models.CASCADE)
 	quantity = models.IntegerField(default=0)
+	# Bouteilles vides (retours clients), distinctes des pleines
+	empty_quantity = models.IntegerField(default=0)
+	# Pleines promises à des commandes validées non encore livrées (core.stock.reserve_orders)
+	reserved_quantity = models.PositiveIntegerField(default=0)
 
 	class Meta:
 		unique_together = ("warehouse", "bottle_type")
 
+	@property
+	def available_quantity(self) -> int:
+		return self.quantity - self.reserved_quantity
+
 	def __str__(self) -> str:
 		return f"{self.warehouse} - {self.bottle_type}: {self.quantity}"
 
@@ -154,10 +172,18 @@ class BusBottleStock(TimeStampedModel):
 	bus = models.ForeignKey(Bus, on_delete=models.CASCADE, related_name="stocks")
 	bottle_type = models.ForeignKey(GasBottleType, on_delete=models.CASCADE)
 	quantity = models.IntegerField(default=0)
+	# Bouteilles vides (retours clients), distinctes des pleines
+	empty_quantity = models.IntegerField(default=0)
+	# Pleines promises à des commandes validées non encore livrées (core.stock.reserve_orders)
+	reserved_quantity = models.PositiveIntegerField(default=0)
 
 	class Meta:
 		unique_together = ("bus", "bottle_type")
 
+	@property
+	def available_quantity(self) -> int:
+		return self.quantity - self.reserved_quantity
+
 	def __str__(self) -> str:
 		return f"{self.bus} - {self.bottle_type}: {self.quantity}"
 
@@ -170,6 +196,106 @@ class Wallet(TimeStampedModel):
 		return f"Wallet {self.client} - {self.balance_mru} MRU"
 
 
+class WalletEntry(TimeStampedModel):
+	"""Écriture (immuable) du grand livre d'un portefeuille client.
+
+	Chaque écriture est la jambe « portefeuille » d'une opération en partie
+	double: ``amount_mru`` (positif = crédit du client) est contrebalancé par
+	le même montant de signe opposé sur ``counter_account``.
+	"""
+
+	TYPE_PAYMENT = "payment"
+	TYPE_ORDER = "order"
+	TYPE_DEPOSIT = "deposit"
+	TYPE_DEPOSIT_REFUND = "deposit_refund"
+	TYPE_ADJUSTMENT = "adjustment"
+
+	ENTRY_TYPE_CHOICES = [
+		(TYPE_PAYMENT, "Paiement"),
+		(TYPE_ORDER, "Commande livrée"),
+		(TYPE_DEPOSIT, "Consigne"),
+		(TYPE_DEPOSIT_REFUND, "Remboursement de consigne"),
+		(TYPE_ADJUSTMENT, "Ajustement"),
+	]
+
+	ACCOUNT_CASH = "cash"
+	ACCOUNT_SALES = "sales"
+	ACCOUNT_DEPOSITS = "deposits"
+	ACCOUNT_ADJUSTMENTS = "adjustments"
+
+	ACCOUNT_CHOICES = [
+		(ACCOUNT_CASH, "Encaissements"),
+		(ACCOUNT_SALES, "Ventes"),
+		(ACCOUNT_DEPOSITS, "Consignes"),
+		(ACCOUNT_ADJUSTMENTS, "Ajustements"),
+	]
+
+	wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name="entries")
+	entry_type = models.CharField(max_length=20, choices=ENTRY_TYPE_CHOICES)
+	counter_account = models.CharField(max_length=20, choices=ACCOUNT_CHOICES)
+	amount_mru = models.DecimalField(max_digits=14, decimal_places=2)
+	balance_after_mru = models.DecimalField(max_digits=14, decimal_places=2)
+	payment = models.ForeignKey("Payment", on_delete=models.SET_NULL, null=True, blank=True, related_name="wallet_entries")
+	order = models.ForeignKey("ClientOrder", on_delete=models.SET_NULL, null=True, blank=True, related_name="wallet_entries")
+	note = models.TextField(blank=True)
+	created_by = models.ForeignKey(
+		settings.AUTH_USER_MODEL,
+		on_delete=models.SET_NULL,
+		null=True,
+		blank=True,
+		related_name="wallet_entries",
+	)
+
+	class Meta:
+		ordering = ["-created_at", "-id"]
+		indexes = [
+			models.Index(fields=["wallet", "created_at", "id"]),
+		]
+		constraints = [
+			# Un paiement / une commande ne produit chaque type d'écriture qu'une seule fois
+			models.UniqueConstraint(
+				fields=["payment", "entry_type"],
+				condition=models.Q(payment__isnull=False),
+				name="unique_wallet_entry_per_payment",
+			),
+			models.UniqueConstraint(
+				fields=["order", "entry_type"],
+				condition=models.Q(order__isnull=False),
+				name="unique_wallet_entry_per_order",
+			),
+		]
+
+	def __str__(self) -> str:
+		return f"{self.wallet} {self.entry_type} {self.amount_mru} MRU"
+
+
+class WalletCheckpoint(TimeStampedModel):
+	"""Solde arrêté d'un portefeuille à une date, jusqu'à une écriture donnée incluse."""
+
+	wallet = models.ForeignKey(Wallet, on_delete=models.CASCADE, related_name="checkpoints")
+	as_of = models.DateTimeField()
+	last_entry = models.ForeignKey(WalletEntry, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	balance_mru = models.DecimalField(max_digits=14, decimal_places=2)
+
+	class Meta:
+		ordering = ["-as_of"]
+		indexes = [
+			models.Index(fields=["wallet", "as_of"]),
+		]
+
+	def __str__(self) -> str:
+		return f"{self.wallet} @ {self.as_of}: {self.balance_mru} MRU"
+
+
+_protected_storage = FileSystemStorage(location=getattr(settings, "PROTECTED_MEDIA_ROOT", settings.BASE_DIR / "protected_media"))
+
+
+def protected_storage():
+	"""Stockage des fichiers privés (reçus), hors MEDIA_ROOT: jamais servi par la
+	route publique /media/, uniquement par les vues qui contrôlent l'accès."""
+	return _protected_storage
+
+
 class Payment(TimeStampedModel):
 	PENDING = "pending"
 	PENDING_ADMIN = "pending_admin"
@@ -201,7 +327,11 @@ class Payment(TimeStampedModel):
 	order = models.ForeignKey("ClientOrder", on_delete=models.SET_NULL, null=True, blank=True, related_name="payments")
 	amount_mru = models.DecimalField(max_digits=14, decimal_places=2)
 	method = models.CharField(max_length=50, choices=METHOD_CHOICES, blank=True)
-	receipt_image = models.ImageField(upload_to="receipts/", null=True, blank=True)
+	receipt_image = models.ImageField(upload_to="receipts/", storage=protected_storage, null=True, blank=True)
+	# Empreinte du reçu original (dédoublonnage) et variantes générées en arrière-plan
+	receipt_sha256 = models.CharField(max_length=64, blank=True, db_index=True)
+	receipt_display = models.ImageField(upload_to="receipts/display/", storage=protected_storage, null=True, blank=True)
+	receipt_thumbnail = models.ImageField(upload_to="receipts/thumbs/", storage=protected_storage, null=True, blank=True)
 	status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
 	rejection_reason = models.TextField(blank=True)
 
@@ -212,6 +342,9 @@ class Payment(TimeStampedModel):
 		permissions = [
 			("can_validate_payments", "Peut valider ou rejeter les paiements"),
 		]
+		indexes = [
+			models.Index(fields=["client", "created_at", "id"]),
+		]
 
 
 class Tour(TimeStampedModel):
@@ -241,14 +374,45 @@ class TourStop(TimeStampedModel):
 	status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=PENDING)
 	delivered_bottles = models.IntegerField(default=0)
 	returned_bottles = models.IntegerField(default=0)
+	# Présence du bus chez le client, détectée par GPS (core.arrivals)
+	arrived_at = models.DateTimeField(null=True, blank=True)
+	departed_at = models.DateTimeField(null=True, blank=True)
 
 	class Meta:
 		ordering = ["order_index"]
+		indexes = [
+			models.Index(fields=["client", "created_at", "id"]),
+		]
 
 	def __str__(self) -> str:
 		return f"{self.tour} - {self.client} ({self.status})"
 
 
+class TourProgress(models.Model):
+	"""Avancement d'une tournée (modèle de lecture), tenu à jour par core.progress à chaque écriture d'arrêt."""
+
+	tour = models.OneToOneField(Tour, on_delete=models.CASCADE, primary_key=True, related_name="progress")
+	pending_stops = models.PositiveIntegerField(default=0)
+	completed_stops = models.PositiveIntegerField(default=0)
+	skipped_stops = models.PositiveIntegerField(default=0)
+	delivered_bottles = models.IntegerField(default=0)
+	returned_bottles = models.IntegerField(default=0)
+	last_stop_at = models.DateTimeField(null=True, blank=True)
+	next_client = models.ForeignKey(Client, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	updated_at = models.DateTimeField(auto_now=True)
+	# Présence en cours du bus près d'un arrêt (core.arrivals), hors FIELDS de core.progress
+	presence_stop = models.ForeignKey("TourStop", on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	presence_since = models.DateTimeField(null=True, blank=True)
+	presence_seen_at = models.DateTimeField(null=True, blank=True)
+
+	def __str__(self) -> str:
+		return f"{self.tour}: {self.completed_stops + self.skipped_stops}/{self.total_stops}"
+
+	@property
+	def total_stops(self) -> int:
+		return self.pending_stops + self.completed_stops + self.skipped_stops
+
+
 class BusPosition(TimeStampedModel):
 	STATUS_ON_TOUR = "on_tour"
 	STATUS_PAUSED = "paused"
@@ -339,9 +503,15 @@ class ClientOrder(TimeStampedModel):
 		blank=True,
 		related_name="delivered_orders",
 	)
+	# Emplacement dont le stock est réservé pour la commande (validée, non livrée)
+	reserved_bus = models.ForeignKey(Bus, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	reserved_warehouse = models.ForeignKey(Warehouse, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
 
 	class Meta:
 		ordering = ["-created_at"]
+		indexes = [
+			models.Index(fields=["client", "created_at", "id"]),
+		]
 
 	def __str__(self) -> str:
 		return f"Commande {self.id} - {self.client} - {self.quantity} x {self.bottle_type}"
@@ -362,6 +532,9 @@ class PaymentStatusHistory(TimeStampedModel):
 
 	class Meta:
 		ordering = ["-created_at"]
+		indexes = [
+			models.Index(fields=["payment", "created_at", "id"]),
+		]
 
 	def __str__(self) -> str:
 		return f"Payment {self.payment_id}: {self.previous_status} -> {self.new_status}"
@@ -389,13 +562,129 @@ class ActivityLog(TimeStampedModel):
 	)
 	model_name = models.CharField(max_length=100)
 	object_id = models.CharField(max_length=50, blank=True)
+	# Référence entière de l'objet visé (historique par objet via index composite)
+	content_type = models.ForeignKey(ContentType, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	object_pk = models.PositiveBigIntegerField(null=True, blank=True)
 	action = models.CharField(max_length=20, choices=ACTION_CHOICES)
 	description = models.TextField(blank=True)
 	data = models.JSONField(null=True, blank=True)
 
 	class Meta:
 		ordering = ["-created_at"]
+		indexes = [
+			models.Index(fields=["content_type", "object_pk", "created_at", "id"]),
+			models.Index(fields=["created_at"]),
+		]
 
 	def __str__(self) -> str:
 		return f"{self.model_name}({self.object_id}) - {self.action}"
 
+
+class StockMovement(TimeStampedModel):
+	"""Mouvement (immuable) de bouteilles entre dépôts, bus et clients.
+
+	Les stocks courants (WarehouseBottleStock, BusBottleStock,
+	ClientBottleBalance) sont mis à jour dans la même transaction; ils
+	peuvent être reconstruits à partir des mouvements (commande reconcile_stock).
+	"""
+
+	TYPE_LOAD = "load"
+	TYPE_DELIVERY = "delivery"
+	TYPE_RETURN = "return"
+	TYPE_UNLOAD = "unload"
+	TYPE_ADJUSTMENT = "adjustment"
+
+	TYPE_CHOICES = [
+		(TYPE_LOAD, "Chargement dépôt -> bus"),
+		(TYPE_DELIVERY, "Livraison bus -> client"),
+		(TYPE_RETURN, "Retour de vides client -> bus"),
+		(TYPE_UNLOAD, "Déchargement bus -> dépôt"),
+		(TYPE_ADJUSTMENT, "Correction d'inventaire"),
+	]
+
+	movement_type = models.CharField(max_length=20, choices=TYPE_CHOICES)
+	bottle_type = models.ForeignKey(GasBottleType, on_delete=models.PROTECT, related_name="movements")
+	quantity = models.PositiveIntegerField()
+	empty = models.BooleanField(default=False)
+	from_warehouse = models.ForeignKey(Warehouse, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	from_bus = models.ForeignKey(Bus, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	from_client = models.ForeignKey(Client, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	to_warehouse = models.ForeignKey(Warehouse, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	to_bus = models.ForeignKey(Bus, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	to_client = models.ForeignKey(Client, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	order = models.ForeignKey(ClientOrder, on_delete=models.SET_NULL, null=True, blank=True, related_name="stock_movements")
+	note = models.TextField(blank=True)
+	created_by = models.ForeignKey(
+		settings.AUTH_USER_MODEL,
+		on_delete=models.SET_NULL,
+		null=True,
+		blank=True,
+		related_name="stock_movements",
+	)
+
+	class Meta:
+		ordering = ["-created_at", "-id"]
+		indexes = [
+			models.Index(fields=["bottle_type", "created_at"]),
+			models.Index(fields=["from_bus", "created_at"]),
+			models.Index(fields=["to_bus", "created_at"]),
+		]
+
+	def __str__(self) -> str:
+		kind = "vides" if self.empty else "pleines"
+		return f"{self.get_movement_type_display()}: {self.quantity} x {self.bottle_type} ({kind})"
+
+
+class IdempotencyKey(models.Model):
+	"""Réponse d'un POST mobile mémorisée sous sa clé ``Idempotency-Key``.
+
+	Un nouvel envoi de la même requête (réseau coupé avant la réponse) reçoit
+	la réponse d'origine sans recréer l'objet. Les clés expirent après
+	IDEMPOTENCY_KEY_TTL (commande purge_idempotency_keys).
+	"""
+
+	user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="+")
+	key = models.CharField(max_length=64)
+	endpoint = models.CharField(max_length=200)
+	# sha256 du corps de la requête: une clé réutilisée pour une autre requête est refusée
+	fingerprint = models.CharField(max_length=64)
+	status_code = models.PositiveSmallIntegerField(null=True, blank=True)
+	response_body = models.JSONField(null=True, blank=True)
+	created_at = models.DateTimeField(auto_now_add=True)
+	expires_at = models.DateTimeField(db_index=True)
+
+	class Meta:
+		constraints = [
+			models.UniqueConstraint(fields=["user", "key", "endpoint"], name="unique_idempotency_key"),
+		]
+
+	def __str__(self) -> str:
+		return f"{self.endpoint} [{self.key}]"
+
+
+class DriverNotification(TimeStampedModel):
+	"""Message poussé dans le fil du chauffeur (arrêt ajouté à sa tournée, ...)."""
+
+	KIND_NEW_STOP = "new_stop"
+	KIND_ARRIVAL = "arrival"
+
+	KIND_CHOICES = [
+		(KIND_NEW_STOP, "Nouvel arrêt"),
+		(KIND_ARRIVAL, "Arrêt à confirmer"),
+	]
+
+	driver = models.ForeignKey(Driver, on_delete=models.CASCADE, related_name="notifications")
+	kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+	tour = models.ForeignKey(Tour, on_delete=models.CASCADE, null=True, blank=True, related_name="+")
+	stop = models.ForeignKey(TourStop, on_delete=models.SET_NULL, null=True, blank=True, related_name="+")
+	message = models.TextField()
+	data = models.JSONField(null=True, blank=True)
+
+	class Meta:
+		ordering = ["-id"]
+		indexes = [
+			models.Index(fields=["driver", "id"]),
+		]
+
+	def __str__(self) -> str:
+		return f"{self.driver} - {self.kind}: {self.message}"
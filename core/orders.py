@@ -0,0 +1,142 @@
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, PermissionDenied
+
+from .audit import audit_writer, describe_changes
+from .models import ActivityLog, ClientOrder
+from .payments import can_validate_payments
+
+
+# Machine à états: pending -> validated -> delivered, annulation possible avant livraison.
+# La livraison n'est enregistrée que par le chauffeur (core.deliveries).
+ALLOWED_TRANSITIONS = {
+	ClientOrder.PENDING: (ClientOrder.VALIDATED, ClientOrder.CANCELLED, ClientOrder.DELIVERED),
+	ClientOrder.VALIDATED: (ClientOrder.CANCELLED, ClientOrder.DELIVERED),
+	ClientOrder.DELIVERED: (),
+	ClientOrder.CANCELLED: (),
+}
+
+# Décisions du back-office
+FINANCE_STATUSES = (ClientOrder.VALIDATED, ClientOrder.CANCELLED)
+
+RESULT_OK = "ok"
+RESULT_NOT_FOUND = "not_found"
+RESULT_CONFLICT = "conflict"
+
+# Émis dans la transaction, uniquement pour un changement de statut effectif.
+# Arguments: orders (commandes au nouveau statut), previous_statuses ({id: ancien statut}),
+# new_status, user. Un seul envoi pour un lot.
+order_transitioned = Signal()
+
+
+class OrderTransitionConflict(APIException):
+	status_code = status.HTTP_409_CONFLICT
+	default_detail = "Le statut de la commande a été modifié entre-temps."
+	default_code = "conflict"
+
+
+def sources_for(new_status: str) -> tuple:
+	"""Statuts depuis lesquels ``new_status`` est atteignable."""
+	return tuple(source for source, targets in ALLOWED_TRANSITIONS.items() if new_status in targets)
+
+
+def check_decision(new_status: str, user):
+	"""Vérifie que l'utilisateur peut prendre cette décision (403 / 409 sinon)."""
+	if not can_validate_payments(user):
+		raise PermissionDenied("Seul un utilisateur financier peut modifier une commande.")
+	if new_status not in FINANCE_STATUSES:
+		raise OrderTransitionConflict("La livraison est enregistrée par le chauffeur.")
+
+
+def check_transition(old_status: str, new_status: str, user):
+	"""Vérifie qu'une décision du back-office est permise depuis ``old_status``."""
+	check_decision(new_status, user)
+	if new_status not in ALLOWED_TRANSITIONS.get(old_status, ()):
+		raise OrderTransitionConflict(f"Transition {old_status} -> {new_status} non autorisée.")
+
+
+def notify(orders, previous_statuses: dict, new_status: str, user):
+	"""Diffuse l'événement de transition (paiements, réservations de stock, ...)."""
+	if orders:
+		order_transitioned.send(
+			sender=ClientOrder,
+			orders=orders,
+			previous_statuses=previous_statuses,
+			new_status=new_status,
+			user=user,
+		)
+
+
+def transition(order, new_status: str, user, expected: str | None = None, changes: dict | None = None):
+	"""Applique une décision par ``UPDATE ... WHERE id=... AND status=<attendu>``.
+
+	Si le statut a changé depuis la lecture, aucune ligne n'est touchée et
+	OrderTransitionConflict (409) est levée; sinon l'événement est émis dans la
+	même transaction.
+	"""
+	expected = expected or order.status
+	check_transition(expected, new_status, user)
+	now = timezone.now()
+	with transaction.atomic():
+		if not ClientOrder.objects.filter(pk=order.pk, status=expected).update(status=new_status, updated_at=now):
+			raise OrderTransitionConflict()
+		order.status = new_status
+		order.updated_at = now
+		all_changes = dict(changes or {})
+		all_changes["status"] = {"old": expected, "new": new_status}
+		audit_writer.log(
+			order,
+			ActivityLog.ACTION_UPDATE,
+			description=describe_changes(changes or {}, prefix=f"Changement de statut commande {expected} -> {new_status}"),
+			data={"before_status": expected, "after_status": new_status, "changes": all_changes},
+			user=user,
+		)
+		notify([order], {order.pk: expected}, new_status, user)
+	return order
+
+
+def bulk_transition(ids, new_status: str, user) -> list[dict]:
+	"""Valide ou annule un lot de commandes en une transaction.
+
+	Les commandes sont verrouillées (``select_for_update``) à la lecture, puis
+	un UPDATE conditionnel par statut de départ: les lignes modifiées sont
+	exactement celles des groupes mis à jour. L'événement est émis
+	une fois pour le lot et le journal inséré en masse. Retourne un résultat
+	par id demandé.
+	"""
+	ids = list(dict.fromkeys(ids))
+	check_decision(new_status, user)
+	sources = sources_for(new_status)
+	now = timezone.now()
+	results = {pk: {"id": pk, "result": RESULT_NOT_FOUND, "previous_status": None, "status": None} for pk in ids}
+
+	with transaction.atomic(), audit_writer.batch():
+		current = dict(ClientOrder.objects.select_for_update().filter(pk__in=ids).order_by("pk").values_list("id", "status"))
+		by_source = {}
+		for pk, current_status in current.items():
+			results[pk].update(previous_status=current_status, status=current_status, result=RESULT_CONFLICT)
+			if current_status in sources:
+				by_source.setdefault(current_status, []).append(pk)
+		applied_ids = []
+		for source, group in by_source.items():
+			if ClientOrder.objects.filter(pk__in=group, status=source).update(status=new_status, updated_at=now):
+				applied_ids.extend(group)
+
+		applied = list(ClientOrder.objects.filter(pk__in=applied_ids).select_related("client", "bottle_type"))
+		previous_statuses = {}
+		for order in applied:
+			previous_statuses[order.pk] = current[order.pk]
+			results[order.pk].update(status=new_status, result=RESULT_OK)
+			audit_writer.log(
+				order,
+				ActivityLog.ACTION_UPDATE,
+				description=f"Changement de statut commande {current[order.pk]} -> {new_status} (lot)",
+				data={"before_status": current[order.pk], "after_status": new_status},
+				user=user,
+			)
+		notify(applied, previous_statuses, new_status, user)
+
+	return [results[pk] for pk in ids]
@@ -0,0 +1,161 @@
+from django.db import transaction
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, PermissionDenied
+
+from . import ledger
+from .audit import audit_writer, describe_changes
+from .models import ActivityLog, Payment, PaymentStatusHistory
+
+
+# Machine à états: pending -> pending_admin -> validated / rejected.
+# La finance peut aussi trancher directement un paiement pending (paiement sans reçu).
+ALLOWED_TRANSITIONS = {
+	Payment.PENDING: (Payment.PENDING_ADMIN, Payment.VALIDATED, Payment.REJECTED),
+	Payment.PENDING_ADMIN: (Payment.VALIDATED, Payment.REJECTED),
+	Payment.VALIDATED: (),
+	Payment.REJECTED: (),
+}
+
+# Décisions réservées à la finance
+FINANCE_STATUSES = (Payment.VALIDATED, Payment.REJECTED)
+
+RESULT_OK = "ok"
+RESULT_NOT_FOUND = "not_found"
+RESULT_CONFLICT = "conflict"
+
+
+class PaymentTransitionConflict(APIException):
+	status_code = status.HTTP_409_CONFLICT
+	default_detail = "Le statut du paiement a été modifié entre-temps."
+	default_code = "conflict"
+
+
+def can_validate_payments(user) -> bool:
+	return bool(user and user.is_authenticated and (user.is_superuser or user.has_perm("core.can_validate_payments")))
+
+
+def sources_for(new_status: str) -> tuple:
+	"""Statuts depuis lesquels ``new_status`` est atteignable."""
+	return tuple(source for source, targets in ALLOWED_TRANSITIONS.items() if new_status in targets)
+
+
+def check_transition(old_status: str, new_status: str, user):
+	"""Vérifie qu'une transition est permise pour l'utilisateur (403 / 409 sinon)."""
+	if new_status in FINANCE_STATUSES and not can_validate_payments(user):
+		raise PermissionDenied("Seul un utilisateur financier peut valider ou rejeter un paiement.")
+	if new_status not in ALLOWED_TRANSITIONS.get(old_status, ()):
+		raise PaymentTransitionConflict(f"Transition {old_status} -> {new_status} non autorisée.")
+
+
+def _record_effects(payment, previous_status: str, new_status: str, user, note: str, description: str, data: dict, history: list | None = None):
+	"""Historique, journal et écriture de portefeuille d'une transition appliquée.
+
+	L'historique est inséré dans la transaction de la transition; un lot passe
+	``history`` pour l'insérer en une fois.
+	"""
+	entry = PaymentStatusHistory(
+		payment_id=payment.pk,
+		previous_status=previous_status,
+		new_status=new_status,
+		changed_by=user if user is not None and user.is_authenticated else None,
+		note=note,
+	)
+	if history is None:
+		audit_writer.write_history([entry])
+	else:
+		history.append(entry)
+	audit_writer.log(payment, ActivityLog.ACTION_UPDATE, description=description, data=data, user=user)
+	if new_status == Payment.VALIDATED:
+		ledger.credit_payment(payment, user=user)
+
+
+def transition(payment, new_status: str, user, note: str = "", expected: str | None = None, reason: str | None = None, changes: dict | None = None):
+	"""Applique une transition de statut par ``UPDATE ... WHERE id=... AND status=<attendu>``.
+
+	Une seule écriture, sans relecture: si le statut a changé depuis la lecture
+	(clic concurrent), aucune ligne n'est touchée et PaymentTransitionConflict
+	(409) est levée. ``changes`` (autres champs modifiés dans la même requête)
+	est joint à l'entrée du journal.
+	"""
+	expected = expected or payment.status
+	check_transition(expected, new_status, user)
+	now = timezone.now()
+	fields = {"status": new_status, "updated_at": now}
+	if reason is not None:
+		fields["rejection_reason"] = reason
+
+	with transaction.atomic():
+		if not Payment.objects.filter(pk=payment.pk, status=expected).update(**fields):
+			raise PaymentTransitionConflict()
+		for name, value in fields.items():
+			setattr(payment, name, value)
+		all_changes = dict(changes or {})
+		all_changes["status"] = {"old": expected, "new": new_status}
+		_record_effects(
+			payment,
+			expected,
+			new_status,
+			user,
+			note,
+			describe_changes(changes or {}, prefix=f"Changement de statut {expected} -> {new_status}"),
+			{"changes": all_changes},
+		)
+	return payment
+
+
+def bulk_decide(ids, new_status: str, user, reason: str = "", note: str = "Décision groupée via le back-office") -> list[dict]:
+	"""Valide ou rejette un lot de paiements en une transaction.
+
+	Un UPDATE conditionnel par statut de départ (``WHERE id IN (...) AND
+	status = <départ>``) sur des lignes verrouillées à la lecture
+	(``select_for_update``): les lignes modifiées sont exactement celles des
+	groupes mis à jour. L'historique est inséré en masse
+	dans la transaction, le journal via le lot d'audit. Retourne un résultat
+	par id demandé.
+	"""
+	ids = list(dict.fromkeys(ids))
+	sources = sources_for(new_status)
+	now = timezone.now()
+	results = {pk: {"id": pk, "result": RESULT_NOT_FOUND, "previous_status": None, "status": None} for pk in ids}
+
+	with transaction.atomic(), audit_writer.batch():
+		current = {
+			pk: (current_status, client_id, amount)
+			for pk, current_status, client_id, amount in Payment.objects.select_for_update()
+			.filter(pk__in=ids)
+			.order_by("pk")
+			.values_list("id", "status", "client_id", "amount_mru")
+		}
+		by_source = {}
+		for pk, (current_status, _, _) in current.items():
+			results[pk].update(previous_status=current_status, status=current_status, result=RESULT_CONFLICT)
+			if current_status in sources:
+				by_source.setdefault(current_status, []).append(pk)
+
+		fields = {"status": new_status, "updated_at": now}
+		if new_status == Payment.REJECTED:
+			fields["rejection_reason"] = reason
+		applied = []
+		for source, group in by_source.items():
+			if Payment.objects.filter(pk__in=group, status=source).update(**fields):
+				applied.extend(group)
+		history = []
+		for pk in applied:
+			previous_status, client_id, amount = current[pk]
+			results[pk].update(status=new_status, result=RESULT_OK)
+			payment = Payment(pk=pk, client_id=client_id, amount_mru=amount, status=new_status)
+			_record_effects(
+				payment,
+				previous_status,
+				new_status,
+				user,
+				f"{note} - {reason}" if reason else note,
+				f"Changement de statut {previous_status} -> {new_status} (lot)",
+				{"changes": {"status": {"old": previous_status, "new": new_status}}, "reason": reason or None},
+				history=history,
+			)
+		audit_writer.write_history(history)
+
+	return [results[pk] for pk in ids]
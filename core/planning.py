@@ -0,0 +1,211 @@
+import math
+import time
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import distances, progress, routing, stock
+from .audit import audit_writer
+from .models import ActivityLog, Bus, BusBottleStock, ClientOrder, Tour, TourStop
+
+
+class _Load:
+	"""Chargement prévu d'un bus: bouteilles par type, dans la limite de sa capacité et de son stock."""
+
+	def __init__(self, bus, stock: dict, share: int | None = None):
+		self.bus = bus
+		self.capacity = bus.capacity
+		# Capacité inconnue: part égale de la demande du jour, pour que le balayage passe au bus suivant
+		self.share = share if bus.capacity is None else None
+		# Bus déjà chargé: limite par type (pleines disponibles); sinon, capacité seule
+		self.stock = stock
+		self.clients = []
+		self.bottles = 0
+		self.by_type = defaultdict(int)
+
+	def limit(self, shared: bool = True) -> int | None:
+		return self.capacity if self.capacity is not None else (self.share if shared else None)
+
+	def fits(self, demand: dict, shared: bool = True) -> bool:
+		total = sum(demand.values())
+		limit = self.limit(shared)
+		if limit is not None and self.bottles + total > limit:
+			return False
+		if self.stock:
+			return all(self.by_type[bottle_type] + quantity <= self.stock.get(bottle_type, 0) for bottle_type, quantity in demand.items())
+		return True
+
+	def full(self, bottles: int) -> bool:
+		limit = self.limit()
+		return limit is not None and self.bottles + bottles > limit
+
+	def add(self, client_id: int, demand: dict):
+		self.clients.append(client_id)
+		self.bottles += sum(demand.values())
+		for bottle_type, quantity in demand.items():
+			self.by_type[bottle_type] += quantity
+
+
+def _latest_sectors(field: str, ids) -> dict:
+	"""Secteur de la dernière tournée de chaque client / bus (champ ``client_id`` ou ``bus_id``)."""
+	if field == "bus_id":
+		rows = Tour.objects.filter(bus_id__in=ids).exclude(sector="").order_by("bus_id", "-date", "-id").values_list("bus_id", "sector")
+	else:
+		rows = (
+			TourStop.objects.filter(client_id__in=ids)
+			.exclude(tour__sector="")
+			.order_by("client_id", "-tour__date", "-id")
+			.values_list("client_id", "tour__sector")
+		)
+	sectors = {}
+	for key, sector in rows.iterator(chunk_size=2000):
+		sectors.setdefault(key, sector)
+	return sectors
+
+
+def plan_day(day=None, user=None, dry_run: bool = False, time_budget: float | None = None) -> dict:
+	"""Crée les tournées du jour à partir des commandes validées non encore planifiées.
+
+	Un arrêt par client (toutes ses commandes). Les clients sont d'abord
+	confiés au bus qui dessert habituellement leur secteur (secteur de leur
+	dernière tournée), puis les autres par balayage angulaire autour du dépôt:
+	des parts de « camembert » contiguës, une par bus, dans la limite de
+	``Bus.capacity`` (à défaut, d'une part égale de la demande du jour) et du
+	stock par type d'un bus déjà chargé. Chaque tournée
+	est ensuite ordonnée (core.routing) et tout est inséré en deux bulk_create;
+	les réservations tenues par un dépôt sont alors chargées sur le bus retenu.
+	"""
+	day = day or timezone.localdate()
+	if time_budget is None:
+		time_budget = getattr(settings, "TOUR_PLANNING_TIME_BUDGET", 10.0)
+	started = time.monotonic()
+
+	planned = TourStop.objects.filter(tour__date=day).values("client_id")
+	orders = (
+		ClientOrder.objects.filter(status=ClientOrder.VALIDATED)
+		.exclude(client_id__in=planned)
+		.values_list("client_id", "bottle_type_id", "quantity", "client__gps_latitude", "client__gps_longitude")
+	)
+	demand = defaultdict(lambda: defaultdict(int))
+	points = {}
+	for client_id, bottle_type_id, quantity, latitude, longitude in orders.iterator(chunk_size=2000):
+		demand[client_id][bottle_type_id] += quantity
+		if latitude is not None and longitude is not None:
+			points[client_id] = (float(latitude), float(longitude))
+
+	buses = list(Bus.objects.exclude(tours__date=day).select_related("warehouse", "driver").order_by("id"))
+	available = defaultdict(dict)
+	for row in BusBottleStock.objects.filter(bus__in=buses).values("bus_id", "bottle_type_id", "quantity", "reserved_quantity"):
+		available[row["bus_id"]][row["bottle_type_id"]] = max(row["quantity"] - row["reserved_quantity"], 0)
+	# Demande non couverte par les capacités connues, répartie également entre les bus sans capacité
+	unknown = sum(1 for bus in buses if bus.capacity is None)
+	uncovered = sum(sum(quantities.values()) for quantities in demand.values()) - sum(bus.capacity for bus in buses if bus.capacity is not None)
+	share = math.ceil(max(uncovered, 0) / unknown) if unknown else None
+	loads = [_Load(bus, available.get(bus.pk, {}), share) for bus in buses]
+
+	# 1. Secteur habituel
+	client_sectors = _latest_sectors("client_id", list(demand))
+	bus_sectors = _latest_sectors("bus_id", [bus.pk for bus in buses])
+	loads_by_sector = defaultdict(list)
+	for load in loads:
+		if load.bus.pk in bus_sectors:
+			loads_by_sector[bus_sectors[load.bus.pk]].append(load)
+	remaining = []
+	for client_id in demand:
+		for load in loads_by_sector.get(client_sectors.get(client_id), ()):
+			if load.fits(demand[client_id]):
+				load.add(client_id, demand[client_id])
+				break
+		else:
+			remaining.append(client_id)
+
+	# 2. Balayage angulaire des clients restants autour du centre des dépôts
+	depots = [routing.coordinates(load.bus.warehouse) for load in loads if routing.coordinates(load.bus.warehouse)]
+	located = [client_id for client_id in remaining if client_id in points]
+	if depots:
+		center = (sum(lat for lat, _ in depots) / len(depots), sum(lon for _, lon in depots) / len(depots))
+	elif located:
+		center = (sum(points[c][0] for c in located) / len(located), sum(points[c][1] for c in located) / len(located))
+	else:
+		center = (0.0, 0.0)
+	scale = math.cos(math.radians(center[0]))
+	located.sort(key=lambda c: math.atan2(points[c][0] - center[0], (points[c][1] - center[1]) * scale))
+	unassigned = []
+	current = 0
+	for client_id in located + [client_id for client_id in remaining if client_id not in points]:
+		for offset in range(len(loads)):
+			load = loads[(current + offset) % len(loads)]
+			if load.fits(demand[client_id]):
+				load.add(client_id, demand[client_id])
+				# Bus suivant seulement quand le bus courant est plein (pas pour un type de bouteille manquant)
+				if offset and loads[current].full(sum(demand[client_id].values())):
+					current = (current + offset) % len(loads)
+				break
+		else:
+			# Parts égales dépassées (demandes indivisibles): bus sans capacité connue le moins chargé
+			spare = [load for load in loads if load.fits(demand[client_id], shared=False)]
+			if spare:
+				min(spare, key=lambda load: load.bottles).add(client_id, demand[client_id])
+			else:
+				unassigned.append(client_id)
+
+	# 3. Ordre de visite et insertion groupée
+	used = [load for load in loads if load.clients]
+	budget = time_budget / max(len(used), 1)
+	tours, stops, summary_tours = [], [], []
+	for load in used:
+		depot = routing.coordinates(load.bus.warehouse)
+		with_point = [c for c in load.clients if c in points]
+		depot_key = distances.node(load.bus.warehouse) if depot else None
+		keys = [(distances.CLIENT, c) for c in with_point] + [depot_key, depot_key]
+		order, _, distance = routing.solve([points[c] for c in with_point], depot, depot, budget, keys=keys)
+		sequence = [with_point[i] for i in order] + [c for c in load.clients if c not in points]
+		driver = getattr(load.bus, "driver", None)
+		tour = Tour(date=day, bus=load.bus, driver=driver, sector=bus_sectors.get(load.bus.pk, ""))
+		tours.append((tour, sequence))
+		summary_tours.append(
+			{
+				"bus": load.bus.pk,
+				"bus_name": load.bus.name,
+				"driver": driver.pk if driver else None,
+				"stops": len(sequence),
+				"bottles": load.bottles,
+				"capacity": load.capacity,
+				"distance_km": round(distance, 3),
+			}
+		)
+
+	summary = {
+		"date": day.isoformat(),
+		"clients": len(demand),
+		"tours": summary_tours,
+		"unassigned_clients": unassigned,
+		"dry_run": dry_run,
+	}
+	if not dry_run and tours:
+		with transaction.atomic():
+			created = Tour.objects.bulk_create([tour for tour, _ in tours])
+			for tour, (_, sequence) in zip(created, tours):
+				stops.extend(TourStop(tour=tour, client_id=client_id, order_index=index) for index, client_id in enumerate(sequence, start=1))
+			TourStop.objects.bulk_create(stops, batch_size=1000)
+			progress.refresh(tour.pk for tour in created)
+			# Réservations prises sur un dépôt avant la planification: chargées sur le bus retenu
+			summary["loaded_orders"] = stock.load_reservations([tour.pk for tour in created], user=user)
+			for tour, entry in zip(created, summary_tours):
+				entry["tour"] = tour.pk
+			audit_writer.record(
+				ActivityLog(
+					user=user if user is not None and user.is_authenticated else None,
+					model_name=Tour._meta.label,
+					action=ActivityLog.ACTION_CREATE,
+					description=(
+						f"Planification du {day.isoformat()}: {len(created)} tournée(s), {len(stops)} arrêt(s), "
+						f"{len(unassigned)} client(s) non planifié(s)"
+					),
+					data={**summary, "unassigned_clients": unassigned[:500]},
+				)
+			)
+	summary["elapsed_ms"] = round((time.monotonic() - started) * 1000, 1)
+	return summary
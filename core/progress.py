@@ -0,0 +1,96 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Count, Max, Q, Sum
+from django.utils import timezone
+
+from . import arrivals
+from .models import Tour, TourProgress, TourStop
+
+
+FIELDS = [
+	"pending_stops",
+	"completed_stops",
+	"skipped_stops",
+	"delivered_bottles",
+	"returned_bottles",
+	"last_stop_at",
+	"next_client",
+	"updated_at",
+]
+
+
+def refresh(tour_ids) -> int:
+	"""Recalcule l'avancement des tournées données: une agrégation, une requête d'arrêts suivants, un upsert.
+
+	Les écritures groupées l'appellent dans leur transaction; les écritures
+	unitaires passent par ``schedule``. Les tournées supprimées entre-temps sont
+	ignorées. Retourne le nombre de lignes écrites.
+	"""
+	tour_ids = set(tour_ids)
+	if not tour_ids:
+		return 0
+	done = ~Q(stops__status=TourStop.PENDING)
+	rows = (
+		Tour.objects.filter(pk__in=tour_ids)
+		.annotate(
+			pending=Count("stops", filter=Q(stops__status=TourStop.PENDING)),
+			completed=Count("stops", filter=Q(stops__status=TourStop.COMPLETED)),
+			skipped=Count("stops", filter=Q(stops__status=TourStop.SKIPPED)),
+			delivered=Sum("stops__delivered_bottles"),
+			returned=Sum("stops__returned_bottles"),
+			last_stop_at=Max("stops__updated_at", filter=done),
+		)
+		.values_list("pk", "pending", "completed", "skipped", "delivered", "returned", "last_stop_at")
+	)
+	next_clients = {}
+	for tour_id, client_id in (
+		TourStop.objects.filter(tour_id__in=tour_ids, status=TourStop.PENDING)
+		.order_by("tour_id", "order_index", "id")
+		.values_list("tour_id", "client_id")
+	):
+		next_clients.setdefault(tour_id, client_id)
+
+	progress = [
+		TourProgress(
+			tour_id=tour_id,
+			pending_stops=pending,
+			completed_stops=completed,
+			skipped_stops=skipped,
+			delivered_bottles=delivered or 0,
+			returned_bottles=returned or 0,
+			last_stop_at=last_stop_at,
+			next_client_id=next_clients.get(tour_id),
+		)
+		for tour_id, pending, completed, skipped, delivered, returned, last_stop_at in rows
+	]
+	# Les arrêts à visiter ont changé: index de détection d'arrivée à reconstruire
+	arrivals.invalidate(tour_ids)
+	TourProgress.objects.bulk_create(progress, update_conflicts=True, unique_fields=["tour"], update_fields=FIELDS)
+	return len(progress)
+
+
+def schedule(tour_ids):
+	"""Recalcule l'avancement au commit (après la suppression en cascade d'une tournée, par exemple)."""
+	transaction.on_commit(partial(refresh, set(tour_ids)))
+
+
+def refresh_stop(sender, instance, **kwargs):
+	"""Receveur post_save / post_delete de TourStop."""
+	schedule([instance.tour_id])
+
+
+def refresh_tour(sender, instance, created, **kwargs):
+	"""Receveur post_save de Tour: toute tournée a sa ligne d'avancement, même sans arrêt."""
+	if created:
+		schedule([instance.pk])
+
+
+def active(day=None):
+	"""Tournées du jour avec bus, chauffeur, avancement et prochain client, en une requête."""
+	day = day or timezone.localdate()
+	return (
+		Tour.objects.filter(date=day)
+		.select_related("bus", "driver", "progress__next_client")
+		.order_by("bus_id", "id")
+	)
@@ -0,0 +1,170 @@
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from pathlib import Path
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.urls import reverse
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from .models import Payment, protected_storage
+
+
+logger = logging.getLogger(__name__)
+
+
+RECEIPTS_DIR = "receipts"
+DISPLAY_DIR = "receipts/display"
+THUMBNAIL_DIR = "receipts/thumbs"
+
+# (côté max en pixels, qualité JPEG)
+DISPLAY_SIZE = (1600, 80)
+THUMBNAIL_SIZE = (320, 70)
+
+
+@dataclass
+class StoredReceipt:
+	name: str
+	sha256: str
+	created: bool
+
+
+def _extension(upload) -> str:
+	ext = os.path.splitext(getattr(upload, "name", "") or "")[1].lower()
+	return ext if ext in (".jpg", ".jpeg", ".png", ".webp", ".gif", ".bmp", ".heic") else ".jpg"
+
+
+def store_upload(upload) -> StoredReceipt:
+	"""Écrit un reçu téléversé sous ``receipts/<aa>/<sha256><ext>`` (stockage protégé), par blocs.
+
+	Le fichier est copié morceau par morceau dans un fichier temporaire du même
+	dossier pendant le calcul de l'empreinte, puis renommé atomiquement. Un reçu
+	identique déjà stocké est réutilisé: le temporaire est simplement supprimé.
+	"""
+	tmp_dir = Path(protected_storage().path(f"{RECEIPTS_DIR}/.tmp"))
+	tmp_dir.mkdir(parents=True, exist_ok=True)
+	digest = hashlib.sha256()
+	fd, tmp_path = tempfile.mkstemp(dir=tmp_dir, suffix=".part")
+	try:
+		with os.fdopen(fd, "wb") as fh:
+			for chunk in upload.chunks():
+				digest.update(chunk)
+				fh.write(chunk)
+		sha256 = digest.hexdigest()
+		name = f"{RECEIPTS_DIR}/{sha256[:2]}/{sha256}{_extension(upload)}"
+		target = Path(protected_storage().path(name))
+		if target.exists():
+			os.unlink(tmp_path)
+			return StoredReceipt(name, sha256, created=False)
+		target.parent.mkdir(parents=True, exist_ok=True)
+		os.replace(tmp_path, target)
+		return StoredReceipt(name, sha256, created=True)
+	except BaseException:
+		if os.path.exists(tmp_path):
+			os.unlink(tmp_path)
+		raise
+
+
+def hash_file(name: str) -> str:
+	"""Empreinte SHA-256 d'un fichier déjà stocké (reçus antérieurs au pipeline)."""
+	digest = hashlib.sha256()
+	with protected_storage().open(name, "rb") as fh:
+		for chunk in iter(lambda: fh.read(64 * 1024), b""):
+			digest.update(chunk)
+	return digest.hexdigest()
+
+
+def _render(image, name: str, size: tuple[int, int]):
+	max_side, quality = size
+	target = Path(protected_storage().path(name))
+	if target.exists():
+		return
+	copy = image.copy()
+	copy.thumbnail((max_side, max_side), Image.Resampling.LANCZOS)
+	target.parent.mkdir(parents=True, exist_ok=True)
+	tmp = target.with_suffix(".part")
+	copy.save(tmp, "JPEG", quality=quality, optimize=True, progressive=True)
+	os.replace(tmp, target)
+
+
+def build_variants(sha256: str, source_name: str) -> tuple[str, str] | None:
+	"""Génère (si absentes) les versions d'affichage et miniature d'un reçu.
+
+	Les variantes sont nommées d'après l'empreinte: un même reçu n'est traité
+	qu'une fois et tous les paiements qui le partagent sont mis à jour d'un
+	seul UPDATE.
+	"""
+	display_name = f"{DISPLAY_DIR}/{sha256}.jpg"
+	thumbnail_name = f"{THUMBNAIL_DIR}/{sha256}.jpg"
+	try:
+		with protected_storage().open(source_name, "rb") as fh, Image.open(fh) as image:
+			image = ImageOps.exif_transpose(image).convert("RGB")
+			_render(image, display_name, DISPLAY_SIZE)
+			_render(image, thumbnail_name, THUMBNAIL_SIZE)
+	except (OSError, UnidentifiedImageError):
+		logger.warning("Reçu illisible, variantes non générées: %s", source_name)
+		return None
+	Payment.objects.filter(receipt_sha256=sha256).update(receipt_display=display_name, receipt_thumbnail=thumbnail_name)
+	return display_name, thumbnail_name
+
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def _run_in_background(sha256: str, source_name: str):
+	try:
+		build_variants(sha256, source_name)
+	except Exception:
+		logger.exception("Échec de génération des variantes du reçu %s", source_name)
+	finally:
+		close_old_connections()
+
+
+def _submit(sha256: str, source_name: str):
+	global _executor
+	if not getattr(settings, "RECEIPT_VARIANTS_ASYNC", True):
+		build_variants(sha256, source_name)
+		return
+	with _executor_lock:
+		if _executor is None:
+			_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="receipt-variants")
+	_executor.submit(_run_in_background, sha256, source_name)
+
+
+def schedule_variants(payment):
+	"""Planifie, après le commit, la génération des variantes hors du cycle de la requête."""
+	if not payment.receipt_image or not payment.receipt_sha256:
+		return
+	transaction.on_commit(lambda: _submit(payment.receipt_sha256, payment.receipt_image.name))
+
+
+VARIANT_ORIGINAL = "original"
+VARIANT_DISPLAY = "display"
+VARIANT_THUMBNAIL = "thumbnail"
+VARIANT_FIELDS = {
+	VARIANT_ORIGINAL: "receipt_image",
+	VARIANT_DISPLAY: "receipt_display",
+	VARIANT_THUMBNAIL: "receipt_thumbnail",
+}
+
+
+def variant_file(payment, variant: str):
+	"""Fichier d'une variante; l'original tant que la variante n'est pas générée."""
+	return getattr(payment, VARIANT_FIELDS[variant]) or payment.receipt_image
+
+
+def variant_url(payment, variant: str, request=None) -> str | None:
+	"""URL de la vue protégée; l'empreinte en paramètre ``v`` rend l'URL immuable."""
+	if not payment.receipt_image:
+		return None
+	url = f"{reverse('payment-receipt', args=[payment.pk])}?variant={variant}"
+	if payment.receipt_sha256:
+		url = f"{url}&v={payment.receipt_sha256[:16]}"
+	return request.build_absolute_uri(url) if request is not None else url
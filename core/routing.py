@@ -0,0 +1,189 @@
+import time
+from array import array
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from . import distances, progress
+from .audit import audit_writer
+from .geo import coordinates, distance_matrix
+from .models import ActivityLog, BusPosition, TourStop
+
+
+def route_length(route: list[int], dist) -> float:
+	return sum(dist[a][b] for a, b in zip(route, route[1:]))
+
+
+def nearest_neighbour(nodes: list[int], start: int, end: int, dist) -> list[int]:
+	"""Route start -> (plus proche non visité)* -> end."""
+	remaining = set(nodes)
+	route = [start]
+	current = start
+	while remaining:
+		row = dist[current]
+		current = min(remaining, key=row.__getitem__)
+		remaining.remove(current)
+		route.append(current)
+	route.append(end)
+	return route
+
+
+def two_opt(route: list[int], dist, deadline: float) -> bool:
+	"""Un passage 2-opt (inversion de segments, extrémités fixes); vrai si la route a raccourci."""
+	improved = False
+	n = len(route)
+	for i in range(1, n - 2):
+		if time.monotonic() > deadline:
+			break
+		a, b = route[i - 1], route[i]
+		row_a, row_b = dist[a], dist[b]
+		ab = row_a[b]
+		for j in range(i + 1, n - 1):
+			c, d = route[j], route[j + 1]
+			delta = row_a[c] + row_b[d] - ab - dist[c][d]
+			if delta < -1e-9:
+				route[i:j + 1] = route[i:j + 1][::-1]
+				improved = True
+				b = route[i]
+				row_b = dist[b]
+				ab = row_a[b]
+	return improved
+
+
+def or_opt(route: list[int], dist, deadline: float, max_segment: int = 3) -> bool:
+	"""Un passage Or-opt: déplace des segments de 1 à ``max_segment`` arrêts; vrai si la route a raccourci."""
+	improved = False
+	for length in range(1, max_segment + 1):
+		i = 1
+		while i + length < len(route):
+			if time.monotonic() > deadline:
+				return improved
+			prev, first, last, nxt = route[i - 1], route[i], route[i + length - 1], route[i + length]
+			removal = dist[prev][first] + dist[last][nxt] - dist[prev][nxt]
+			best, best_k = -1e-9, None
+			for k in range(len(route) - 1):
+				if i - 1 <= k <= i + length - 1:
+					continue
+				p, q = route[k], route[k + 1]
+				delta = dist[p][first] + dist[last][q] - dist[p][q] - removal
+				if delta < best:
+					best, best_k = delta, k
+			if best_k is None:
+				i += 1
+				continue
+			segment = route[i:i + length]
+			del route[i:i + length]
+			k = best_k if best_k < i else best_k - length
+			route[k + 1:k + 1] = segment
+			improved = True
+	return improved
+
+
+def optimise(nodes: list[int], start: int, end: int, dist, time_budget: float) -> list[int]:
+	"""Plus proche voisin puis 2-opt et Or-opt jusqu'à stabilité ou épuisement du budget (secondes)."""
+	deadline = time.monotonic() + time_budget
+	route = nearest_neighbour(nodes, start, end, dist)
+	while time.monotonic() < deadline:
+		changed = two_opt(route, dist, deadline)
+		changed = or_opt(route, dist, deadline) or changed
+		if not changed:
+			break
+	return route
+
+
+def solve(points: list[tuple[float, float]], start=None, end=None, time_budget: float = 1.0, keys=None) -> tuple[list[int], float, float]:
+	"""Ordre de visite court des points, de ``start`` à ``end`` (None: extrémité libre).
+
+	``keys``: clés core.distances des points, du départ et de l'arrivée (None
+	pour une position libre), pour lire les distances dans la matrice persistante.
+	Retourne (ordre des indices, distance dans l'ordre reçu, distance optimisée) en km.
+	"""
+	# Noeuds 0..n-1: points; n: départ; n+1: arrivée (sans coordonnées: noeud fictif à distance nulle)
+	n = len(points)
+	nodes = list(points)
+	nodes.append(start or (points[0] if points else (0.0, 0.0)))
+	nodes.append(end or nodes[n])
+	dist = distances.submatrix(list(zip(keys, nodes))) if keys else None
+	if dist is None:
+		dist = distance_matrix(nodes)
+	for node, point in ((n, start), (n + 1, end)):
+		if point is None:
+			for row in dist:
+				row[node] = 0.0
+			dist[node] = array("d", bytes(8 * (n + 2)))
+
+	current = [n, *range(n), n + 1]
+	before = route_length(current, dist)
+	route = optimise(list(range(n)), n, n + 1, dist, time_budget) if n > 1 else current
+	after = route_length(route, dist)
+	if after > before:
+		route, after = current, before
+	return route[1:-1], before, after
+
+
+def _start_point(tour, visited: list):
+	"""Départ (clé core.distances, point): dernier client visité, sinon dépôt du bus, sinon dernière position du bus."""
+	for stop in reversed(visited):
+		point = coordinates(stop.client)
+		if point:
+			return distances.node(stop.client), point
+	depot = coordinates(tour.bus.warehouse)
+	if depot:
+		return distances.node(tour.bus.warehouse), depot
+	position = BusPosition.objects.filter(bus_id=tour.bus_id).order_by("-created_at").values_list("latitude", "longitude").first()
+	return None, ((float(position[0]), float(position[1])) if position else None)
+
+
+def optimise_tour(tour, user=None, time_budget: float | None = None) -> dict:
+	"""Réordonne les arrêts à visiter d'une tournée pour raccourcir l'itinéraire.
+
+	Les arrêts déjà visités (ou non visités) gardent leur rang en tête; les
+	arrêts à visiter partent du dernier client visité (ou du dépôt du bus) et
+	reviennent au dépôt. Les clients sans coordonnées sont placés en fin de
+	tournée. ``order_index`` est réécrit en un seul bulk_update.
+	"""
+	if time_budget is None:
+		time_budget = getattr(settings, "ROUTE_OPTIMIZATION_TIME_BUDGET", 2.0)
+	started = time.monotonic()
+	stops = list(tour.stops.select_related("client").order_by("order_index", "id"))
+	visited = [stop for stop in stops if stop.status != TourStop.PENDING]
+	pending = [stop for stop in stops if stop.status == TourStop.PENDING]
+	located = [stop for stop in pending if coordinates(stop.client)]
+	unlocated = [stop for stop in pending if not coordinates(stop.client)]
+
+	start_key, start = _start_point(tour, visited)
+	depot = coordinates(tour.bus.warehouse)
+	depot_key = distances.node(tour.bus.warehouse) if depot else None
+	keys = [distances.node(stop.client) for stop in located] + [start_key, depot_key]
+	order, before, after = solve([coordinates(stop.client) for stop in located], start, depot, time_budget, keys=keys)
+
+	ordered = visited + [located[i] for i in order] + unlocated
+	now = timezone.now()
+	changed = []
+	for index, stop in enumerate(ordered, start=1):
+		if stop.order_index != index:
+			stop.order_index = index
+			stop.updated_at = now
+			changed.append(stop)
+	result = {
+		"tour": tour.pk,
+		"stops": len(located),
+		"unlocated_stops": len(unlocated),
+		"distance_before_km": round(before, 3),
+		"distance_after_km": round(after, 3),
+		"reordered": len(changed),
+		"elapsed_ms": round((time.monotonic() - started) * 1000, 1),
+	}
+	with transaction.atomic():
+		TourStop.objects.bulk_update(changed, ["order_index", "updated_at"], batch_size=500)
+		if changed:
+			progress.refresh([tour.pk])
+			audit_writer.log(
+				tour,
+				ActivityLog.ACTION_UPDATE,
+				description=f"Itinéraire optimisé: {result['distance_before_km']} km -> {result['distance_after_km']} km",
+				data=result,
+				user=user,
+			)
+	return result
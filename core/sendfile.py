@@ -0,0 +1,135 @@
+import mimetypes
+import os
+import re
+from pathlib import Path
+
+from django.conf import settings
+from django.http import FileResponse, HttpResponse, HttpResponseNotModified, StreamingHttpResponse
+from django.utils.http import http_date, parse_http_date_safe, quote_etag
+
+
+CHUNK_SIZE = 64 * 1024
+
+_RANGE_RE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+
+def _parse_range(header: str, size: int):
+	"""Intervalle unique ``bytes=a-b`` -> (début, fin incluse); None si absent ou multiple, False si insatisfiable."""
+	match = _RANGE_RE.match(header.strip())
+	if not match:
+		return None
+	first, last = match.groups()
+	if not first and not last:
+		return None
+	if not first:
+		# Suffixe: les N derniers octets
+		length = int(last)
+		if length == 0:
+			return False
+		return max(size - length, 0), size - 1
+	start = int(first)
+	end = int(last) if last else size - 1
+	if start >= size or end < start:
+		return False
+	return start, min(end, size - 1)
+
+
+def _etag_matches(header: str, etag: str) -> bool:
+	if header.strip() == "*":
+		return True
+	candidates = [value.strip().removeprefix("W/") for value in header.split(",")]
+	return etag in candidates
+
+
+def _not_modified(request, etag: str, mtime: int) -> bool:
+	if_none_match = request.headers.get("If-None-Match")
+	if if_none_match is not None:
+		return _etag_matches(if_none_match, etag)
+	since = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+	return since is not None and int(mtime) <= since
+
+
+def _range_applies(request, etag: str, mtime: int) -> bool:
+	"""If-Range: l'intervalle n'est servi que si la représentation n'a pas changé."""
+	if_range = request.headers.get("If-Range")
+	if not if_range:
+		return True
+	if if_range.startswith(('"', "W/")):
+		return if_range == etag
+	since = parse_http_date_safe(if_range)
+	return since is not None and int(mtime) <= since
+
+
+def _iter_range(path: Path, start: int, length: int):
+	with open(path, "rb") as fh:
+		fh.seek(start)
+		remaining = length
+		while remaining > 0:
+			chunk = fh.read(min(CHUNK_SIZE, remaining))
+			if not chunk:
+				break
+			remaining -= len(chunk)
+			yield chunk
+
+
+def serve_file(request, path, internal_name: str, etag: str | None = None, cache_control: str = "private, max-age=3600", filename: str | None = None):
+	"""Sert un fichier protégé après contrôle d'accès par la vue appelante.
+
+	Selon ``SENDFILE_BACKEND``, le transfert est délégué au serveur web frontal
+	(``"x-accel"``: en-tête X-Accel-Redirect vers ``SENDFILE_URL_PREFIX`` +
+	``internal_name``, nginx; ``"x-sendfile"``: chemin absolu, Apache/lighttpd),
+	qui gère alors lui-même Range et cache. Sans frontal, Django répond aux
+	requêtes conditionnelles (ETag / Last-Modified -> 304) et à un intervalle
+	unique (206 / 416), puis diffuse le fichier par blocs.
+	"""
+	path = Path(path)
+	stat = path.stat()
+	size = stat.st_size
+	mtime = int(stat.st_mtime)
+	etag = quote_etag(etag or f"{mtime:x}-{size:x}")
+	content_type = mimetypes.guess_type(path.name)[0] or "application/octet-stream"
+
+	def _headers(response):
+		response["ETag"] = etag
+		response["Last-Modified"] = http_date(mtime)
+		response["Cache-Control"] = cache_control
+		response["Accept-Ranges"] = "bytes"
+		response["Vary"] = "Cookie, Authorization"
+		if filename:
+			response["Content-Disposition"] = f'inline; filename="{filename}"'
+		return response
+
+	if request.method in ("GET", "HEAD") and _not_modified(request, etag, mtime):
+		return _headers(HttpResponseNotModified())
+
+	backend = getattr(settings, "SENDFILE_BACKEND", None)
+	if backend == "x-accel":
+		response = HttpResponse(content_type=content_type)
+		prefix = getattr(settings, "SENDFILE_URL_PREFIX", "/protected-media/")
+		response["X-Accel-Redirect"] = prefix.rstrip("/") + "/" + internal_name.lstrip("/")
+		return _headers(response)
+	if backend == "x-sendfile":
+		response = HttpResponse(content_type=content_type)
+		response["X-Sendfile"] = os.fspath(path)
+		return _headers(response)
+
+	byte_range = None
+	range_header = request.headers.get("Range")
+	if range_header and _range_applies(request, etag, mtime):
+		byte_range = _parse_range(range_header, size)
+	if byte_range is False:
+		response = HttpResponse(status=416)
+		response["Content-Range"] = f"bytes */{size}"
+		return _headers(response)
+	if byte_range:
+		start, end = byte_range
+		length = end - start + 1
+		response = StreamingHttpResponse(_iter_range(path, start, length), status=206, content_type=content_type)
+		response["Content-Range"] = f"bytes {start}-{end}/{size}"
+		response["Content-Length"] = str(length)
+		return _headers(response)
+
+	# FileResponse utilise wsgi.file_wrapper (sendfile) quand le serveur le propose
+	response = FileResponse(open(path, "rb"), content_type=content_type)
+	response.block_size = CHUNK_SIZE
+	return _headers(response)
@@ -1,15 +1,19 @@
 from rest_framework import serializers
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Permission
 
+from . import geo, receipts
 from .models import (
     Client,
     Bus,
     Driver,
+    DriverNotification,
     Tour,
     TourStop,
     BusPosition,
     Wallet,
+    WalletEntry,
     Payment,
     PaymentStatusHistory,
     GasBottleType,
@@ -21,7 +25,7 @@ from .models import (
     BusAlert,
     ActivityLog,
     ClientOrder,
-    
+    StockMovement,
 )
 
 
@@ -61,7 +65,98 @@ class WalletSerializer(serializers.ModelSerializer):
         fields = ["id", "client", "balance_mru", "created_at", "updated_at"]
 
 
-class PaymentSerializer(serializers.ModelSerializer):
+class WalletEntrySerializer(serializers.ModelSerializer):
+    client_id = serializers.IntegerField(source="wallet.client_id", read_only=True)
+    created_by_username = serializers.CharField(source="created_by.username", read_only=True, default=None)
+
+    class Meta:
+        model = WalletEntry
+        fields = [
+            "id",
+            "wallet",
+            "client_id",
+            "entry_type",
+            "counter_account",
+            "amount_mru",
+            "balance_after_mru",
+            "payment",
+            "order",
+            "note",
+            "created_by_username",
+            "created_at",
+        ]
+        read_only_fields = fields
+
+
+class WalletAdjustmentSerializer(serializers.Serializer):
+    amount_mru = serializers.DecimalField(max_digits=14, decimal_places=2)
+    note = serializers.CharField()
+
+    def validate_amount_mru(self, value):
+        if not value:
+            raise serializers.ValidationError("Le montant de l'ajustement ne peut pas être nul.")
+        return value
+
+
+class UpdateFieldsMixin:
+    """Ne sauvegarde que les champs envoyés: une mise à jour concurrente du statut
+    (transition conditionnelle) n'est jamais écrasée par une valeur relue plus tôt."""
+
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save(update_fields=[*validated_data, "updated_at"])
+        return instance
+
+
+class ReceiptUploadMixin:
+    """Reçu stocké par empreinte (doublons réutilisés), variantes générées après le commit,
+    servi uniquement par la vue protégée PaymentReceiptView."""
+
+    def validate_receipt_image(self, value):
+        max_size = getattr(settings, "RECEIPT_MAX_UPLOAD_SIZE", 10 * 1024 * 1024)
+        if value and value.size > max_size:
+            raise serializers.ValidationError(f"Le reçu dépasse la taille maximale ({max_size // (1024 * 1024)} Mo).")
+        return value
+
+    def _store_receipt(self, validated_data):
+        if "receipt_image" not in validated_data:
+            return
+        upload = validated_data.pop("receipt_image")
+        if upload:
+            stored = receipts.store_upload(upload)
+            validated_data["receipt_image"] = stored.name
+            validated_data["receipt_sha256"] = stored.sha256
+        else:
+            validated_data["receipt_image"] = None
+            validated_data["receipt_sha256"] = ""
+        validated_data["receipt_display"] = None
+        validated_data["receipt_thumbnail"] = None
+
+    def create(self, validated_data):
+        self._store_receipt(validated_data)
+        instance = super().create(validated_data)
+        receipts.schedule_variants(instance)
+        return instance
+
+    def update(self, instance, validated_data):
+        self._store_receipt(validated_data)
+        instance = super().update(instance, validated_data)
+        if "receipt_sha256" in validated_data:
+            receipts.schedule_variants(instance)
+        return instance
+
+    def to_representation(self, instance):
+        # Les reçus ne sont jamais exposés sous /media/: URLs de la vue protégée
+        data = super().to_representation(instance)
+        request = self.context.get("request")
+        for variant, field in receipts.VARIANT_FIELDS.items():
+            if field in data:
+                data[field] = receipts.variant_url(instance, variant, request) if data[field] else None
+        return data
+
+
+class PaymentSerializer(ReceiptUploadMixin, UpdateFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Payment
         fields = [
@@ -70,15 +165,28 @@ class PaymentSerializer(serializers.ModelSerializer):
             "amount_mru",
             "method",
             "receipt_image",
+            "receipt_display",
+            "receipt_thumbnail",
             "status",
             "rejection_reason",
             "created_at",
             "updated_at",
         ]
-        read_only_fields = ["created_at", "updated_at"]
+        read_only_fields = ["receipt_display", "receipt_thumbnail", "created_at", "updated_at"]
 
 
-class ClientSelfPaymentSerializer(serializers.ModelSerializer):
+class PaymentBulkStatusSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=500)
+    status = serializers.ChoiceField(choices=[Payment.VALIDATED, Payment.REJECTED])
+    reason = serializers.CharField(required=False, allow_blank=True, default="")
+
+
+class OrderBulkStatusSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=500)
+    status = serializers.ChoiceField(choices=[ClientOrder.VALIDATED, ClientOrder.CANCELLED])
+
+
+class ClientSelfPaymentSerializer(ReceiptUploadMixin, UpdateFieldsMixin, serializers.ModelSerializer):
     order_id = serializers.IntegerField(source="order.id", read_only=True)
     order_status = serializers.CharField(source="order.status", read_only=True)
 
@@ -91,10 +199,11 @@ class ClientSelfPaymentSerializer(serializers.ModelSerializer):
             "amount_mru",
             "method",
             "receipt_image",
+            "receipt_thumbnail",
             "status",
             "created_at",
         ]
-        read_only_fields = ["status", "created_at"]
+        read_only_fields = ["receipt_thumbnail", "status", "created_at"]
 
 
 class PaymentStatusHistorySerializer(serializers.ModelSerializer):
@@ -157,6 +266,7 @@ class ClientOrderSerializer(serializers.ModelSerializer):
         queryset=GasBottleType.objects.all(), source="bottle_type", write_only=True
     )
     delivered_by_name = serializers.CharField(source="delivered_by.name", read_only=True, default=None)
+    distance_km = serializers.SerializerMethodField()
 
     class Meta:
         model = ClientOrder
@@ -175,6 +285,7 @@ class ClientOrderSerializer(serializers.ModelSerializer):
             "status",
             "delivered_at",
             "delivered_by_name",
+            "distance_km",
             "created_at",
         ]
         # status et les champs de livraison sont gérés côté back-office / API dédiée
@@ -186,6 +297,14 @@ class ClientOrderSerializer(serializers.ModelSerializer):
             "delivered_by_name",
         ]
 
+    def get_distance_km(self, obj):
+        # Renseignée pour la file du chauffeur (point de départ fourni par la vue)
+        origin = self.context.get("origin")
+        client = obj.client
+        if origin is None or client.gps_latitude is None or client.gps_longitude is None:
+            return None
+        return round(geo.haversine_km(*origin, float(client.gps_latitude), float(client.gps_longitude)), 2)
+
 
 class UserSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, required=False, allow_blank=True)
@@ -277,6 +396,7 @@ class BusSerializer(serializers.ModelSerializer):
             "plate_number",
             "capacity",
             "max_speed_kmh",
+            "warehouse",
             "created_at",
             "updated_at",
         ]
@@ -311,20 +431,92 @@ class TourSerializer(serializers.ModelSerializer):
         ]
 
 
+class TourProgressSerializer(serializers.ModelSerializer):
+    """Tournée et son avancement (core.progress), pour la popup bus de la carte."""
+
+    tour = serializers.IntegerField(source="id", read_only=True)
+    bus_name = serializers.CharField(source="bus.name", read_only=True)
+    driver_name = serializers.CharField(source="driver.name", read_only=True, default=None)
+    pending_stops = serializers.IntegerField(source="progress.pending_stops", read_only=True)
+    completed_stops = serializers.IntegerField(source="progress.completed_stops", read_only=True)
+    skipped_stops = serializers.IntegerField(source="progress.skipped_stops", read_only=True)
+    delivered_bottles = serializers.IntegerField(source="progress.delivered_bottles", read_only=True)
+    returned_bottles = serializers.IntegerField(source="progress.returned_bottles", read_only=True)
+    last_stop_at = serializers.DateTimeField(source="progress.last_stop_at", read_only=True)
+    next_client = serializers.IntegerField(source="progress.next_client_id", read_only=True)
+    next_client_name = serializers.CharField(source="progress.next_client.name", read_only=True, default=None)
+
+    class Meta:
+        model = Tour
+        fields = [
+            "tour",
+            "date",
+            "sector",
+            "bus",
+            "bus_name",
+            "driver",
+            "driver_name",
+            "pending_stops",
+            "completed_stops",
+            "skipped_stops",
+            "delivered_bottles",
+            "returned_bottles",
+            "last_stop_at",
+            "next_client",
+            "next_client_name",
+        ]
+
+
+class DriverNotificationSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = DriverNotification
+        fields = ["id", "created_at", "kind", "tour", "stop", "message", "data"]
+
+
+class TourPlanSerializer(serializers.Serializer):
+    date = serializers.DateField(required=False)
+    dry_run = serializers.BooleanField(required=False, default=False)
+
+
 class TourStopSerializer(serializers.ModelSerializer):
+    client_name = serializers.CharField(source="client.name", read_only=True)
+
     class Meta:
         model = TourStop
         fields = [
             "id",
             "tour",
             "client",
+            "client_name",
             "order_index",
             "status",
             "delivered_bottles",
             "returned_bottles",
+            "arrived_at",
+            "departed_at",
             "created_at",
             "updated_at",
         ]
+        read_only_fields = ["arrived_at", "departed_at"]
+
+
+class TourStopBulkCreateSerializer(serializers.Serializer):
+    clients = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=500)
+
+
+class TourStopReorderSerializer(serializers.Serializer):
+    stops = serializers.ListField(child=serializers.IntegerField(min_value=1), allow_empty=False, max_length=1000)
+
+
+class TourStopStatusSerializer(serializers.Serializer):
+    id = serializers.IntegerField(min_value=1)
+    status = serializers.ChoiceField(choices=TourStop.STATUS_CHOICES)
+    delivered_bottles = serializers.IntegerField(min_value=0, required=False)
+    returned_bottles = serializers.IntegerField(min_value=0, required=False)
+
+
+class TourStopBulkStatusSerializer(serializers.Serializer):
+    stops = TourStopStatusSerializer(many=True, allow_empty=False, max_length=500)
 
 
 class BusPositionSerializer(serializers.ModelSerializer):
@@ -406,6 +598,7 @@ class WarehouseBottleStockSerializer(serializers.ModelSerializer):
     bottle_type_id = serializers.PrimaryKeyRelatedField(
         queryset=GasBottleType.objects.all(), source="bottle_type", write_only=True
     )
+    available_quantity = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = WarehouseBottleStock
@@ -416,9 +609,13 @@ class WarehouseBottleStockSerializer(serializers.ModelSerializer):
             "warehouse_id",
             "bottle_type_id",
             "quantity",
+            "empty_quantity",
+            "reserved_quantity",
+            "available_quantity",
             "created_at",
             "updated_at",
         ]
+        read_only_fields = ["reserved_quantity"]
 
 
 class ActivityLogSerializer(serializers.ModelSerializer):
@@ -447,6 +644,7 @@ class BusBottleStockSerializer(serializers.ModelSerializer):
     bottle_type_id = serializers.PrimaryKeyRelatedField(
         queryset=GasBottleType.objects.all(), source="bottle_type", write_only=True
     )
+    available_quantity = serializers.IntegerField(read_only=True)
 
     class Meta:
         model = BusBottleStock
@@ -457,6 +655,67 @@ class BusBottleStockSerializer(serializers.ModelSerializer):
             "bus_id",
             "bottle_type_id",
             "quantity",
+            "empty_quantity",
+            "reserved_quantity",
+            "available_quantity",
             "created_at",
             "updated_at",
         ]
+        read_only_fields = ["reserved_quantity"]
+
+
+class StockMovementSerializer(serializers.ModelSerializer):
+    bottle_type_name = serializers.CharField(source="bottle_type.name", read_only=True)
+    created_by_username = serializers.CharField(source="created_by.username", read_only=True, default=None)
+
+    class Meta:
+        model = StockMovement
+        fields = [
+            "id",
+            "created_at",
+            "movement_type",
+            "bottle_type",
+            "bottle_type_name",
+            "quantity",
+            "empty",
+            "from_warehouse",
+            "from_bus",
+            "from_client",
+            "to_warehouse",
+            "to_bus",
+            "to_client",
+            "order",
+            "note",
+            "created_by_username",
+        ]
+
+
+class StockTransferSerializer(serializers.Serializer):
+    """Chargement (dépôt -> bus) ou déchargement (bus -> dépôt) saisi par le back-office."""
+
+    movement_type = serializers.ChoiceField(choices=[StockMovement.TYPE_LOAD, StockMovement.TYPE_UNLOAD])
+    bottle_type_id = serializers.PrimaryKeyRelatedField(queryset=GasBottleType.objects.all(), source="bottle_type")
+    warehouse_id = serializers.PrimaryKeyRelatedField(queryset=Warehouse.objects.all(), source="warehouse")
+    bus_id = serializers.PrimaryKeyRelatedField(queryset=Bus.objects.all(), source="bus")
+    quantity = serializers.IntegerField(min_value=1)
+    empty = serializers.BooleanField(default=False)
+    note = serializers.CharField(required=False, allow_blank=True, default="")
+
+
+class DeliveryEventSerializer(serializers.Serializer):
+    order_id = serializers.IntegerField(min_value=1)
+    delivered_at = serializers.DateTimeField(required=False, allow_null=True, default=None)
+    returned_bottles = serializers.IntegerField(min_value=0, required=False, default=0)
+    latitude = serializers.DecimalField(max_digits=9, decimal_places=6, required=False, allow_null=True, default=None)
+    longitude = serializers.DecimalField(max_digits=9, decimal_places=6, required=False, allow_null=True, default=None)
+
+    def validate(self, attrs):
+        latitude, longitude = attrs.pop("latitude"), attrs.pop("longitude")
+        attrs["position"] = [str(latitude), str(longitude)] if latitude is not None and longitude is not None else None
+        return attrs
+
+
+class DeliverySyncSerializer(serializers.Serializer):
+    """File de livraisons confirmées hors ligne par le chauffeur (une tournée entière au plus)."""
+
+    deliveries = DeliveryEventSerializer(many=True, allow_empty=False, max_length=500)
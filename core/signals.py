@@ -1,10 +1,27 @@
 from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.contrib.auth.models import Group
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
-from .models import Client, Driver, ClientOrder, Payment, ActivityLog
+from .audit import audit_writer
+from . import dispatch, distances, inventory, progress, stock
+from .models import (
+	Client,
+	Driver,
+	ClientOrder,
+	Payment,
+	PaymentStatusHistory,
+	ActivityLog,
+	BusBottleStock,
+	ClientBottleBalance,
+	GasBottleType,
+	Tour,
+	TourStop,
+	Warehouse,
+	WarehouseBottleStock,
+)
+from .orders import order_transitioned
 
 
 User = get_user_model()
@@ -53,45 +70,92 @@ def create_user_for_driver(sender, instance: Driver, created: bool, **kwargs):
 		_create_user_for_instance(instance, group_name="drivers", prefix="rimgaz_driver_")
 
 
-@receiver(post_save, sender=ClientOrder)
-def create_payment_for_validated_order(sender, instance: ClientOrder, created: bool, **kwargs):
-	"""When a client order is validated, automatically create a pending Payment.
+@receiver(order_transitioned)
+def create_payments_for_validated_orders(sender, orders, new_status: str, user=None, **kwargs):
+	"""When client orders are validated, create their pending Payments.
 
 	This increments pending payments for finance and notifies the system that
-	the client must now pay for the validated order.
+	the client must now pay for the validated order. Fired only on an actual
+	status change (core.orders), once per batch: payments and status history are
+	bulk inserted in the transaction, audit entries through the audit batch.
 	"""
-	# Only act on updates, not on initial creation of the order
-	if created:
-		return
-
-	# We only care about orders that are in VALIDATED status
-	if instance.status != ClientOrder.VALIDATED:
+	if new_status != ClientOrder.VALIDATED:
 		return
 
 	# Avoid creating multiple payments for the same order
-	if Payment.objects.filter(order=instance).exists():
-		return
-
-	payment = Payment.objects.create(
-		client=instance.client,
-		order=instance,
-		amount_mru=instance.total_price_mru,
-		method="",
-		status=Payment.PENDING,
-		rejection_reason="",
+	existing = set(Payment.objects.filter(order__in=orders).values_list("order_id", flat=True))
+	payments = Payment.objects.bulk_create(
+		[
+			Payment(
+				client_id=order.client_id,
+				order=order,
+				amount_mru=order.total_price_mru,
+				method="",
+				status=Payment.PENDING,
+				rejection_reason="",
+			)
+			for order in orders
+			if order.pk not in existing
+		]
 	)
 
 	# Log the creation for audit / dashboards
-	ActivityLog.objects.create(
-		user=getattr(instance.client, "user", None),
-		model_name=Payment._meta.label,
-		object_id=str(payment.pk),
-		action=ActivityLog.ACTION_CREATE,
-		description=f"Création d'un paiement en attente pour la commande #{instance.id}",
-		data={
-			"order_id": instance.id,
-			"client_id": instance.client.id,
-			"amount_mru": str(payment.amount_mru),
-		},
+	changed_by = user if user is not None and user.is_authenticated else None
+	audit_writer.write_history(
+		PaymentStatusHistory(
+			payment_id=payment.pk,
+			previous_status=None,
+			new_status=Payment.PENDING,
+			changed_by=changed_by,
+			note=f"Validation de la commande #{payment.order_id}",
+		)
+		for payment in payments
 	)
-
+	with audit_writer.batch():
+		for payment in payments:
+			audit_writer.log(
+				payment,
+				ActivityLog.ACTION_CREATE,
+				description=f"Création d'un paiement en attente pour la commande #{payment.order_id}",
+				data={
+					"order_id": payment.order_id,
+					"client_id": payment.client_id,
+					"amount_mru": str(payment.amount_mru),
+				},
+				user=user,
+			)
+
+
+@receiver(order_transitioned)
+def insert_validated_orders_into_tours(sender, orders, new_status: str, user=None, **kwargs):
+	"""Ajoute les commandes validées aux tournées en cours (avant la réservation: le bus retenu porte la réservation)."""
+	if new_status == ClientOrder.VALIDATED and getattr(settings, "AUTO_INSERT_VALIDATED_ORDERS", True):
+		dispatch.insert_orders(orders, user=user)
+
+
+@receiver(order_transitioned)
+def manage_stock_reservations(sender, orders, new_status: str, **kwargs):
+	"""Réserve le stock à la validation, le libère à l'annulation et à la livraison.
+
+	À la livraison, la réservation est tenue par le bus du chauffeur (core.deliveries
+	refuse tout autre bus): sa sortie réelle (core.stock.record_delivery) la remplace.
+	"""
+	if new_status == ClientOrder.VALIDATED:
+		stock.reserve_orders(orders)
+	elif new_status in (ClientOrder.CANCELLED, ClientOrder.DELIVERED):
+		stock.release_orders(orders)
+
+# Inventaire en cache: invalidé par toute écriture de stock hors core.stock (admin, API)
+for _model in (WarehouseBottleStock, BusBottleStock, ClientBottleBalance, GasBottleType):
+	post_save.connect(inventory.invalidate, sender=_model, dispatch_uid=f"inventory-save-{_model.__name__}")
+	post_delete.connect(inventory.invalidate, sender=_model, dispatch_uid=f"inventory-delete-{_model.__name__}")
+
+# Avancement des tournées: recalculé au commit de chaque écriture unitaire (les écritures groupées appellent progress.refresh)
+post_save.connect(progress.refresh_tour, sender=Tour, dispatch_uid="progress-save-Tour")
+post_save.connect(progress.refresh_stop, sender=TourStop, dispatch_uid="progress-save-TourStop")
+post_delete.connect(progress.refresh_stop, sender=TourStop, dispatch_uid="progress-delete-TourStop")
+
+# Matrice des distances: ligne recalculée au commit quand un client / dépôt est créé, déplacé ou supprimé
+for _model in (Client, Warehouse):
+	post_save.connect(distances.node_saved, sender=_model, dispatch_uid=f"distances-save-{_model.__name__}")
+	post_delete.connect(distances.node_deleted, sender=_model, dispatch_uid=f"distances-delete-{_model.__name__}")
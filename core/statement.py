@@ -0,0 +1,151 @@
+from rest_framework import serializers
+
+from . import ledger
+from .models import ClientBottleBalance, ClientOrder, Payment, TourStop, Wallet, WalletEntry
+from .timeline import TimelineSource, before_position, merge_page
+
+
+KIND_LEDGER = "ledger"
+KIND_ORDER = "order"
+KIND_PAYMENT = "payment"
+KIND_STOP = "stop"
+
+_timestamp = serializers.DateTimeField()
+_amount = serializers.DecimalField(max_digits=14, decimal_places=2)
+
+
+def _identity(row):
+	return row
+
+
+def _sources(client_id: int, wallet_id: int | None) -> list[TimelineSource]:
+	"""Flux du relevé, chacun lu par plage d'index (client|wallet, created_at, id)."""
+	sources = [
+		TimelineSource(KIND_ORDER, ClientOrder.objects.filter(client_id=client_id).select_related("bottle_type"), _identity),
+		TimelineSource(KIND_PAYMENT, Payment.objects.filter(client_id=client_id), _identity),
+		TimelineSource(
+			KIND_STOP,
+			TourStop.objects.filter(client_id=client_id).exclude(status=TourStop.PENDING).select_related("tour"),
+			_identity,
+		),
+	]
+	if wallet_id is not None:
+		sources.append(TimelineSource(KIND_LEDGER, WalletEntry.objects.filter(wallet_id=wallet_id), _identity))
+	return sources
+
+
+def _ledger_item(entry):
+	return {
+		"type": KIND_LEDGER,
+		"id": entry.id,
+		"created_at": _timestamp.to_representation(entry.created_at),
+		"entry_type": entry.entry_type,
+		"amount_mru": _amount.to_representation(entry.amount_mru),
+		"payment_id": entry.payment_id,
+		"order_id": entry.order_id,
+		"note": entry.note,
+	}
+
+
+def _order_item(order):
+	return {
+		"type": KIND_ORDER,
+		"id": order.id,
+		"created_at": _timestamp.to_representation(order.created_at),
+		"status": order.status,
+		"bottle_type": order.bottle_type.name,
+		"quantity": order.quantity,
+		"total_price_mru": _amount.to_representation(order.total_price_mru),
+		"delivered_at": _timestamp.to_representation(order.delivered_at) if order.delivered_at else None,
+	}
+
+
+def _payment_item(payment):
+	return {
+		"type": KIND_PAYMENT,
+		"id": payment.id,
+		"created_at": _timestamp.to_representation(payment.created_at),
+		"status": payment.status,
+		"method": payment.method,
+		"amount_mru": _amount.to_representation(payment.amount_mru),
+		"order_id": payment.order_id,
+		"rejection_reason": payment.rejection_reason,
+	}
+
+
+def _stop_item(stop):
+	# Passage de tournée: mouvements de bouteilles, ou incident si l'arrêt n'a pas été visité
+	return {
+		"type": KIND_STOP,
+		"id": stop.id,
+		"created_at": _timestamp.to_representation(stop.created_at),
+		"status": stop.status,
+		"tour_date": stop.tour.date.isoformat(),
+		"delivered_bottles": stop.delivered_bottles,
+		"returned_bottles": stop.returned_bottles,
+	}
+
+
+# Modèle -> (flux, construction de la ligne)
+_ROW_TYPES = {
+	WalletEntry: (KIND_LEDGER, _ledger_item),
+	ClientOrder: (KIND_ORDER, _order_item),
+	Payment: (KIND_PAYMENT, _payment_item),
+	TourStop: (KIND_STOP, _stop_item),
+}
+
+
+def _opening_balance(wallet_id: int, oldest):
+	"""Solde juste avant l'événement le plus ancien de la page (une lecture d'index)."""
+	position = (oldest.created_at, _ROW_TYPES[type(oldest)][0], oldest.pk)
+	source = TimelineSource(KIND_LEDGER, WalletEntry.objects.none(), _identity)
+	balance = (
+		WalletEntry.objects.filter(wallet_id=wallet_id)
+		.filter(before_position(source, position))
+		.order_by("-created_at", "-id")
+		.values_list("balance_after_mru", flat=True)
+		.first()
+	)
+	return balance if balance is not None else ledger.ZERO
+
+
+def build_statement(client, limit: int, cursor: str | None = None) -> dict:
+	"""Relevé de compte d'un client: commandes, paiements, écritures et passages fusionnés.
+
+	Chaque ligne porte le solde du portefeuille après l'événement: repris tel quel
+	des écritures (``balance_after_mru``, calculé à l'écriture), reporté sur les
+	autres événements. Au plus ``limit + 1`` lignes par flux et une lecture pour
+	le solde d'ouverture de la page.
+	"""
+	wallet = Wallet.objects.filter(client_id=client.pk).only("id", "balance_mru").first()
+	wallet_id = wallet.id if wallet else None
+	rows, next_cursor = merge_page(_sources(client.pk, wallet_id), limit, cursor)
+
+	balances = {}
+	if rows and wallet_id is not None:
+		running = _opening_balance(wallet_id, rows[-1])
+		for row in reversed(rows):
+			if isinstance(row, WalletEntry):
+				running = row.balance_after_mru
+			balances[id(row)] = running
+
+	items = []
+	for row in rows:
+		item = _ROW_TYPES[type(row)][1](row)
+		item["balance_mru"] = _amount.to_representation(balances.get(id(row), ledger.ZERO))
+		items.append(item)
+
+	statement = {
+		"client": client.pk,
+		"balance_mru": _amount.to_representation(wallet.balance_mru if wallet else ledger.ZERO),
+		"next_cursor": next_cursor,
+		"results": items,
+	}
+	if cursor is None:
+		# Soldes de bouteilles courants: seulement sur la première page
+		bottles = ClientBottleBalance.objects.filter(client_id=client.pk).select_related("bottle_type").order_by("bottle_type__name")
+		statement["bottle_balances"] = [
+			{"bottle_type": balance.bottle_type.name, "bottle_type_id": balance.bottle_type_id, "quantity": balance.quantity}
+			for balance in bottles
+		]
+	return statement
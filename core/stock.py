@@ -0,0 +1,390 @@
+from collections import defaultdict
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Sum
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from . import inventory, ledger
+from .models import (
+	Bus,
+	BusBottleStock,
+	Client,
+	ClientBottleBalance,
+	ClientOrder,
+	StockMovement,
+	TourStop,
+	Warehouse,
+	WarehouseBottleStock,
+)
+
+
+class InsufficientStock(APIException):
+	status_code = status.HTTP_409_CONFLICT
+	default_detail = "Stock insuffisant pour ce mouvement."
+	default_code = "insufficient_stock"
+
+
+class ReservedElsewhere(APIException):
+	status_code = status.HTTP_409_CONFLICT
+	default_detail = "Les bouteilles de cette commande sont réservées sur un autre emplacement."
+	default_code = "reserved_elsewhere"
+
+
+# Type d'emplacement -> (modèle de stock, nom de l'emplacement: FK du stock et suffixe from_/to_ du mouvement)
+_LOCATIONS = {
+	Warehouse: (WarehouseBottleStock, "warehouse"),
+	Bus: (BusBottleStock, "bus"),
+	Client: (ClientBottleBalance, "client"),
+}
+
+
+def _stock_field(location, empty: bool) -> str:
+	# Un client détient des bouteilles, sans distinction pleine / vide
+	if isinstance(location, Client) or not empty:
+		return "quantity"
+	return "empty_quantity"
+
+
+def _apply(location, bottle_type_id: int, delta: int, empty: bool, strict: bool = False):
+	"""Ajoute ``delta`` au stock de l'emplacement par un UPDATE ``F()`` (ligne créée au besoin).
+
+	Avec ``strict``, un retrait n'est appliqué que si le stock le couvre
+	(``WHERE <champ> >= quantité``), sinon InsufficientStock.
+	"""
+	model, fk = _LOCATIONS[type(location)]
+	field = _stock_field(location, empty)
+	inventory.invalidate()
+	rows = model.objects.filter(**{f"{fk}_id": location.pk, "bottle_type_id": bottle_type_id})
+	guarded = rows.filter(**{f"{field}__gte": -delta}) if strict and delta < 0 else rows
+	if guarded.update(**{field: F(field) + delta, "updated_at": timezone.now()}):
+		return
+	if strict and delta < 0:
+		raise InsufficientStock(f"Stock insuffisant ({location}): {-delta} bouteille(s) demandée(s).")
+	try:
+		with transaction.atomic():
+			model.objects.create(**{f"{fk}_id": location.pk, "bottle_type_id": bottle_type_id, field: delta})
+	except IntegrityError:
+		# Ligne créée en parallèle
+		rows.update(**{field: F(field) + delta, "updated_at": timezone.now()})
+
+
+def transfer(
+	movement_type: str,
+	bottle_type,
+	quantity: int,
+	source=None,
+	target=None,
+	empty: bool = False,
+	order=None,
+	user=None,
+	note: str = "",
+	strict: bool = False,
+):
+	"""Déplace ``quantity`` bouteilles de ``source`` vers ``target`` (Warehouse, Bus ou Client).
+
+	Le mouvement est inscrit et les deux stocks modifiés dans une même
+	transaction. ``source`` ou ``target`` peut être None (entrée / sortie du
+	réseau, corrections d'inventaire).
+	"""
+	if quantity <= 0:
+		return None
+	bottle_type_id = getattr(bottle_type, "pk", bottle_type)
+	with transaction.atomic():
+		if source is not None:
+			_apply(source, bottle_type_id, -quantity, empty, strict=strict)
+		if target is not None:
+			_apply(target, bottle_type_id, quantity, empty)
+		return _record(movement_type, bottle_type_id, quantity, source, target, empty, order, user, note)
+
+
+def _record(movement_type, bottle_type_id, quantity, source, target, empty, order=None, user=None, note=""):
+	if user is not None and not getattr(user, "is_authenticated", False):
+		user = None
+	fields = {}
+	for prefix, location in (("from", source), ("to", target)):
+		if location is not None:
+			fields[f"{prefix}_{_LOCATIONS[type(location)][1]}"] = location
+	return StockMovement.objects.create(
+		movement_type=movement_type,
+		bottle_type_id=bottle_type_id,
+		quantity=quantity,
+		empty=empty,
+		order=order,
+		note=note,
+		created_by=user,
+		**fields,
+	)
+
+
+def adjust(location, bottle_type, delta: int, empty: bool = False, user=None, note: str = ""):
+	"""Correction d'inventaire: écart positif (entrée) ou négatif (sortie) sur un emplacement."""
+	if delta > 0:
+		return transfer(StockMovement.TYPE_ADJUSTMENT, bottle_type, delta, target=location, empty=empty, user=user, note=note)
+	return transfer(StockMovement.TYPE_ADJUSTMENT, bottle_type, -delta, source=location, empty=empty, user=user, note=note)
+
+
+def record_delivery(order, bus=None, returned_empties: int = 0, user=None):
+	"""Mouvements d'une commande livrée: pleines bus -> client, vides client -> bus.
+
+	La consigne est facturée (ou remboursée) sur le solde net de bouteilles
+	laissées chez le client.
+	"""
+	client = order.client
+	with transaction.atomic():
+		transfer(StockMovement.TYPE_DELIVERY, order.bottle_type, order.quantity, source=bus, target=client, order=order, user=user)
+		transfer(
+			StockMovement.TYPE_RETURN,
+			order.bottle_type,
+			returned_empties,
+			source=client,
+			target=bus,
+			empty=True,
+			order=order,
+			user=user,
+		)
+		ledger.charge_deposit(client.pk, order.bottle_type, order.quantity - returned_empties, order=order, user=user)
+
+
+def _reserve_at(model, fk: str, location_id: int, bottle_type_id: int, quantity: int) -> bool:
+	"""``UPDATE ... SET reserved = reserved + q WHERE quantity >= reserved + q``: vrai si réservé."""
+	return bool(
+		model.objects.filter(
+			**{f"{fk}_id": location_id, "bottle_type_id": bottle_type_id},
+			quantity__gte=F("reserved_quantity") + quantity,
+		).update(reserved_quantity=F("reserved_quantity") + quantity, updated_at=timezone.now())
+	)
+
+
+def reserve_orders(orders):
+	"""Réserve les pleines des commandes validées, sans lecture préalable du stock disponible.
+
+	Chaque commande est réservée sur le bus de la tournée du jour qui passe chez
+	le client, à défaut sur un dépôt (le plus fourni d'abord), par un UPDATE
+	conditionnel: deux validations concurrentes ne peuvent pas promettre les
+	mêmes bouteilles. Une réservation prise sur un dépôt pour un client déjà
+	desservi par un bus est aussitôt chargée sur ce bus (``load_reservations``).
+	Si une commande du lot ne trouve pas de stock, InsufficientStock (409)
+	annule la validation du lot entier.
+	"""
+	orders = [order for order in orders if not (order.reserved_bus_id or order.reserved_warehouse_id)]
+	if not orders:
+		return
+	buses = dict(
+		TourStop.objects.filter(
+			client_id__in={order.client_id for order in orders},
+			status=TourStop.PENDING,
+			tour__date=timezone.localdate(),
+		).values_list("client_id", "tour__bus_id")
+	)
+	warehouses = defaultdict(list)
+	rows = (
+		WarehouseBottleStock.objects.filter(bottle_type_id__in={order.bottle_type_id for order in orders})
+		.order_by(F("reserved_quantity") - F("quantity"))
+		.values_list("warehouse_id", "bottle_type_id")
+	)
+	for warehouse_id, bottle_type_id in rows:
+		warehouses[bottle_type_id].append(warehouse_id)
+
+	missing = []
+	for order in orders:
+		bus_id = buses.get(order.client_id)
+		if bus_id and _reserve_at(BusBottleStock, "bus", bus_id, order.bottle_type_id, order.quantity):
+			order.reserved_bus_id = bus_id
+			continue
+		for warehouse_id in warehouses[order.bottle_type_id]:
+			if _reserve_at(WarehouseBottleStock, "warehouse", warehouse_id, order.bottle_type_id, order.quantity):
+				order.reserved_warehouse_id = warehouse_id
+				break
+		else:
+			missing.append(order)
+	if missing:
+		raise InsufficientStock(
+			"Stock disponible insuffisant pour la commande "
+			+ ", ".join(f"#{order.pk} ({order.quantity} x {order.bottle_type})" for order in missing)
+			+ "."
+		)
+	ClientOrder.objects.bulk_update(orders, ["reserved_bus", "reserved_warehouse"])
+	inventory.invalidate()
+	_load([(order, buses[order.client_id]) for order in orders if order.reserved_warehouse_id and buses.get(order.client_id)])
+
+
+def _unreserve(model, fk: str, location_id: int, bottle_type_id: int, quantity: int, now):
+	rows = model.objects.filter(**{f"{fk}_id": location_id, "bottle_type_id": bottle_type_id})
+	# Jamais sous zéro (stock corrigé à la main entre-temps)
+	if not rows.filter(reserved_quantity__gte=quantity).update(reserved_quantity=F("reserved_quantity") - quantity, updated_at=now):
+		rows.update(reserved_quantity=0, updated_at=now)
+
+
+def _load(assignments, user=None) -> int:
+	"""Charge sur leur bus les commandes réservées sur un dépôt: [(commande, bus_id)].
+
+	Pleines dépôt -> bus (un mouvement TYPE_LOAD par commande) et réservation
+	déplacée avec elles; un UPDATE par emplacement et type de bouteille.
+	"""
+	assignments = [(order, bus_id) for order, bus_id in assignments if order.reserved_warehouse_id]
+	if not assignments:
+		return 0
+	if user is not None and not getattr(user, "is_authenticated", False):
+		user = None
+	now = timezone.now()
+	totals = defaultdict(int)
+	by_bus = defaultdict(list)
+	movements = []
+	for order, bus_id in assignments:
+		totals[(order.reserved_warehouse_id, bus_id, order.bottle_type_id)] += order.quantity
+		by_bus[bus_id].append(order.pk)
+		movements.append(
+			StockMovement(
+				movement_type=StockMovement.TYPE_LOAD,
+				bottle_type_id=order.bottle_type_id,
+				quantity=order.quantity,
+				from_warehouse_id=order.reserved_warehouse_id,
+				to_bus_id=bus_id,
+				order=order,
+				created_by=user,
+				note=f"Chargement de la commande #{order.pk} réservée au dépôt",
+			)
+		)
+		order.reserved_warehouse_id = None
+		order.reserved_bus_id = bus_id
+	with transaction.atomic():
+		for (warehouse_id, bus_id, bottle_type_id), quantity in totals.items():
+			_apply(Warehouse(pk=warehouse_id), bottle_type_id, -quantity, empty=False)
+			_unreserve(WarehouseBottleStock, "warehouse", warehouse_id, bottle_type_id, quantity, now)
+			_apply(Bus(pk=bus_id), bottle_type_id, quantity, empty=False)
+			BusBottleStock.objects.filter(bus_id=bus_id, bottle_type_id=bottle_type_id).update(
+				reserved_quantity=F("reserved_quantity") + quantity, updated_at=now
+			)
+		StockMovement.objects.bulk_create(movements)
+		for bus_id, ids in by_bus.items():
+			ClientOrder.objects.filter(pk__in=ids).update(reserved_bus_id=bus_id, reserved_warehouse=None, updated_at=now)
+	inventory.invalidate()
+	return len(assignments)
+
+
+def load_reservations(tour_ids, user=None) -> int:
+	"""Charge sur le bus de chaque tournée les commandes validées de ses clients réservées sur un dépôt.
+
+	Appelé quand des clients sont confiés à un bus (planification, ajout
+	d'arrêts): la livraison consomme ensuite la réservation sur ce bus.
+	Retourne le nombre de commandes chargées.
+	"""
+	bus_by_client = dict(
+		TourStop.objects.filter(tour_id__in=list(tour_ids), status=TourStop.PENDING)
+		.exclude(tour__bus=None)
+		.values_list("client_id", "tour__bus_id")
+	)
+	if not bus_by_client:
+		return 0
+	orders = ClientOrder.objects.select_for_update().filter(
+		status=ClientOrder.VALIDATED,
+		client_id__in=list(bus_by_client),
+		reserved_warehouse__isnull=False,
+	)
+	with transaction.atomic():
+		return _load([(order, bus_by_client[order.client_id]) for order in orders], user=user)
+
+
+def check_reservation(order, bus_id):
+	"""Refuse (409) une livraison depuis un bus qui ne tient pas la réservation de la commande."""
+	if order.reserved_warehouse_id:
+		raise ReservedElsewhere(f"Commande #{order.pk} réservée au dépôt #{order.reserved_warehouse_id}: à charger sur le bus avant livraison.")
+	if order.reserved_bus_id and order.reserved_bus_id != bus_id:
+		raise ReservedElsewhere(f"Commande #{order.pk} réservée sur le bus #{order.reserved_bus_id}.")
+
+
+def release_orders(orders):
+	"""Libère les réservations des commandes (annulées, ou livrées: consommées sur le bus qui les tient).
+
+	Un UPDATE par emplacement et type de bouteille pour tout le lot.
+	"""
+	held = [order for order in orders if order.reserved_bus_id or order.reserved_warehouse_id]
+	if not held:
+		return
+	totals = defaultdict(int)
+	for order in held:
+		if order.reserved_bus_id:
+			totals[(BusBottleStock, "bus", order.reserved_bus_id, order.bottle_type_id)] += order.quantity
+		else:
+			totals[(WarehouseBottleStock, "warehouse", order.reserved_warehouse_id, order.bottle_type_id)] += order.quantity
+		order.reserved_bus_id = None
+		order.reserved_warehouse_id = None
+	now = timezone.now()
+	for (model, fk, location_id, bottle_type_id), quantity in totals.items():
+		_unreserve(model, fk, location_id, bottle_type_id, quantity, now)
+	ClientOrder.objects.filter(pk__in=[order.pk for order in held]).update(reserved_bus=None, reserved_warehouse=None)
+	inventory.invalidate()
+
+
+def _net_by_location(location_field: str) -> dict:
+	"""Solde des mouvements par (emplacement, type de bouteille, vide): entrées - sorties."""
+	totals = defaultdict(int)
+	for direction, sign in (("to", 1), ("from", -1)):
+		rows = (
+			StockMovement.objects.filter(**{f"{direction}_{location_field}__isnull": False})
+			.values_list(f"{direction}_{location_field}", "bottle_type", "empty")
+			.annotate(total=Sum("quantity"))
+			.order_by()
+		)
+		for location_id, bottle_type_id, empty, total in rows:
+			if location_field == "client":
+				empty = False
+			totals[(location_id, bottle_type_id, empty)] += sign * total
+	return totals
+
+
+def reconcile(fix: str | None = None, user=None) -> list[dict]:
+	"""Compare les stocks courants aux mouvements et retourne les écarts.
+
+	``fix="stock"`` réécrit les stocks d'après les mouvements; ``fix="movements"``
+	inscrit des corrections d'inventaire pour que les mouvements rejoignent les
+	stocks (bilan d'ouverture des stocks saisis avant les mouvements).
+	"""
+	drifts = []
+	for location_model, (model, fk) in _LOCATIONS.items():
+		expected = _net_by_location(fk)
+		stock_fields = ("quantity",) if location_model is Client else ("quantity", "empty_quantity")
+		current = {}
+		for row in model.objects.values(f"{fk}_id", "bottle_type_id", *stock_fields):
+			for field in stock_fields:
+				current[(row[f"{fk}_id"], row["bottle_type_id"], field == "empty_quantity")] = row[field]
+		for key in set(expected) | set(current):
+			wanted, actual = expected.get(key, 0), current.get(key, 0)
+			if wanted == actual:
+				continue
+			location_id, bottle_type_id, empty = key
+			drifts.append(
+				{
+					"location": fk,
+					"location_id": location_id,
+					"bottle_type_id": bottle_type_id,
+					"empty": empty,
+					"stock": actual,
+					"movements": wanted,
+				}
+			)
+			if fix == "stock":
+				field = "empty_quantity" if empty else "quantity"
+				model.objects.update_or_create(
+					**{f"{fk}_id": location_id, "bottle_type_id": bottle_type_id},
+					defaults={field: wanted},
+				)
+			elif fix == "movements":
+				# Seul le mouvement est inscrit: le stock fait foi
+				location = location_model(pk=location_id)
+				delta = actual - wanted
+				source, target = (None, location) if delta > 0 else (location, None)
+				_record(
+					StockMovement.TYPE_ADJUSTMENT,
+					bottle_type_id,
+					abs(delta),
+					source,
+					target,
+					empty,
+					user=user,
+					note="Bilan d'ouverture (réconciliation)",
+				)
+	return drifts
@@ -0,0 +1,147 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+
+from . import progress, stock
+from .audit import audit_writer
+from .models import ActivityLog, Client, TourStop
+
+
+# Un arrêt non visité peut être repris; un arrêt visité est définitif.
+ALLOWED_TRANSITIONS = {
+	TourStop.PENDING: (TourStop.COMPLETED, TourStop.SKIPPED),
+	TourStop.SKIPPED: (TourStop.PENDING, TourStop.COMPLETED),
+	TourStop.COMPLETED: (),
+}
+
+RESULT_OK = "ok"
+RESULT_NOT_FOUND = "not_found"
+RESULT_CONFLICT = "conflict"
+
+
+class TourStopsChanged(APIException):
+	status_code = status.HTTP_409_CONFLICT
+	default_detail = "Les arrêts de la tournée ont été modifiés entre-temps; rechargez-les."
+	default_code = "conflict"
+
+
+def _log(tour, description: str, data: dict, user):
+	"""Une seule entrée de journal par lot, rattachée à la tournée."""
+	audit_writer.log(tour, ActivityLog.ACTION_UPDATE, description=description, data=data, user=user)
+
+
+def bulk_create(tour, client_ids, user=None) -> list:
+	"""Ajoute des arrêts en fin de tournée, dans l'ordre reçu, en un bulk_create.
+
+	Les clients inconnus ou ayant déjà un arrêt à visiter dans la tournée sont
+	refusés (400) avant toute écriture. Les commandes des clients ajoutés
+	réservées sur un dépôt sont chargées sur le bus de la tournée.
+	"""
+	client_ids = list(dict.fromkeys(client_ids))
+	with transaction.atomic():
+		known = set(Client.objects.filter(pk__in=client_ids).values_list("id", flat=True))
+		planned = set(tour.stops.filter(status=TourStop.PENDING, client_id__in=client_ids).values_list("client_id", flat=True))
+		errors = {}
+		unknown = [pk for pk in client_ids if pk not in known]
+		if unknown:
+			errors["unknown"] = unknown
+		if planned:
+			errors["already_planned"] = sorted(planned)
+		if errors:
+			raise ValidationError({"clients": errors})
+
+		last = tour.stops.aggregate(last=Max("order_index"))["last"] or 0
+		created = TourStop.objects.bulk_create(
+			[TourStop(tour=tour, client_id=client_id, order_index=index) for index, client_id in enumerate(client_ids, start=last + 1)],
+			batch_size=500,
+		)
+		progress.refresh([tour.pk])
+		stock.load_reservations([tour.pk], user=user)
+		_log(
+			tour,
+			f"{len(created)} arrêt(s) ajouté(s) à la tournée #{tour.pk}",
+			{"stops": [stop.pk for stop in created], "clients": client_ids},
+			user,
+		)
+	return created
+
+
+def reorder(tour, stop_ids, user=None) -> dict:
+	"""Réécrit ``order_index`` selon la liste complète des arrêts de la tournée, en un bulk_update.
+
+	Les arrêts sont verrouillés le temps de l'écriture; si la liste ne correspond
+	plus aux arrêts de la tournée (ajout ou suppression concurrente),
+	TourStopsChanged (409) est levée.
+	"""
+	stop_ids = list(stop_ids)
+	now = timezone.now()
+	with transaction.atomic():
+		stops = {stop.pk: stop for stop in tour.stops.select_for_update()}
+		if len(stop_ids) != len(set(stop_ids)) or set(stop_ids) != set(stops):
+			raise TourStopsChanged()
+		changed = []
+		for index, pk in enumerate(stop_ids, start=1):
+			stop = stops[pk]
+			if stop.order_index != index:
+				stop.order_index = index
+				stop.updated_at = now
+				changed.append(stop)
+		if changed:
+			TourStop.objects.bulk_update(changed, ["order_index", "updated_at"], batch_size=500)
+			progress.refresh([tour.pk])
+			_log(tour, f"Arrêts de la tournée #{tour.pk} réordonnés ({len(changed)} déplacé(s))", {"order": stop_ids}, user)
+	return {"tour": tour.pk, "stops": len(stop_ids), "reordered": len(changed)}
+
+
+def bulk_status(tour, items, user=None) -> list[dict]:
+	"""Change le statut (et les bouteilles) de plusieurs arrêts de la tournée.
+
+	Les arrêts sont verrouillés à la lecture (``select_for_update``), puis un
+	UPDATE conditionnel par couple (statut de départ, statut visé): seuls les
+	arrêts des groupes mis à jour reçoivent leurs compteurs de bouteilles (un
+	bulk_update). Les compteurs sont déclaratifs: les livraisons (stock,
+	portefeuille) passent par core.deliveries.deliver, qui pointe lui-même
+	l'arrêt. Retourne un résultat par arrêt demandé: ok, conflict ou not_found.
+	"""
+	items = {item["id"]: item for item in items}
+	now = timezone.now()
+	results = {pk: {"id": pk, "result": RESULT_NOT_FOUND, "previous_status": None, "status": None} for pk in items}
+
+	with transaction.atomic():
+		current = dict(tour.stops.select_for_update().filter(pk__in=list(items)).order_by("pk").values_list("id", "status"))
+		groups = defaultdict(list)
+		for pk, current_status in current.items():
+			results[pk].update(previous_status=current_status, status=current_status, result=RESULT_CONFLICT)
+			target = items[pk]["status"]
+			if target in ALLOWED_TRANSITIONS.get(current_status, ()):
+				groups[(current_status, target)].append(pk)
+		applied_ids = []
+		for (source, target), group in groups.items():
+			if TourStop.objects.filter(pk__in=group, status=source).update(status=target, updated_at=now):
+				applied_ids.extend(group)
+
+		applied = list(TourStop.objects.filter(pk__in=applied_ids).order_by("pk"))
+		bottles = []
+		for stop in applied:
+			item = items[stop.pk]
+			results[stop.pk].update(status=stop.status, result=RESULT_OK)
+			if "delivered_bottles" in item or "returned_bottles" in item:
+				stop.delivered_bottles = item.get("delivered_bottles", stop.delivered_bottles)
+				stop.returned_bottles = item.get("returned_bottles", stop.returned_bottles)
+				bottles.append(stop)
+		TourStop.objects.bulk_update(bottles, ["delivered_bottles", "returned_bottles"], batch_size=500)
+
+		if applied:
+			progress.refresh([tour.pk])
+			_log(
+				tour,
+				f"Statut de {len(applied)} arrêt(s) de la tournée #{tour.pk} modifié (lot)",
+				{"results": [results[stop.pk] for stop in applied]},
+				user,
+			)
+	return [results[pk] for pk in items]
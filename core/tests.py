@@ -1,3 +1,116 @@
+import datetime
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
 from django.test import TestCase
+from django.utils import timezone
+
+from rest_framework.test import APIClient
+
+from . import ledger
+from .models import Client, ClientOrder, Driver, GasBottleType, Payment, Wallet, WalletEntry
+
+
+class LedgerTests(TestCase):
+	"""Grand livre des portefeuilles (core.ledger), sans concurrence."""
+
+	def setUp(self):
+		self.client_profile = Client.objects.create(name="Ali", phone="22000001")
+		self.bottle_type = GasBottleType.objects.create(name="B12", capacity_kg=12, price_mru=100)
+
+	def _order(self, quantity=2):
+		return ClientOrder.objects.create(
+			client=self.client_profile,
+			bottle_type=self.bottle_type,
+			quantity=quantity,
+			unit_price_mru=100,
+			total_price_mru=100 * quantity,
+		)
+
+	def test_balance_after_follows_each_entry(self):
+		ledger.post_entry(self.client_profile.pk, "100.00", WalletEntry.TYPE_ADJUSTMENT, WalletEntry.ACCOUNT_ADJUSTMENTS)
+		ledger.post_entry(self.client_profile.pk, "-30.00", WalletEntry.TYPE_ADJUSTMENT, WalletEntry.ACCOUNT_ADJUSTMENTS)
+		ledger.adjust(self.client_profile.pk, "5.50", note="Geste commercial")
+
+		entries = WalletEntry.objects.order_by("id")
+		self.assertEqual([entry.amount_mru for entry in entries], [Decimal("100.00"), Decimal("-30.00"), Decimal("5.50")])
+		self.assertEqual([entry.balance_after_mru for entry in entries], [Decimal("100.00"), Decimal("70.00"), Decimal("75.50")])
+		self.assertEqual(Wallet.objects.get(client=self.client_profile).balance_mru, Decimal("75.50"))
+
+	def test_payment_credit_replay_is_ignored(self):
+		payment = Payment.objects.create(client=self.client_profile, amount_mru="150.00")
+
+		self.assertIsNotNone(ledger.credit_payment(payment))
+		self.assertIsNone(ledger.credit_payment(payment))
+
+		self.assertEqual(WalletEntry.objects.filter(payment=payment).count(), 1)
+		self.assertEqual(Wallet.objects.get(client=self.client_profile).balance_mru, Decimal("150.00"))
+
+	def test_order_debit_replay_is_ignored(self):
+		order = self._order(quantity=3)
+
+		first = ledger.debit_order(order)
+		self.assertEqual(first.amount_mru, Decimal("-300.00"))
+		self.assertIsNone(ledger.debit_order(order))
+
+		self.assertEqual(WalletEntry.objects.filter(order=order).count(), 1)
+		self.assertEqual(Wallet.objects.get(client=self.client_profile).balance_mru, Decimal("-300.00"))
+		# Le rejeu n'a pas décalé la séquence des soldes
+		after = ledger.adjust(self.client_profile.pk, "50.00", note="Correction")
+		self.assertEqual(after.balance_after_mru, Decimal("-250.00"))
+
+	def test_balance_at_reads_last_entry_before_date(self):
+		start = timezone.now() - datetime.timedelta(days=3)
+		for day, amount in enumerate(("100.00", "-40.00", "10.00")):
+			entry = ledger.adjust(self.client_profile.pk, amount, note="Test")
+			WalletEntry.objects.filter(pk=entry.pk).update(created_at=start + datetime.timedelta(days=day))
+		wallet_id = Wallet.objects.get(client=self.client_profile).pk
+
+		self.assertEqual(ledger.balance_at(wallet_id, start - datetime.timedelta(hours=1)), Decimal("0.00"))
+		self.assertEqual(ledger.balance_at(wallet_id, start + datetime.timedelta(hours=1)), Decimal("100.00"))
+		self.assertEqual(ledger.balance_at(wallet_id, start + datetime.timedelta(days=1, hours=1)), Decimal("60.00"))
+		self.assertEqual(ledger.balance_at(wallet_id, timezone.now()), Decimal("70.00"))
+
+	def test_checkpoint_reports_drift(self):
+		ledger.adjust(self.client_profile.pk, "80.00", note="Test")
+		wallet = Wallet.objects.get(client=self.client_profile)
+
+		point, drift = ledger.checkpoint(wallet.pk)
+		self.assertEqual((point.balance_mru, drift), (Decimal("80.00"), Decimal("0.00")))
+
+		ledger.adjust(self.client_profile.pk, "-20.00", note="Test")
+		Wallet.objects.filter(pk=wallet.pk).update(balance_mru=Decimal("100.00"))
+		point, drift = ledger.checkpoint(wallet.pk)
+		self.assertEqual((point.balance_mru, drift), (Decimal("60.00"), Decimal("40.00")))
+
+
+class WalletEntryApiTests(TestCase):
+	"""Portée de l'API wallet-entries/: back-office, client, chauffeur."""
+
+	def setUp(self):
+		User = get_user_model()
+		self.own = Client.objects.create(name="Ali", phone="22000001", user=User.objects.create_user("ali", password="x"))
+		other = Client.objects.create(name="Sidi", phone="22000002")
+		ledger.adjust(self.own.pk, "10.00", note="Test")
+		ledger.adjust(other.pk, "20.00", note="Test")
+		self.driver_user = User.objects.create_user("driver", password="x")
+		Driver.objects.create(name="Moussa", phone="22000003", user=self.driver_user)
+		self.staff = User.objects.create_user("staff", password="x", is_staff=True)
+		self.api = APIClient()
+
+	def _amounts(self, user):
+		self.api.force_authenticate(user)
+		response = self.api.get("/api/wallet-entries/")
+		if response.status_code != 200:
+			return response.status_code
+		rows = response.data["results"] if isinstance(response.data, dict) else response.data
+		return sorted(row["amount_mru"] for row in rows)
+
+	def test_staff_sees_every_wallet(self):
+		self.assertEqual(self._amounts(self.staff), ["10.00", "20.00"])
+
+	def test_client_sees_own_wallet_only(self):
+		self.assertEqual(self._amounts(self.own.user), ["10.00"])
 
-# Create your tests here.
+	def test_driver_is_refused(self):
+		self.assertEqual(self._amounts(self.driver_user), 403)
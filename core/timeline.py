@@ -0,0 +1,124 @@
+import base64
+import heapq
+import json
+from dataclasses import dataclass
+from typing import Callable
+
+from django.db.models import Q, QuerySet
+from django.utils.dateparse import parse_datetime
+
+from rest_framework.exceptions import ValidationError
+
+
+@dataclass
+class TimelineSource:
+	"""Un flux d'événements: queryset filtré sur l'objet et conversion en dict.
+
+	Le queryset doit être servi par un index (..., created_at, id): chaque page
+	ne lit que ``limit + 1`` lignes par flux, quelle que soit la taille de la table.
+	"""
+
+	kind: str
+	queryset: QuerySet
+	to_item: Callable
+
+	def rows(self, position, limit: int) -> list:
+		"""Au plus ``limit + 1`` lignes antérieures au curseur: [(created_at, pk, ligne)]."""
+		qs = self.queryset
+		if position is not None:
+			qs = qs.filter(before_position(self, position))
+		return [(row.created_at, row.pk, row) for row in qs.order_by("-created_at", "-id")[: limit + 1]]
+
+
+@dataclass
+class ArchivedTimelineSource:
+	"""Un flux lu hors base (archives), entièrement antérieur au flux ``follows``.
+
+	``entries(before, accept, newest)`` produit à la demande des dicts
+	(``created_at``, ``id``, ...) du plus récent au plus ancien: ceux d'au plus
+	``before`` (None: depuis le plus récent) retenus par ``accept``, au plus
+	``newest`` par partition lue. La lecture s'arrête dès que ``limit + 1``
+	entrées sont trouvées, et n'a pas lieu si ``follows`` remplit déjà la page.
+	"""
+
+	kind: str
+	entries: Callable
+	to_item: Callable
+	follows: TimelineSource | None = None
+
+	def rows(self, position, limit: int) -> list:
+		def accept(entry):
+			# Même ordre (created_at, kind, id) que before_position
+			return position is None or (entry["created_at"], self.kind, entry["id"]) < position
+
+		found = []
+		for entry in self.entries(position[0] if position is not None else None, accept, limit + 1):
+			found.append((entry["created_at"], entry["id"], entry))
+			if len(found) > limit:
+				break
+		return found
+
+
+def encode_cursor(created_at, kind: str, pk: int) -> str:
+	raw = json.dumps([created_at.isoformat(), kind, pk]).encode()
+	return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str):
+	"""Décode un curseur opaque en (created_at, kind, pk)."""
+	try:
+		raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+		created_at, kind, pk = json.loads(raw)
+		created_at = parse_datetime(created_at)
+		if created_at is None:
+			raise ValueError(cursor)
+		return created_at, str(kind), int(pk)
+	except (ValueError, TypeError):
+		raise ValidationError({"cursor": "Curseur invalide."})
+
+
+def before_position(source: TimelineSource, cursor) -> Q:
+	"""Condition keyset: événements strictement antérieurs au curseur.
+
+	L'ordre global est (created_at, kind, id) décroissant, ce qui départage
+	les événements simultanés de flux différents.
+	"""
+	created_at, kind, pk = cursor
+	if source.kind == kind:
+		return Q(created_at__lt=created_at) | Q(created_at=created_at, id__lt=pk)
+	if source.kind < kind:
+		return Q(created_at__lte=created_at)
+	return Q(created_at__lt=created_at)
+
+
+def merge_page(sources, limit: int, cursor: str | None = None):
+	"""Fusionne plusieurs flux en une page ordonnée du plus récent au plus ancien.
+
+	Retourne ``(items, next_cursor)``; ``next_cursor`` vaut None sur la dernière page.
+	"""
+	position = decode_cursor(cursor) if cursor else None
+	rows = {}
+	for source in sources:
+		follows = getattr(source, "follows", None)
+		if follows is not None and len(rows.get(id(follows), ())) > limit:
+			# Flux précédent déjà plus long que la page: le flux plus ancien n'y figurerait pas
+			rows[id(source)] = []
+		else:
+			rows[id(source)] = source.rows(position, limit)
+	streams = [[(created_at, source.kind, pk, source, row) for created_at, pk, row in rows[id(source)]] for source in sources]
+
+	merged = heapq.merge(*streams, key=lambda entry: entry[:3], reverse=True)
+	page = []
+	has_more = False
+	for entry in merged:
+		if len(page) == limit:
+			has_more = True
+			break
+		page.append(entry)
+
+	items = [source.to_item(row) for _, _, _, source, row in page]
+	next_cursor = None
+	if has_more and page:
+		created_at, kind, pk = page[-1][:3]
+		next_cursor = encode_cursor(created_at, kind, pk)
+	return items, next_cursor
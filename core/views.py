@@ -1,22 +1,45 @@
+import datetime
+import os
+
+from django.apps import apps
 from django.contrib.admin.views.decorators import staff_member_required
 from django.contrib.auth import logout, get_user_model
+from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.decorators import login_required
+from django.db import transaction
+from django.db.models import Q
 from django.shortcuts import render, redirect
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
 
-from rest_framework import viewsets, mixins, status
-from rest_framework.exceptions import PermissionDenied
+from rest_framework import viewsets, mixins, serializers, status
+from rest_framework.decorators import action
+from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.exceptions import NotFound, PermissionDenied, ValidationError
 from rest_framework.response import Response
-
+from rest_framework.utils.urls import replace_query_param
+from rest_framework.views import APIView
+
+from . import arrivals, deliveries, geo, inventory, ledger, orders, payments, planning, progress, receipts, routing, stock, stops
+from .statement import build_statement
+from .archive import ActivityLogArchive, month_start
+from .sendfile import serve_file
+from .idempotency import IdempotentCreateMixin
+from .audit import audit_writer, diff, snapshot
+from .timeline import ArchivedTimelineSource, TimelineSource, merge_page
 from .models import (
 	Client,
 	Bus,
 	Tour,
+	TourStop,
 	BusPosition,
 	Wallet,
+	WalletEntry,
 	Payment,
 	GasBottleType,
 	ClientBottleBalance,
 	Driver,
+	DriverNotification,
 	Warehouse,
 	WarehouseBottleStock,
 	BusBottleStock,
@@ -25,15 +48,27 @@ from .models import (
 	ActivityLog,
 	PaymentStatusHistory,
 	ClientOrder,
+	StockMovement,
 )
 from .serializers import (
 	ClientSerializer,
 	BusSerializer,
 	DriverSerializer,
 	TourSerializer,
+	TourPlanSerializer,
+	TourProgressSerializer,
+	TourStopSerializer,
+	TourStopBulkCreateSerializer,
+	TourStopReorderSerializer,
+	TourStopBulkStatusSerializer,
+	DriverNotificationSerializer,
 	BusPositionSerializer,
 	WalletSerializer,
+	WalletEntrySerializer,
+	WalletAdjustmentSerializer,
 	PaymentSerializer,
+	OrderBulkStatusSerializer,
+	PaymentBulkStatusSerializer,
 	PaymentStatusHistorySerializer,
 	GasBottleTypeSerializer,
 	ClientBottleBalanceSerializer,
@@ -46,6 +81,9 @@ from .serializers import (
 	ClientSelfPaymentSerializer,
 	ClientOrderSerializer,
 	UserSerializer,
+	StockMovementSerializer,
+	StockTransferSerializer,
+	DeliverySyncSerializer,
 )
 
 
@@ -58,73 +96,33 @@ def logout_view(request):
 	return redirect("login")
 
 
-class AuditedModelViewSet(viewsets.ModelViewSet):
-	"""ModelViewSet de base qui crée une trace dans ActivityLog pour chaque action CRUD."""
+class AuditLogMixin:
+	"""Outils communs de journalisation pour les viewsets (écriture via audit_writer)."""
 
 	def _snapshot_instance(self, instance):
-		"""Retourne un dict simple des champs de base de l'instance (sans M2M)."""
-		if instance is None:
-			return {}
-		data = {}
-		for field in instance._meta.fields:
-			name = field.name
-			try:
-				value = getattr(instance, name)
-			except Exception:
-				continue
-			# Pour les FK, stocker la valeur brute (pk) plutôt que l'objet complet
-			if hasattr(value, "pk") and not isinstance(value, (str, int, float, bool)):
-				data[name] = getattr(value, "pk", None)
-			else:
-				data[name] = value
-		return data
-
-	def _build_changes(self, before: dict, after: dict) -> dict:
-		"""Construit un dict des champs modifiés: {field: {old, new}}."""
-		changes = {}
-		# Ignorer les champs purement techniques
-		ignored = {"id", "pk", "created_at", "updated_at"}
-		for field, old in before.items():
-			if field in ignored:
-				continue
-			new = after.get(field)
-			if old != new:
-				changes[field] = {"old": old, "new": new}
-		return changes
+		"""Instantané des colonnes de l'instance via le plan d'audit précompilé (sans requête)."""
+		return snapshot(instance)
 
 	def _log(self, instance, action: str, description: str = "", extra_data: dict | None = None):
-		# Génération automatique d'une description lisible si non fournie
-		try:
-			if not description:
-				model_verbose = getattr(instance._meta, "verbose_name", instance.__class__.__name__)
-				obj_id = getattr(instance, "pk", None)
-				base = f"{model_verbose}"
-				if obj_id is not None:
-					base = f"{base} #{obj_id}"
-				if action == ActivityLog.ACTION_CREATE:
-					description = f"Création de {base}"
-				elif action == ActivityLog.ACTION_UPDATE:
-					description = f"Mise à jour de {base}"
-				elif action == ActivityLog.ACTION_DELETE:
-					description = f"Suppression de {base}"
-				else:
-					description = f"Action {action} sur {base}"
-		except Exception:
-			# Si la génération automatique échoue, on garde la description brute
-			pass
+		"""Journalise une action dans ActivityLog sans casser l'API en cas d'erreur."""
+		audit_writer.log(
+			instance,
+			action,
+			description=description,
+			data=extra_data,
+			user=self._audit_user(),
+		)
+
+	def _log_changes(self, instance, before: dict, prefix: str = "") -> dict:
+		"""Journalise une mise à jour (diff avant/après) et retourne les champs modifiés."""
+		return audit_writer.log_changes(instance, before, prefix=prefix, user=self._audit_user())
+
+	def _audit_user(self):
+		return getattr(self.request, "user", None) if hasattr(self, "request") else None
 
-		try:
-			ActivityLog.objects.create(
-				user=getattr(self.request, "user", None) if hasattr(self, "request") else None,
-				model_name=instance._meta.label,
-				object_id=str(getattr(instance, "pk", "")),
-				action=action,
-				description=description,
-				data=extra_data or None,
-			)
-		except Exception:
-			# Ne jamais casser l'API à cause de la journalisation
-			pass
+
+class AuditedModelViewSet(AuditLogMixin, viewsets.ModelViewSet):
+	"""ModelViewSet de base qui crée une trace dans ActivityLog pour chaque action CRUD."""
 
 	def perform_create(self, serializer):
 		instance = serializer.save()
@@ -134,16 +132,7 @@ class AuditedModelViewSet(viewsets.ModelViewSet):
 	def perform_update(self, serializer):
 		before = self._snapshot_instance(serializer.instance)
 		instance = serializer.save()
-		after = self._snapshot_instance(instance)
-		changes = self._build_changes(before, after)
-		desc = ""
-		if changes:
-			parts = []
-			for field, vals in changes.items():
-				parts.append(f"{field}: '{vals['old']}' -> '{vals['new']}'")
-			fields_str = "; ".join(parts)
-			desc = f"Champs modifiés: {fields_str}"
-		self._log(instance, ActivityLog.ACTION_UPDATE, description=desc, extra_data={"changes": changes} if changes else None)
+		self._log_changes(instance, before)
 		return instance
 
 	def perform_destroy(self, instance):
@@ -151,10 +140,55 @@ class AuditedModelViewSet(viewsets.ModelViewSet):
 		return super().perform_destroy(instance)
 
 
+def _statement_response(request, client):
+	"""Relevé de compte paginé par curseur (?limit=50&cursor=...)."""
+	try:
+		limit = min(int(request.query_params.get("limit", 50)), 200)
+	except ValueError:
+		limit = 50
+	data = build_statement(client, max(limit, 1), request.query_params.get("cursor") or None)
+	next_cursor = data.pop("next_cursor")
+	data["next"] = replace_query_param(request.build_absolute_uri(), "cursor", next_cursor) if next_cursor else None
+	return Response(data)
+
+
 class ClientViewSet(AuditedModelViewSet):
 	queryset = Client.objects.all().order_by("id")
 	serializer_class = ClientSerializer
 
+	@action(detail=True, methods=["get"])
+	def statement(self, request, pk=None):
+		"""Relevé de compte du client pour le back-office."""
+		if not _user_can_access_dashboard(request.user):
+			raise PermissionDenied("Vous n'avez pas accès aux relevés de compte.")
+		return _statement_response(request, self.get_object())
+
+
+class ClientStatementView(APIView):
+	"""Relevé de compte du client connecté (écran « Voir mon compte »).
+
+	GET /api/client-statement/?limit=50&cursor=...
+	"""
+
+	def get(self, request):
+		try:
+			client = request.user.client_profile
+		except Client.DoesNotExist:
+			raise PermissionDenied("Seuls les comptes clients ont un relevé de compte.")
+		return _statement_response(request, client)
+
+
+class InventoryView(APIView):
+	"""Inventaire du réseau par type de bouteille: dépôts, bus et clients (pleines / vides).
+
+	GET /api/inventory/ — agrégats SQL mis en cache, invalidés à chaque mouvement de stock.
+	"""
+
+	def get(self, request):
+		if not _user_can_access_dashboard(request.user):
+			raise PermissionDenied("Vous n'avez pas accès à l'inventaire.")
+		return Response(inventory.inventory())
+
 
 class UserViewSet(AuditedModelViewSet):
 	serializer_class = UserSerializer
@@ -177,11 +211,115 @@ class DriverViewSet(AuditedModelViewSet):
 
 
 class TourViewSet(AuditedModelViewSet):
-	queryset = Tour.objects.select_related("bus", "driver").all().order_by("-date")
+	queryset = Tour.objects.select_related("bus__warehouse", "driver").all().order_by("-date")
 	serializer_class = TourSerializer
 
+	@action(detail=True, methods=["post"])
+	def optimize(self, request, pk=None):
+		"""Réordonne les arrêts à visiter (plus proche voisin + 2-opt / Or-opt).
+
+		Retourne la distance avant / après (km), départ et retour au dépôt du bus.
+		"""
+		if not _user_can_access_dashboard(request.user):
+			raise PermissionDenied("Vous n'avez pas accès à la planification des tournées.")
+		tour = self.get_object()
+		return Response(routing.optimise_tour(tour, user=request.user))
+
+	@action(detail=False, methods=["post"])
+	def plan(self, request):
+		"""Crée les tournées d'un jour à partir des commandes validées non planifiées.
+
+		Corps: {"date": "AAAA-MM-JJ" (défaut: aujourd'hui), "dry_run": false}.
+		"""
+		if not _user_can_access_dashboard(request.user):
+			raise PermissionDenied("Vous n'avez pas accès à la planification des tournées.")
+		serializer = TourPlanSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		summary = planning.plan_day(
+			serializer.validated_data.get("date"),
+			user=request.user,
+			dry_run=serializer.validated_data["dry_run"],
+		)
+		return Response(summary, status=status.HTTP_200_OK if summary["dry_run"] else status.HTTP_201_CREATED)
+
+	@action(detail=False, methods=["get"])
+	def progress(self, request):
+		"""Avancement de toutes les tournées d'un jour (popup bus de la carte en direct).
+
+		GET /api/tours/progress/?date=AAAA-MM-JJ (défaut: aujourd'hui).
+		"""
+		if not _user_can_access_dashboard(request.user):
+			raise PermissionDenied("Vous n'avez pas accès au suivi des tournées.")
+		day = None
+		if request.query_params.get("date"):
+			day = parse_date(request.query_params["date"])
+			if day is None:
+				raise ValidationError({"date": "Date invalide (AAAA-MM-JJ)."})
+		return Response(TourProgressSerializer(progress.active(day), many=True).data)
+
+
+class TourStopViewSet(viewsets.GenericViewSet):
+	"""Arrêts d'une tournée, gérés par lots: /api/tours/<id>/stops/.
+
+	GET: liste ordonnée. POST: ajout en fin de tournée ({"clients": [..]}).
+	POST reorder/: ordre complet ({"stops": [ids]}). POST status/: statuts et
+	bouteilles ({"stops": [{"id", "status", "delivered_bottles", "returned_bottles"}]}).
+	Le planificateur a tous les droits; le chauffeur de la tournée peut la
+	consulter, la réordonner et pointer ses arrêts.
+	"""
+
+	serializer_class = TourStopSerializer
+	pagination_class = None
+
+	def get_tour(self, planner_only: bool = False):
+		tour = Tour.objects.select_related("driver").filter(pk=self.kwargs["tour_pk"]).first()
+		if tour is None:
+			raise NotFound("Tournée introuvable.")
+		user = self.request.user
+		if _user_can_access_dashboard(user):
+			return tour
+		if not planner_only and tour.driver is not None and tour.driver.user_id == user.pk:
+			return tour
+		raise PermissionDenied("Vous n'avez pas accès aux arrêts de cette tournée.")
+
+	def get_queryset(self):
+		return TourStop.objects.filter(tour=self.get_tour()).select_related("client").order_by("order_index", "id")
+
+	def list(self, request, tour_pk=None):
+		return Response(self.get_serializer(self.get_queryset(), many=True).data)
+
+	def create(self, request, tour_pk=None):
+		tour = self.get_tour(planner_only=True)
+		serializer = TourStopBulkCreateSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		created = stops.bulk_create(tour, serializer.validated_data["clients"], user=request.user)
+		return Response(
+			self.get_serializer(TourStop.objects.filter(pk__in=[stop.pk for stop in created]).select_related("client"), many=True).data,
+			status=status.HTTP_201_CREATED,
+		)
+
+	@action(detail=False, methods=["post"])
+	def reorder(self, request, tour_pk=None):
+		tour = self.get_tour()
+		serializer = TourStopReorderSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		return Response(stops.reorder(tour, serializer.validated_data["stops"], user=request.user))
+
+	@action(detail=False, methods=["post"], url_path="status")
+	def bulk_status(self, request, tour_pk=None):
+		tour = self.get_tour()
+		serializer = TourStopBulkStatusSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		results = stops.bulk_status(tour, serializer.validated_data["stops"], user=request.user)
+		return Response(
+			{
+				"updated": sum(1 for r in results if r["result"] == stops.RESULT_OK),
+				"results": results,
+			}
+		)
 
-class BusPositionViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
+
+class BusPositionViewSet(IdempotentCreateMixin, mixins.CreateModelMixin, mixins.ListModelMixin, viewsets.GenericViewSet):
 	"""Permet de créer de nouvelles positions (côté chauffeur) et de lister les positions (côté back-office)."""
 
 	queryset = BusPosition.objects.select_related("bus", "tour").all().order_by("-created_at")
@@ -204,21 +342,12 @@ class BusPositionViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, viewset
 			except (TypeError, ValueError):
 				pass
 
+		# Arrivée / départ chez un client de la tournée (présence tenue sur TourProgress)
+		arrivals.track(position, user=self.request.user)
+
 		# Geofencing alert (outside all active zones)
 		zones = GeofenceZone.objects.filter(is_active=True)
 		if zones.exists():
-			from math import radians, sin, cos, asin, sqrt
-
-			def haversine(lat1, lon1, lat2, lon2):
-				# distance in meters
-				R = 6371000.0
-				phi1, phi2 = radians(lat1), radians(lat2)
-				dphi = radians(lat2 - lat1)
-				dlambda = radians(lon2 - lon1)
-				a = sin(dphi / 2) ** 2 + cos(phi1) * cos(phi2) * sin(dlambda / 2) ** 2
-				c = 2 * asin(sqrt(a))
-				return R * c
-
 			try:
 				lat = float(position.latitude)
 				lon = float(position.longitude)
@@ -260,7 +389,7 @@ class BusPositionViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, viewset
 					try:
 						cz_lat = float(z.center_latitude)
 						cz_lon = float(z.center_longitude)
-						if haversine(lat, lon, cz_lat, cz_lon) <= z.radius_meters:
+						if geo.haversine_km(lat, lon, cz_lat, cz_lon) * 1000 <= z.radius_meters:
 							inside_any = True
 							break
 					except (TypeError, ValueError):
@@ -279,6 +408,64 @@ class WalletViewSet(viewsets.ReadOnlyModelViewSet):
 	queryset = Wallet.objects.select_related("client").all().order_by("client__name")
 	serializer_class = WalletSerializer
 
+	@action(detail=True, methods=["get"])
+	def balance(self, request, pk=None):
+		"""Solde courant, ou solde à une date donnée (?at=AAAA-MM-JJTHH:MM)."""
+		wallet = self.get_object()
+		at = request.query_params.get("at") or None
+		if at is None:
+			return Response({"wallet": wallet.id, "at": None, "balance_mru": str(wallet.balance_mru)})
+		when = parse_datetime(at)
+		if when is None:
+			raise ValidationError({"at": "Date invalide."})
+		if timezone.is_naive(when):
+			when = timezone.make_aware(when)
+		return Response({"wallet": wallet.id, "at": when.isoformat(), "balance_mru": str(ledger.balance_at(wallet.id, when))})
+
+	@action(detail=True, methods=["post"])
+	def adjust(self, request, pk=None):
+		"""Ajustement manuel du solde (finance uniquement)."""
+		user = request.user
+		if not (user.is_superuser or user.has_perm("core.can_validate_payments")):
+			raise PermissionDenied("Seul un utilisateur financier peut ajuster un portefeuille.")
+		wallet = self.get_object()
+		serializer = WalletAdjustmentSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		entry = ledger.adjust(wallet.client_id, serializer.validated_data["amount_mru"], serializer.validated_data["note"], user=user)
+		audit_writer.log(
+			wallet,
+			ActivityLog.ACTION_UPDATE,
+			description=f"Ajustement de portefeuille: {entry.amount_mru} MRU",
+			data={"entry_id": entry.id, "amount_mru": str(entry.amount_mru), "note": entry.note},
+			user=user,
+		)
+		return Response(WalletEntrySerializer(entry).data, status=status.HTTP_201_CREATED)
+
+
+class WalletEntryViewSet(viewsets.ReadOnlyModelViewSet):
+	"""Grand livre des portefeuilles (lecture seule). Filtres: ?client=, ?wallet=.
+
+	Back-office: toutes les écritures; compte client: celles de son portefeuille.
+	"""
+
+	queryset = WalletEntry.objects.select_related("wallet", "created_by").order_by("-created_at", "-id")
+	serializer_class = WalletEntrySerializer
+
+	def get_queryset(self):
+		qs = super().get_queryset()
+		user = self.request.user
+		if not _user_can_access_dashboard(user):
+			try:
+				qs = qs.filter(wallet__client=user.client_profile)
+			except Client.DoesNotExist:
+				raise PermissionDenied("Vous n'avez pas accès au grand livre.")
+		client_id = self.request.query_params.get("client") or None
+		wallet_id = self.request.query_params.get("wallet") or None
+		if client_id:
+			qs = qs.filter(wallet__client_id=client_id)
+		if wallet_id:
+			qs = qs.filter(wallet_id=wallet_id)
+		return qs
 
 
 class PaymentViewSet(AuditedModelViewSet):
@@ -286,66 +473,77 @@ class PaymentViewSet(AuditedModelViewSet):
 	serializer_class = PaymentSerializer
 
 	def perform_create(self, serializer):
-		# Toute demande de paiement créée via l'API est en attente
-		instance = serializer.save(status=Payment.PENDING)
-		PaymentStatusHistory.objects.create(
-			payment=instance,
-			previous_status=None,
-			new_status=Payment.PENDING,
-			changed_by=getattr(self.request, "user", None),
-			note="Création de la demande de paiement",
-		)
+		# Toute demande de paiement créée via l'API est en attente; historique dans la même transaction
+		with transaction.atomic():
+			instance = serializer.save(status=Payment.PENDING)
+			audit_writer.write_history([
+				PaymentStatusHistory(
+					payment=instance,
+					previous_status=None,
+					new_status=Payment.PENDING,
+					changed_by=getattr(self.request, "user", None),
+					note="Création de la demande de paiement",
+				)
+			])
 		self._log(instance, ActivityLog.ACTION_CREATE, "Création de paiement en attente")
 		return instance
 
 	def perform_update(self, serializer):
-		payment = self.get_object()
-		old_status = payment.status
-		before = self._snapshot_instance(payment)
-		instance = serializer.save()
-		new_status = instance.status
-		after = self._snapshot_instance(instance)
-		changes = self._build_changes(before, after)
-		changes_data = {"changes": changes} if changes else None
-
-		if old_status != new_status and new_status in (Payment.VALIDATED, Payment.REJECTED):
-			user = getattr(self.request, "user", None)
-			if not (user and (user.is_superuser or user.has_perm("core.can_validate_payments"))):
-				raise PermissionDenied("Seul un utilisateur financier peut valider ou rejeter un paiement.")
-			PaymentStatusHistory.objects.create(
-				payment=instance,
-				previous_status=old_status,
-				new_status=new_status,
-				changed_by=user,
-				note="Changement de statut via le back-office",
-			)
-			desc = f"Changement de statut {old_status} -> {new_status}"
-			if changes:
-				parts = []
-				for field, vals in changes.items():
-					parts.append(f"{field}: '{vals['old']}' -> '{vals['new']}'")
-				fields_str = "; ".join(parts)
-				desc = f"{desc} | Champs modifiés: {fields_str}"
-			self._log(
-				instance,
-				ActivityLog.ACTION_UPDATE,
-				desc,
-				extra_data=changes_data,
-			)
-		else:
-			# Mise à jour classique sans changement de statut critique
-			desc = ""
-			if changes:
-				parts = []
-				for field, vals in changes.items():
-					parts.append(f"{field}: '{vals['old']}' -> '{vals['new']}'")
-				fields_str = "; ".join(parts)
-				desc = f"Champs modifiés: {fields_str}"
-			self._log(instance, ActivityLog.ACTION_UPDATE, description=desc, extra_data=changes_data)
+		instance = serializer.instance
+		before = self._snapshot_instance(instance)
+		old_status = instance.status
+		new_status = serializer.validated_data.pop("status", old_status)
+		user = getattr(self.request, "user", None)
+
+		# Transition vérifiée avant toute écriture (403 / 409)
+		if new_status != old_status:
+			payments.check_transition(old_status, new_status, user)
+		# Champs et statut dans une même transaction: un conflit (409) annule toute la requête
+		with transaction.atomic():
+			if serializer.validated_data:
+				instance = serializer.save()
+
+			if new_status != old_status:
+				payments.transition(
+					instance,
+					new_status,
+					user,
+					note="Changement de statut via le back-office",
+					expected=old_status,
+					changes=diff(before, snapshot(instance)),
+				)
+			else:
+				# Mise à jour classique sans changement de statut
+				self._log_changes(instance, before)
 		return instance
 
+	@action(detail=False, methods=["post"], url_path="bulk-status")
+	def bulk_status(self, request):
+		"""Valide ou rejette plusieurs paiements en une requête.
 
-class ClientOrderViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
+		Corps: {"ids": [..], "status": "validated" | "rejected", "reason": "..."}.
+		Retourne un résultat par id: ok, conflict (statut incompatible) ou not_found.
+		"""
+		if not payments.can_validate_payments(request.user):
+			raise PermissionDenied("Seul un utilisateur financier peut valider ou rejeter un paiement.")
+		serializer = PaymentBulkStatusSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		results = payments.bulk_decide(
+			serializer.validated_data["ids"],
+			serializer.validated_data["status"],
+			request.user,
+			reason=serializer.validated_data["reason"],
+		)
+		return Response(
+			{
+				"status": serializer.validated_data["status"],
+				"updated": sum(1 for r in results if r["result"] == payments.RESULT_OK),
+				"results": results,
+			}
+		)
+
+
+class ClientOrderViewSet(IdempotentCreateMixin, mixins.CreateModelMixin, mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
 	serializer_class = ClientOrderSerializer
 
 	def get_client(self):
@@ -370,26 +568,57 @@ class ClientOrderViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.
 		user = getattr(self.request, "user", None)
 		if not user or not user.is_authenticated:
 			raise PermissionDenied("Authentification requise.")
-		# Seuls les utilisateurs financiers ou superadmins peuvent modifier le statut
-		if not (user.is_superuser or user.has_perm("core.can_validate_payments")):
+		# Seuls les utilisateurs financiers ou superadmins peuvent modifier une commande
+		if not payments.can_validate_payments(user):
 			raise PermissionDenied("Seul un utilisateur financier peut modifier une commande.")
 
-		before_status = serializer.instance.status
-		instance = serializer.save()
-		after_status = instance.status
-		ActivityLog.objects.create(
-			user=user,
-			model_name=ClientOrder._meta.label,
-			object_id=str(instance.pk),
-			action=ActivityLog.ACTION_UPDATE,
-			description=f"Changement de statut commande {before_status} -> {after_status}",
-			data={
-				"before_status": before_status,
-				"after_status": after_status,
-			},
-		)
+		instance = serializer.instance
+		before = snapshot(instance)
+		old_status = instance.status
+		new_status = serializer.validated_data.pop("status", old_status)
+		# La réservation de stock porte sur la quantité et le type validés
+		if old_status != ClientOrder.PENDING:
+			locked = {
+				name: "Non modifiable une fois la commande validée."
+				for field, name in (("quantity", "quantity"), ("bottle_type", "bottle_type_id"))
+				if field in serializer.validated_data and serializer.validated_data[field] != getattr(instance, field)
+			}
+			if locked:
+				raise ValidationError(locked)
+		# Transition vérifiée avant toute écriture (403 / 409)
+		if new_status != old_status:
+			orders.check_transition(old_status, new_status, user)
+		# Champs et statut dans une même transaction: conflit (409) ou stock
+		# insuffisant à la réservation annulent toute la requête
+		with transaction.atomic():
+			if serializer.validated_data:
+				instance = serializer.save()
+
+			if new_status != old_status:
+				orders.transition(instance, new_status, user, expected=old_status, changes=diff(before, snapshot(instance)))
+			else:
+				audit_writer.log_changes(instance, before, user=user)
 		return instance
 
+	@action(detail=False, methods=["post"], url_path="bulk-status")
+	def bulk_status(self, request):
+		"""Valide ou annule plusieurs commandes en une requête.
+
+		Corps: {"ids": [..], "status": "validated" | "cancelled"}. Les paiements en
+		attente des commandes validées sont créés dans la même transaction.
+		Retourne un résultat par id: ok, conflict (statut incompatible) ou not_found.
+		"""
+		serializer = OrderBulkStatusSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		results = orders.bulk_transition(serializer.validated_data["ids"], serializer.validated_data["status"], request.user)
+		return Response(
+			{
+				"status": serializer.validated_data["status"],
+				"updated": sum(1 for r in results if r["result"] == orders.RESULT_OK),
+				"results": results,
+			}
+		)
+
 	def perform_create(self, serializer):
 		client = self.get_client()
 		bottle_type = serializer.validated_data["bottle_type"]
@@ -402,11 +631,9 @@ class ClientOrderViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.
 			total_price_mru=total_price,
 			status=ClientOrder.PENDING,
 		)
-		ActivityLog.objects.create(
-			user=getattr(self.request, "user", None),
-			model_name=ClientOrder._meta.label,
-			object_id=str(instance.pk),
-			action=ActivityLog.ACTION_CREATE,
+		audit_writer.log(
+			instance,
+			ActivityLog.ACTION_CREATE,
 			description="Création de commande client (mobile)",
 			data={
 				"client_id": client.id,
@@ -415,14 +642,23 @@ class ClientOrderViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.
 				"unit_price_mru": str(unit_price),
 				"total_price_mru": str(total_price),
 			},
+			user=getattr(self.request, "user", None),
 		)
 		return instance
 
 
+class DriverQueuePagination(LimitOffsetPagination):
+	# Sans ?limit, la liste complète est renvoyée (anciennes versions de l'application)
+	max_limit = 100
+
+
 class DriverOrderViewSet(mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
 	"""Vue dédiée aux chauffeurs pour consulter et marquer les commandes comme livrées.
 
-	- LIST: retourne les commandes encore à livrer (pas en statut DELIVERED ou CANCELLED).
+	- LIST: retourne les commandes encore à livrer de la tournée du jour (ou autour du bus,
+	  de sa dernière position ou de son dépôt; 409 position_required sans tournée ni
+	  position), de la plus proche à la plus lointaine (?lat=&lon= pour la position du
+	  téléphone, ?limit=&offset= pour paginer).
 	- UPDATE (PATCH): permet au chauffeur de marquer une commande comme livrée.
 	"""
 
@@ -439,25 +675,31 @@ class DriverOrderViewSet(mixins.ListModelMixin, mixins.UpdateModelMixin, viewset
 		except DriverModel.DoesNotExist:
 			raise PermissionDenied("Seuls les comptes chauffeurs peuvent utiliser cette API.")
 
+	pagination_class = DriverQueuePagination
+
 	def get_queryset(self):
 		# S'assure que l'utilisateur est bien un chauffeur
-		self.get_driver()
-		from .models import ClientOrder as ClientOrderModel  # alias local
+		driver = self.get_driver()
+		params = self.request.query_params
+		try:
+			self.queue_origin = deliveries.driver_origin(driver, params.get("lat"), params.get("lon"))
+		except ValueError:
+			raise ValidationError({"lat": "Coordonnées invalides."})
+		return deliveries.driver_queue(driver, self.queue_origin)
 
-		return (
-			ClientOrderModel.objects.select_related("client", "bottle_type")
-			.filter(status__in=[ClientOrderModel.PENDING, ClientOrderModel.VALIDATED])
-			.order_by("-created_at")
-		)
+	def get_serializer_context(self):
+		context = super().get_serializer_context()
+		context["origin"] = getattr(self, "queue_origin", None)
+		return context
 
 	def partial_update(self, request, *args, **kwargs):
 		"""Permet à un chauffeur de marquer une commande comme livrée.
 
-		On force le statut à DELIVERED et on renseigne delivered_at / delivered_by.
+		On force le statut à DELIVERED et on renseigne delivered_at / delivered_by
+		(voir core.deliveries), ainsi que les bouteilles vides rendues (returned_bottles).
 		"""
 
 		driver = self.get_driver()
-		from django.utils import timezone
 		from .models import ClientOrder as ClientOrderModel
 
 		instance = self.get_object()
@@ -467,98 +709,54 @@ class DriverOrderViewSet(mixins.ListModelMixin, mixins.UpdateModelMixin, viewset
 				status=status.HTTP_400_BAD_REQUEST,
 			)
 
-		instance.status = ClientOrderModel.DELIVERED
-		instance.delivered_at = timezone.now()
-		instance.delivered_by = driver
-		instance.save(update_fields=["status", "delivered_at", "delivered_by", "updated_at"])
-
-		# Journaliser dans ActivityLog
 		try:
-			ActivityLog.objects.create(
-				user=request.user,
-				model_name=ClientOrderModel._meta.label,
-				object_id=str(instance.pk),
-				action=ActivityLog.ACTION_UPDATE,
-				description=f"Commande livrée par {driver.name}",
-				data={
-					"status": instance.status,
-					"delivered_by_driver_id": driver.id,
-					"delivered_by_driver_name": driver.name,
-					"delivered_at": instance.delivered_at.isoformat(),
-				},
+			returned = max(int(request.data.get("returned_bottles") or 0), 0)
+		except (TypeError, ValueError):
+			raise ValidationError({"returned_bottles": "Nombre de bouteilles vides invalide."})
+
+		outcome = deliveries.deliver(instance, driver, request.user, returned_bottles=returned)
+		if outcome == deliveries.RESULT_CONFLICT:
+			return Response(
+				{"detail": "Cette commande ne peut plus être livrée."},
+				status=status.HTTP_409_CONFLICT,
 			)
-		except Exception:
-			pass
+		instance.refresh_from_db()
 
 		serializer = self.get_serializer(instance)
 		return Response(serializer.data)
 
+	@action(detail=False, methods=["post"])
+	def sync(self, request):
+		"""Synchronisation hors ligne: POST /api/driver-orders/sync/ avec une liste de livraisons.
 
-class ClientPaymentViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
-	serializer_class = ClientSelfPaymentSerializer
+		Corps: {"deliveries": [{"order_id", "delivered_at", "returned_bottles", "latitude", "longitude"}, ...]}
+		Réponse: un résultat par événement (ok, duplicate, conflict, not_found).
+		"""
+		driver = self.get_driver()
+		serializer = DeliverySyncSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		results = deliveries.sync(driver, request.user, serializer.validated_data["deliveries"])
+		return Response({"results": results})
 
-	def _snapshot_instance(self, instance):
-		"""Retourne un dict simple des champs de base de l'instance (sans M2M)."""
-		if instance is None:
-			return {}
-		data = {}
-		for field in instance._meta.fields:
-			name = field.name
+	@action(detail=False, methods=["get"])
+	def notifications(self, request):
+		"""Fil du chauffeur (arrêts ajoutés à sa tournée, ...), du plus récent au plus ancien.
+
+		GET /api/driver-orders/notifications/?after=<id>: seulement les messages postérieurs.
+		"""
+		driver = self.get_driver()
+		queryset = DriverNotification.objects.filter(driver=driver)
+		after = request.query_params.get("after")
+		if after:
 			try:
-				value = getattr(instance, name)
-			except Exception:
-				continue
-			# Pour les FK, stocker la valeur brute (pk) plutôt que l'objet complet
-			if hasattr(value, "pk") and not isinstance(value, (str, int, float, bool)):
-				data[name] = getattr(value, "pk", None)
-			else:
-				data[name] = value
-		return data
-
-	def _build_changes(self, before: dict, after: dict) -> dict:
-		"""Construit un dict des champs modifiés: {field: {old, new}}."""
-		changes = {}
-		ignored = {"id", "pk", "created_at", "updated_at"}
-		for field, old in before.items():
-			if field in ignored:
-				continue
-			new = after.get(field)
-			if old != new:
-				changes[field] = {"old": old, "new": new}
-		return changes
+				queryset = queryset.filter(id__gt=int(after))
+			except ValueError:
+				raise ValidationError({"after": "Identifiant invalide."})
+		return Response(DriverNotificationSerializer(queryset.order_by("-id")[:50], many=True).data)
 
-	def _log(self, instance, action: str, description: str = "", extra_data: dict | None = None):
-		"""Journalise une action dans ActivityLog sans casser l'API en cas d'erreur."""
-		try:
-			if not description:
-				model_verbose = getattr(instance._meta, "verbose_name", instance.__class__.__name__)
-				obj_id = getattr(instance, "pk", None)
-				base = f"{model_verbose}"
-				if obj_id is not None:
-					base = f"{base} #{obj_id}"
-				if action == ActivityLog.ACTION_CREATE:
-					description = f"Création de {base}"
-				elif action == ActivityLog.ACTION_UPDATE:
-					description = f"Mise à jour de {base}"
-				elif action == ActivityLog.ACTION_DELETE:
-					description = f"Suppression de {base}"
-				else:
-					description = f"Action {action} sur {base}"
-		except Exception:
-			pass
 
-		try:
-			ActivityLog.objects.create(
-				user=getattr(self.request, "user", None),
-				model_name=instance._meta.label,
-				object_id=str(getattr(instance, "pk", "")),
-				action=action,
-				description=description,
-				data=extra_data or None,
-			)
-		except Exception:
-			# Ne jamais casser l'API à cause de la journalisation
-			pass
+class ClientPaymentViewSet(IdempotentCreateMixin, AuditLogMixin, mixins.CreateModelMixin, mixins.ListModelMixin, mixins.UpdateModelMixin, viewsets.GenericViewSet):
+	serializer_class = ClientSelfPaymentSerializer
 
 	def get_client(self):
 		user = getattr(self.request, "user", None)
@@ -576,90 +774,47 @@ class ClientPaymentViewSet(mixins.CreateModelMixin, mixins.ListModelMixin, mixin
 
 	def perform_create(self, serializer):
 		client = self.get_client()
-		instance = serializer.save(client=client, status=Payment.PENDING)
-		PaymentStatusHistory.objects.create(
-			payment=instance,
-			previous_status=None,
-			new_status=Payment.PENDING,
-			changed_by=getattr(self.request, "user", None),
-			note="Création de la demande de paiement (client)",
-		)
-		ActivityLog.objects.create(
-			user=getattr(self.request, "user", None),
-			model_name=Payment._meta.label,
-			object_id=str(instance.pk),
-			action=ActivityLog.ACTION_CREATE,
+		with transaction.atomic():
+			instance = serializer.save(client=client, status=Payment.PENDING)
+			audit_writer.write_history([
+				PaymentStatusHistory(
+					payment=instance,
+					previous_status=None,
+					new_status=Payment.PENDING,
+					changed_by=getattr(self.request, "user", None),
+					note="Création de la demande de paiement (client)",
+				)
+			])
+		audit_writer.log(
+			instance,
+			ActivityLog.ACTION_CREATE,
 			description="Création de paiement en attente (client mobile)",
 			data={"amount_mru": str(instance.amount_mru), "client_id": client.id},
+			user=getattr(self.request, "user", None),
 		)
 		return instance
 
 	def perform_update(self, serializer):
-		payment = self.get_object()
-		old_status = payment.status
-		before = self._snapshot_instance(payment)
+		before = self._snapshot_instance(serializer.instance)
 		# Laisser DRF appliquer les champs (receipt_image, method, ...)
 		instance = serializer.save()
-		new_status = instance.status
 
 		# Si un reçu vient d'être ajouté pour la première fois et que le statut était pending,
-		# forcer le passage en PENDING_ADMIN
-		if (
-			old_status == Payment.PENDING
-			and instance.receipt_image is not None
-			and not payment.receipt_image  # avant la sauvegarde, pas de reçu
-		):
-			instance.status = Payment.PENDING_ADMIN
-			instance.save(update_fields=["status"])
-			new_status = instance.status
-		after = self._snapshot_instance(instance)
-		changes = self._build_changes(before, after)
-		changes_data = {"changes": changes} if changes else None
-
-		if old_status != new_status:
-			user = getattr(self.request, "user", None)
-			# Passage en VALIDATED / REJECTED: réservé à la finance / superadmin
-			if new_status in (Payment.VALIDATED, Payment.REJECTED):
-				if not (user and (user.is_superuser or user.has_perm("core.can_validate_payments"))):
-					raise PermissionDenied("Seul un utilisateur financier peut valider ou rejeter un paiement.")
-				note = "Changement de statut via l'API (finance)"
-			# Passage en PENDING_ADMIN après dépôt du reçu: effectué par le client
-			elif new_status == Payment.PENDING_ADMIN:
-				note = "Envoi du reçu par le client"
-			else:
-				note = "Changement de statut"
-
-			PaymentStatusHistory.objects.create(
-				payment=instance,
-				previous_status=old_status,
-				new_status=new_status,
-				changed_by=user,
-				note=note,
-			)
-			desc = f"Changement de statut {old_status} -> {new_status}"
-			if changes:
-				parts = []
-				for field, vals in changes.items():
-					parts.append(f"{field}: '{vals['old']}' -> '{vals['new']}'")
-				fields_str = "; ".join(parts)
-				desc = f"{desc} | Champs modifiés: {fields_str}"
-			self._log(
-				instance,
-				ActivityLog.ACTION_UPDATE,
-				desc,
-				extra_data=changes_data,
-			)
-		else:
-			# Mise à jour classique sans changement de statut
-			desc = ""
-			if changes:
-				parts = []
-				for field, vals in changes.items():
-					parts.append(f"{field}: '{vals['old']}' -> '{vals['new']}'")
-				fields_str = "; ".join(parts)
-				desc = f"Champs modifiés: {fields_str}"
-			self._log(instance, ActivityLog.ACTION_UPDATE, description=desc, extra_data=changes_data)
-
+		# passer en PENDING_ADMIN (transition conditionnelle: sans effet si la finance a tranché entre-temps)
+		if before.get("status") == Payment.PENDING and instance.receipt_image and not before.get("receipt_image"):
+			try:
+				payments.transition(
+					instance,
+					Payment.PENDING_ADMIN,
+					getattr(self.request, "user", None),
+					note="Envoi du reçu par le client",
+					expected=Payment.PENDING,
+					changes=diff(before, snapshot(instance)),
+				)
+				return instance
+			except payments.PaymentTransitionConflict:
+				pass
+		self._log_changes(instance, before)
 		return instance
 
 
@@ -678,14 +833,97 @@ class WarehouseViewSet(AuditedModelViewSet):
 	serializer_class = WarehouseSerializer
 
 
-class WarehouseBottleStockViewSet(AuditedModelViewSet):
+class StockRowViewSet(AuditedModelViewSet):
+	"""Stocks saisis à la main: les écarts de quantité passent par des corrections
+	d'inventaire (mouvement + UPDATE F()), jamais par une écriture directe."""
+
+	location_field = None
+
+	def _adjust(self, instance, quantities: dict):
+		location = getattr(instance, self.location_field)
+		for field, empty in (("quantity", False), ("empty_quantity", True)):
+			if field in quantities:
+				delta = quantities[field] - getattr(instance, field)
+				stock.adjust(location, instance.bottle_type, delta, empty=empty, user=self._audit_user(), note="Saisie manuelle du stock")
+		instance.refresh_from_db(fields=["quantity", "empty_quantity"])
+
+	def _pop_quantities(self, serializer) -> dict:
+		return {field: serializer.validated_data.pop(field) for field in ("quantity", "empty_quantity") if field in serializer.validated_data}
+
+	def perform_create(self, serializer):
+		quantities = self._pop_quantities(serializer)
+		with transaction.atomic():
+			instance = serializer.save()
+			self._adjust(instance, quantities)
+		self._log(instance, ActivityLog.ACTION_CREATE)
+		return instance
+
+	def perform_update(self, serializer):
+		before = self._snapshot_instance(serializer.instance)
+		quantities = self._pop_quantities(serializer)
+		with transaction.atomic():
+			instance = serializer.save()
+			self._adjust(instance, quantities)
+		self._log_changes(instance, before)
+		return instance
+
+
+class WarehouseBottleStockViewSet(StockRowViewSet):
 	queryset = WarehouseBottleStock.objects.select_related("warehouse", "bottle_type").all()
 	serializer_class = WarehouseBottleStockSerializer
+	location_field = "warehouse"
 
 
-class BusBottleStockViewSet(AuditedModelViewSet):
+class BusBottleStockViewSet(StockRowViewSet):
 	queryset = BusBottleStock.objects.select_related("bus", "bottle_type").all()
 	serializer_class = BusBottleStockSerializer
+	location_field = "bus"
+
+
+class StockMovementViewSet(mixins.CreateModelMixin, viewsets.ReadOnlyModelViewSet):
+	"""Journal des mouvements de stock (lecture) et saisie des chargements / déchargements de bus.
+
+	Filtres: ?bus=, ?warehouse=, ?client=, ?bottle_type=, ?movement_type=
+	"""
+
+	serializer_class = StockMovementSerializer
+
+	def get_queryset(self):
+		if not _user_can_access_dashboard(self.request.user):
+			raise PermissionDenied("Vous n'avez pas accès aux mouvements de stock.")
+		qs = StockMovement.objects.select_related("bottle_type", "created_by").order_by("-created_at", "-id")
+		params = self.request.query_params
+		for location in ("bus", "warehouse", "client"):
+			value = params.get(location)
+			if value:
+				qs = qs.filter(Q(**{f"from_{location}_id": value}) | Q(**{f"to_{location}_id": value}))
+		if params.get("bottle_type"):
+			qs = qs.filter(bottle_type_id=params["bottle_type"])
+		if params.get("movement_type"):
+			qs = qs.filter(movement_type=params["movement_type"])
+		return qs
+
+	def create(self, request, *args, **kwargs):
+		if not _user_can_access_dashboard(request.user):
+			raise PermissionDenied("Vous n'avez pas accès aux mouvements de stock.")
+		serializer = StockTransferSerializer(data=request.data)
+		serializer.is_valid(raise_exception=True)
+		data = serializer.validated_data
+		warehouse, bus = data["warehouse"], data["bus"]
+		source, target = (warehouse, bus) if data["movement_type"] == StockMovement.TYPE_LOAD else (bus, warehouse)
+		movement = stock.transfer(
+			data["movement_type"],
+			data["bottle_type"],
+			data["quantity"],
+			source=source,
+			target=target,
+			empty=data["empty"],
+			user=request.user,
+			note=data["note"],
+			strict=True,
+		)
+		audit_writer.log(movement, ActivityLog.ACTION_CREATE, description=str(movement), user=request.user)
+		return Response(StockMovementSerializer(movement).data, status=status.HTTP_201_CREATED)
 
 
 class GeofenceZoneViewSet(AuditedModelViewSet):
@@ -706,9 +944,25 @@ class PaymentStatusHistoryViewSet(viewsets.ReadOnlyModelViewSet):
 
 
 class ActivityLogViewSet(viewsets.ReadOnlyModelViewSet):
+	"""Journal d'activité.
+
+	Filtres: model, action, user, date_from / date_to (AAAA-MM-JJ). Les mois
+	archivés (voir ``rotate_activity_logs``) ne sont lus que si l'intervalle de
+	dates demandé les recoupe.
+	"""
+
 	queryset = ActivityLog.objects.select_related("user").all().order_by("-created_at")
 	serializer_class = ActivityLogSerializer
 
+	def _date_param(self, name):
+		value = self.request.query_params.get(name) or None
+		if value is None:
+			return None
+		parsed = parse_date(value)
+		if parsed is None:
+			raise ValidationError({name: "Date invalide (format attendu: AAAA-MM-JJ)."})
+		return parsed
+
 	def get_queryset(self):
 		qs = super().get_queryset()
 		request = getattr(self, "request", None)
@@ -717,14 +971,218 @@ class ActivityLogViewSet(viewsets.ReadOnlyModelViewSet):
 		model_name = request.query_params.get("model") or None
 		action = request.query_params.get("action") or None
 		username = request.query_params.get("user") or None
+		date_from = self._date_param("date_from")
+		date_to = self._date_param("date_to")
 		if model_name:
 			qs = qs.filter(model_name__iexact=model_name)
 		if action:
 			qs = qs.filter(action=action)
 		if username:
 			qs = qs.filter(user__username__icontains=username)
+		# Bornes en datetime pour rester sur l'index created_at
+		if date_from:
+			qs = qs.filter(created_at__gte=timezone.make_aware(datetime.datetime.combine(date_from, datetime.time.min)))
+		if date_to:
+			qs = qs.filter(created_at__lt=timezone.make_aware(datetime.datetime.combine(date_to + datetime.timedelta(days=1), datetime.time.min)))
 		return qs
- 
+
+	def list(self, request, *args, **kwargs):
+		date_from = self._date_param("date_from")
+		if date_from is None:
+			# Sans borne basse, seule la partition vivante est consultée
+			return super().list(request, *args, **kwargs)
+		date_to = self._date_param("date_to")
+		archive = ActivityLogArchive()
+		months = archive.months_in_range(date_from, date_to)
+		if not months:
+			return super().list(request, *args, **kwargs)
+
+		data = list(self.get_serializer(self.filter_queryset(self.get_queryset()), many=True).data)
+		timestamp = serializers.DateTimeField()
+		params = request.query_params
+		# Les mois archivés sont tous antérieurs aux lignes vivantes: simple concaténation
+		for year, month in months:
+			for entry in archive.iter_entries(
+				year,
+				month,
+				date_from=date_from,
+				date_to=date_to,
+				model=params.get("model") or None,
+				action=params.get("action") or None,
+				username=params.get("user") or None,
+			):
+				data.append(
+					{
+						"id": entry["id"],
+						"created_at": timestamp.to_representation(entry["created_at"]),
+						"user_username": entry["user_username"],
+						"model_name": entry["model_name"],
+						"object_id": entry["object_id"],
+						"action": entry["action"],
+						"description": entry["description"],
+						"data": entry["data"],
+					}
+				)
+		return Response(data)
+
+
+class ObjectHistoryView(APIView):
+	"""Historique complet d'un objet: journal d'activité + historique de statut des paiements.
+
+	GET /api/history/{model}/{id}/?limit=50&cursor=...
+
+	Les deux flux sont lus par plage d'index (content_type, object_pk, created_at, id)
+	et (payment, created_at, id), fusionnés par date décroissante et paginés par curseur.
+	Les mois du journal archivés (``rotate_activity_logs``), tous antérieurs à la
+	première ligne vivante, forment un troisième flux lu seulement quand le
+	journal vivant ne remplit pas la page, et seulement pour les mois dont
+	l'index mentionne l'objet.
+	"""
+
+	default_limit = 50
+	max_limit = 200
+	_timestamp = serializers.DateTimeField()
+
+	def get(self, request, model, pk):
+		if not _user_can_access_dashboard(request.user):
+			raise PermissionDenied("Vous n'avez pas accès à l'historique.")
+		try:
+			model_class = apps.get_model(model) if "." in model else apps.get_model("core", model)
+		except (LookupError, ValueError):
+			raise NotFound(f"Modèle inconnu: {model}")
+		try:
+			limit = min(int(request.query_params.get("limit", self.default_limit)), self.max_limit)
+		except ValueError:
+			limit = self.default_limit
+		limit = max(limit, 1)
+
+		content_type = ContentType.objects.get_for_model(model_class)
+		live = TimelineSource(
+			kind="activity",
+			queryset=ActivityLog.objects.filter(content_type=content_type, object_pk=pk).select_related("user"),
+			to_item=self._activity_item,
+		)
+		sources = [live]
+		archive = ActivityLogArchive()
+		if archive.months():
+			sources.append(
+				ArchivedTimelineSource(
+					kind="activity",
+					entries=self._archived_entries(archive, model_class._meta.label, pk),
+					to_item=self._archived_item,
+					follows=live,
+				)
+			)
+		if model_class is Payment:
+			sources.append(
+				TimelineSource(
+					kind="status",
+					queryset=PaymentStatusHistory.objects.filter(payment_id=pk).select_related("changed_by"),
+					to_item=self._status_item,
+				)
+			)
+
+		items, next_cursor = merge_page(sources, limit, request.query_params.get("cursor") or None)
+		next_url = None
+		if next_cursor:
+			next_url = replace_query_param(request.build_absolute_uri(), "cursor", next_cursor)
+		return Response(
+			{
+				"model": model_class._meta.label,
+				"object_id": pk,
+				"next": next_url,
+				"results": items,
+			}
+		)
+
+	def _activity_item(self, log):
+		return {
+			"type": "activity",
+			"id": log.id,
+			"created_at": self._timestamp.to_representation(log.created_at),
+			"user_username": log.user.username if log.user else None,
+			"action": log.action,
+			"description": log.description,
+			"data": log.data,
+		}
+
+	@staticmethod
+	def _archived_entries(archive, label: str, pk):
+		"""Entrées archivées de l'objet, des mois entièrement antérieurs au journal vivant (pas de doublon).
+
+		Générateur paresseux: les mois sont ouverts un à un, seulement si leur
+		index peut contenir l'objet.
+		"""
+
+		def entries(before, accept, newest):
+			live_start = ActivityLog.objects.order_by("created_at").values_list("created_at", flat=True).first()
+			for year, month in archive.months_before(live_start):
+				if before is not None and month_start(year, month) > before:
+					continue
+				yield from archive.iter_entries(year, month, model=label, object_id=pk, accept=accept, newest=newest)
+
+		return entries
+
+	def _archived_item(self, entry):
+		return {
+			"type": "activity",
+			"id": entry["id"],
+			"created_at": self._timestamp.to_representation(entry["created_at"]),
+			"user_username": entry["user_username"],
+			"action": entry["action"],
+			"description": entry["description"],
+			"data": entry["data"],
+		}
+
+	def _status_item(self, history):
+		return {
+			"type": "status",
+			"id": history.id,
+			"created_at": self._timestamp.to_representation(history.created_at),
+			"user_username": history.changed_by.username if history.changed_by else None,
+			"previous_status": history.previous_status,
+			"new_status": history.new_status,
+			"note": history.note,
+		}
+
+
+class PaymentReceiptView(APIView):
+	"""Téléchargement protégé d'un reçu de paiement.
+
+	GET /api/receipts/{payment_id}/?variant=original|display|thumbnail
+
+	Réservé au client propriétaire du paiement et aux utilisateurs du back-office.
+	Le transfert est délégué au serveur frontal si configuré (voir core.sendfile).
+	"""
+
+	def get(self, request, pk):
+		payment = Payment.objects.select_related("client").filter(pk=pk).first()
+		if payment is None or not payment.receipt_image:
+			raise NotFound("Reçu introuvable.")
+		user = request.user
+		if payment.client.user_id != user.id and not _user_can_access_dashboard(user):
+			raise PermissionDenied("Vous n'avez pas accès à ce reçu.")
+
+		variant = request.query_params.get("variant", receipts.VARIANT_ORIGINAL)
+		if variant not in receipts.VARIANT_FIELDS:
+			raise ValidationError({"variant": f"Valeurs possibles: {', '.join(receipts.VARIANT_FIELDS)}."})
+		receipt = receipts.variant_file(payment, variant)
+		try:
+			path = receipt.path
+		except (NotImplementedError, ValueError):
+			raise NotFound("Reçu introuvable.")
+		if not os.path.exists(path):
+			raise NotFound("Reçu introuvable.")
+
+		# Les reçus sont nommés par empreinte: une URL versionnée (v=) ne change jamais de contenu
+		cache_control = "private, max-age=3600"
+		etag = None
+		if payment.receipt_sha256 and getattr(payment, receipts.VARIANT_FIELDS[variant]):
+			etag = f"{payment.receipt_sha256}-{variant}"
+			if request.query_params.get("v") == payment.receipt_sha256[:16]:
+				cache_control = "private, max-age=31536000, immutable"
+		return serve_file(request, path, receipt.name, etag=etag, cache_control=cache_control)
+
 
 def _user_can_access_dashboard(user):
 	"""Droit pour utiliser le back-office Rimgaz (AdminLTE), sans ouvrir Django admin.
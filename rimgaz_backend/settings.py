@@ -53,6 +53,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.audit.AuditBatchMiddleware',
 ]
 
 ROOT_URLCONF = 'rimgaz_backend.urls'
@@ -125,6 +126,10 @@ STATIC_URL = 'static/'
 MEDIA_URL = '/media/'
 MEDIA_ROOT = BASE_DIR / 'media'
 
+# Fichiers privés (reçus de paiement): hors MEDIA_ROOT, jamais publiés sous
+# MEDIA_URL, servis uniquement par les vues contrôlant l'accès (core.sendfile)
+PROTECTED_MEDIA_ROOT = BASE_DIR / 'protected_media'
+
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 # Auth redirects
@@ -143,3 +148,69 @@ REST_FRAMEWORK = {
     ],
 }
 
+
+# Journal d'activité: écriture groupée au commit, mode asynchrone optionnel
+# (perte bornée à AUDIT_LOG_BUFFER_SIZE entrées / AUDIT_LOG_FLUSH_INTERVAL secondes)
+AUDIT_LOG_ASYNC = False
+AUDIT_LOG_FLUSH_INTERVAL = 2.0
+AUDIT_LOG_BUFFER_SIZE = 500
+
+# Archives mensuelles du journal d'activité (commande rotate_activity_logs)
+ACTIVITY_LOG_ARCHIVE_DIR = BASE_DIR / 'var' / 'activity_logs'
+ACTIVITY_LOG_RETENTION_MONTHS = 3
+
+# Reçus de paiement: taille maximale et génération des variantes (affichage /
+# miniature) dans un thread de fond après le commit
+RECEIPT_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+RECEIPT_VARIANTS_ASYNC = True
+
+# Fichiers protégés (reçus): délégation du transfert au serveur frontal.
+# None: Django diffuse lui-même (Range / requêtes conditionnelles gérés).
+# "x-accel" (nginx): location /protected-media/ { internal; alias <PROTECTED_MEDIA_ROOT>/; }
+# "x-sendfile" (Apache mod_xsendfile, lighttpd)
+SENDFILE_BACKEND = None
+SENDFILE_URL_PREFIX = '/protected-media/'
+
+# Classement des retards de paiement (commande classify_late_clients, à planifier)
+LATE_PAYMENT_THRESHOLD_MRU = 0
+LATE_PAYMENT_GRACE_DAYS = 7
+
+# Inventaire agrégé (api/inventory/): invalidé à chaque écriture de stock, durée
+# maximale en cache par sécurité. Avec plusieurs processus, configurer un cache
+# partagé (CACHES, Redis / Memcached) pour que l'invalidation les atteigne tous.
+INVENTORY_CACHE_TIMEOUT = 300
+
+# Durée de conservation des réponses rejouables (en-tête Idempotency-Key, secondes)
+IDEMPOTENCY_KEY_TTL = 24 * 3600
+
+# Optimisation d'itinéraire des tournées: temps de calcul maximal (secondes)
+ROUTE_OPTIMIZATION_TIME_BUDGET = 2.0
+# Planification automatique (commande plan_tours): budget partagé entre les tournées
+TOUR_PLANNING_TIME_BUDGET = 10.0
+
+# Commande validée en cours de journée: ajout automatique à la tournée active
+# la moins déviée (au plus AUTO_INSERT_MAX_DETOUR_KM de détour)
+AUTO_INSERT_VALIDATED_ORDERS = True
+AUTO_INSERT_MAX_DETOUR_KM = 15
+
+# Détection d'arrivée chez le client à partir des positions GPS du bus: présence
+# d'au moins ARRIVAL_MIN_DWELL_SECONDS à moins de ARRIVAL_RADIUS_M de l'arrêt.
+# Au départ, l'arrêt est pointé visité (ARRIVAL_AUTO_COMPLETE) ou proposé au chauffeur.
+ARRIVAL_RADIUS_M = 60
+ARRIVAL_MIN_DWELL_SECONDS = 120
+ARRIVAL_AUTO_COMPLETE = False
+# La présence en cours est tenue en base (TourProgress), commune à tous les processus;
+# seul l'index des arrêts est en cache, reconstruit dès que la tournée change, ce qui
+# convient aussi au cache local par processus. Durée de vie de l'index (secondes):
+ARRIVAL_INDEX_TIMEOUT = 600
+
+# Matrice persistante des distances clients / dépôts (float32, projetée en mémoire),
+# tenue à jour à chaque déplacement; reconstruction: commande build_distance_matrix.
+# None pour la désactiver (distances recalculées à chaque besoin).
+DISTANCE_MATRIX_DIR = BASE_DIR / 'var' / 'distances'
+# Nombre maximal de clients + dépôts dans la matrice (fichier dense: MAX² x 4 octets,
+# 256 Mio pour 8192); au-delà, les nouveaux points sont calculés à la demande.
+DISTANCE_MATRIX_MAX_NODES = 8192
+
+# File du chauffeur sans tournée du jour: rayon autour du bus (km)
+DRIVER_QUEUE_RADIUS_KM = 25
@@ -29,8 +29,10 @@ from core.views import (
     BusViewSet,
     DriverViewSet,
     TourViewSet,
+    TourStopViewSet,
     BusPositionViewSet,
     WalletViewSet,
+    WalletEntryViewSet,
     PaymentViewSet,
     PaymentStatusHistoryViewSet,
     GasBottleTypeViewSet,
@@ -64,6 +66,11 @@ from core.views import (
     ClientPaymentViewSet,
     ClientOrderViewSet,
     DriverOrderViewSet,
+    ObjectHistoryView,
+    PaymentReceiptView,
+    StockMovementViewSet,
+    ClientStatementView,
+    InventoryView,
 )
         
 from core.auth_api import RimgazTokenObtainPairView
@@ -74,8 +81,10 @@ router.register(r"clients", ClientViewSet)
 router.register(r"buses", BusViewSet)
 router.register(r"drivers", DriverViewSet)
 router.register(r"tours", TourViewSet)
+router.register(r"tours/(?P<tour_pk>\d+)/stops", TourStopViewSet, basename="tour-stops")
 router.register(r"bus-positions", BusPositionViewSet, basename="bus-positions")
 router.register(r"wallets", WalletViewSet, basename="wallets")
+router.register(r"wallet-entries", WalletEntryViewSet, basename="wallet-entries")
 router.register(r"payments", PaymentViewSet, basename="payments")
 router.register(r"payment-status-history", PaymentStatusHistoryViewSet, basename="payment-status-history")
 router.register(r"bottle-types", GasBottleTypeViewSet, basename="bottle-types")
@@ -85,6 +94,7 @@ router.register(r"bus-alerts", BusAlertViewSet, basename="bus-alerts")
 router.register(r"warehouses", WarehouseViewSet, basename="warehouses")
 router.register(r"warehouse-stocks", WarehouseBottleStockViewSet, basename="warehouse-stocks")
 router.register(r"bus-stocks", BusBottleStockViewSet, basename="bus-stocks")
+router.register(r"stock-movements", StockMovementViewSet, basename="stock-movements")
 router.register(r"activity-logs", ActivityLogViewSet, basename="activity-logs")
 router.register(r"client-payments", ClientPaymentViewSet, basename="client-payments")
 router.register(r"driver-orders", DriverOrderViewSet, basename="driver-orders")
@@ -116,6 +126,10 @@ urlpatterns = [
     path("dashboard/users/", dashboard_users, name="dashboard-users"),
     path("api/token/", RimgazTokenObtainPairView.as_view(), name="token_obtain_pair"),
     path("api/token/refresh/", TokenRefreshView.as_view(), name="token_refresh"),
+    path("api/history/<str:model>/<int:pk>/", ObjectHistoryView.as_view(), name="object-history"),
+    path("api/receipts/<int:pk>/", PaymentReceiptView.as_view(), name="payment-receipt"),
+    path("api/client-statement/", ClientStatementView.as_view(), name="client-statement"),
+    path("api/inventory/", InventoryView.as_view(), name="inventory"),
     path("api/", include(router.urls)),
 ]
 
@@ -1,4 +1,5 @@
 import 'dart:convert';
+import 'dart:math';
 
 import 'package:http/http.dart' as http;
 
@@ -36,6 +37,15 @@ class ApiClient {
     return headers;
   }
 
+  static final Random _random = Random.secure();
+
+  /// Clé envoyée dans l'en-tête Idempotency-Key: un nouvel envoi de la même
+  /// requête (réponse perdue) renvoie la réponse d'origine sans doublon.
+  static String newIdempotencyKey() {
+    final bytes = List<int>.generate(16, (_) => _random.nextInt(256));
+    return bytes.map((b) => b.toRadixString(16).padLeft(2, '0')).join();
+  }
+
   Future<bool> _refreshTokensIfNeeded() async {
     if (_refreshToken == null) return false;
     try {
@@ -121,8 +131,10 @@ class ApiClient {
     required double longitude,
     double? speedKmh,
     String status = 'on_tour',
+    String? idempotencyKey,
   }) async {
     final uri = Uri.parse('$baseUrl/api/bus-positions/');
+    final key = idempotencyKey ?? newIdempotencyKey();
     final body = <String, dynamic>{
       'bus': busId,
       'latitude': latitude,
@@ -136,7 +148,7 @@ class ApiClient {
     final res = await _sendWithAutoRefresh(
       (headers) => _client.post(
         uri,
-        headers: headers,
+        headers: {...headers, 'Idempotency-Key': key},
         body: jsonEncode(body),
       ),
     );
@@ -191,8 +203,11 @@ class ApiClient {
   }
 
   Future<void> createClientPayment(
-      {required double amountMru, String? method}) async {
+      {required double amountMru,
+      String? method,
+      String? idempotencyKey}) async {
     final uri = Uri.parse('$baseUrl/api/client-payments/');
+    final key = idempotencyKey ?? newIdempotencyKey();
     final body = <String, dynamic>{
       'amount_mru': amountMru,
     };
@@ -203,7 +218,7 @@ class ApiClient {
     final res = await _sendWithAutoRefresh(
       (headers) => _client.post(
         uri,
-        headers: headers,
+        headers: {...headers, 'Idempotency-Key': key},
         body: jsonEncode(body),
       ),
     );
@@ -238,8 +253,24 @@ class ApiClient {
     return jsonDecode(res.body) as List<dynamic>;
   }
 
-  Future<List<dynamic>> fetchDriverOrders() async {
-    final uri = Uri.parse('$baseUrl/api/driver-orders/');
+  /// Commandes à livrer, de la plus proche à la plus lointaine.
+  /// Sans latitude / longitude, le serveur part de la dernière position du bus.
+  Future<List<dynamic>> fetchDriverOrders({
+    double? latitude,
+    double? longitude,
+    int limit = 50,
+    int offset = 0,
+  }) async {
+    final params = <String, String>{
+      'limit': '$limit',
+      'offset': '$offset',
+    };
+    if (latitude != null && longitude != null) {
+      params['lat'] = '$latitude';
+      params['lon'] = '$longitude';
+    }
+    final uri = Uri.parse('$baseUrl/api/driver-orders/')
+        .replace(queryParameters: params);
     final res = await _sendWithAutoRefresh(
       (headers) => _client.get(uri, headers: headers),
     );
@@ -247,7 +278,8 @@ class ApiClient {
       throw Exception(
           'Erreur ${res.statusCode} chargement commandes chauffeur');
     }
-    return jsonDecode(res.body) as List<dynamic>;
+    final data = jsonDecode(res.body) as Map<String, dynamic>;
+    return data['results'] as List<dynamic>;
   }
 
   Future<List<dynamic>> fetchClientPayments() async {
@@ -261,11 +293,26 @@ class ApiClient {
     return jsonDecode(res.body) as List<dynamic>;
   }
 
+  /// Relevé de compte (commandes, paiements, écritures, passages) en une requête.
+  /// Passer l'URL `next` de la réponse précédente pour charger la page suivante.
+  Future<Map<String, dynamic>> fetchClientStatement({String? next}) async {
+    final uri = Uri.parse(next ?? '$baseUrl/api/client-statement/');
+    final res = await _sendWithAutoRefresh(
+      (headers) => _client.get(uri, headers: headers),
+    );
+    if (res.statusCode != 200) {
+      throw Exception('Erreur ${res.statusCode} chargement relevé de compte');
+    }
+    return jsonDecode(res.body) as Map<String, dynamic>;
+  }
+
   Future<void> createClientOrder({
     required int bottleTypeId,
     required int quantity,
+    String? idempotencyKey,
   }) async {
     final uri = Uri.parse('$baseUrl/api/client-orders/');
+    final key = idempotencyKey ?? newIdempotencyKey();
     final body = {
       'bottle_type_id': bottleTypeId,
       'quantity': quantity,
@@ -273,7 +320,7 @@ class ApiClient {
     final res = await _sendWithAutoRefresh(
       (headers) => _client.post(
         uri,
-        headers: headers,
+        headers: {...headers, 'Idempotency-Key': key},
         body: jsonEncode(body),
       ),
     );
@@ -301,6 +348,77 @@ class ApiClient {
     return jsonDecode(res.body) as Map<String, dynamic>;
   }
 
+  /// Envoie en une requête les livraisons confirmées hors ligne.
+  /// Chaque événement: order_id, delivered_at (ISO 8601), returned_bottles,
+  /// latitude / longitude optionnelles. Retourne un résultat par événement
+  /// (ok, duplicate, conflict, not_found, error): les événements ok / duplicate
+  /// peuvent être retirés de la file locale, les événements error renvoyés.
+  Future<List<dynamic>> syncDeliveries(
+      List<Map<String, dynamic>> deliveries) async {
+    final uri = Uri.parse('$baseUrl/api/driver-orders/sync/');
+    final res = await _sendWithAutoRefresh(
+      (headers) => _client.post(
+        uri,
+        headers: headers,
+        body: jsonEncode(<String, dynamic>{'deliveries': deliveries}),
+      ),
+    );
+    if (res.statusCode != 200) {
+      throw Exception(
+          'Erreur ${res.statusCode} lors de la synchronisation des livraisons');
+    }
+    final data = jsonDecode(res.body) as Map<String, dynamic>;
+    return data['results'] as List<dynamic>;
+  }
+
+  /// Arrêts de la tournée, dans l'ordre de visite.
+  Future<List<dynamic>> fetchTourStops(int tourId) async {
+    final uri = Uri.parse('$baseUrl/api/tours/$tourId/stops/');
+    final res = await _sendWithAutoRefresh(
+      (headers) => _client.get(uri, headers: headers),
+    );
+    if (res.statusCode != 200) {
+      throw Exception('Erreur ${res.statusCode} chargement arrêts tournée');
+    }
+    return jsonDecode(res.body) as List<dynamic>;
+  }
+
+  /// Pointe plusieurs arrêts en une requête: chaque entrée porte `id`,
+  /// `status` et éventuellement `delivered_bottles` / `returned_bottles`.
+  /// Retourne un résultat par arrêt (ok, conflict ou not_found).
+  Future<List<dynamic>> updateTourStopsStatus(
+      int tourId, List<Map<String, dynamic>> stops) async {
+    final uri = Uri.parse('$baseUrl/api/tours/$tourId/stops/status/');
+    final res = await _sendWithAutoRefresh(
+      (headers) => _client.post(
+        uri,
+        headers: headers,
+        body: jsonEncode(<String, dynamic>{'stops': stops}),
+      ),
+    );
+    if (res.statusCode != 200) {
+      throw Exception('Erreur ${res.statusCode} mise à jour arrêts tournée');
+    }
+    final data = jsonDecode(res.body) as Map<String, dynamic>;
+    return data['results'] as List<dynamic>;
+  }
+
+  /// Fil du chauffeur (nouveaux arrêts ajoutés à sa tournée), du plus récent
+  /// au plus ancien. Passer le plus grand id déjà reçu dans [after].
+  Future<List<dynamic>> fetchDriverNotifications({int? after}) async {
+    final uri = Uri.parse('$baseUrl/api/driver-orders/notifications/').replace(
+      queryParameters: after != null ? {'after': '$after'} : null,
+    );
+    final res = await _sendWithAutoRefresh(
+      (headers) => _client.get(uri, headers: headers),
+    );
+    if (res.statusCode != 200) {
+      throw Exception(
+          'Erreur ${res.statusCode} chargement notifications chauffeur');
+    }
+    return jsonDecode(res.body) as List<dynamic>;
+  }
+
   Future<void> uploadClientPaymentReceipt({
     required int paymentId,
     required String filePath,